@@ -1,16 +1,125 @@
 from django.contrib import admin
-from .models import Vehiculo, UsuarioSistema, Reserva
-from django import forms
-from .models import UsuarioSistema
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
+from .models import Empresa, HorarioOperacion, DiaNoOperativo, Vehiculo, UsuarioSistema, Reserva
+
+
+def estimar_filas(model, using='default'):
+    """
+    Número aproximado de filas de la tabla del modelo, leído de las estadísticas del
+    motor sin recorrer la tabla. Retorna None si el motor no ofrece una estimación.
+    """
+    connection = connections[using]
+    tabla = model._meta.db_table
+    consultas = {
+        'postgresql': ("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)", [tabla]),
+        'mysql': ("SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s", [tabla]),
+        # En SQLite MAX(rowid) se resuelve con el B-tree (no recorre la tabla); sobreestima si hubo borrados
+        'sqlite': (f"SELECT MAX(rowid) FROM {connection.ops.quote_name(tabla)}", []),
+    }
+    if connection.vendor not in consultas:
+        return None
+    sql, params = consultas[connection.vendor]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            fila = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if not fila or fila[0] is None or fila[0] < 0: # reltuples es -1 en tablas nunca analizadas
+        return None
+    return int(fila[0])
+
+
+class PaginadorConteoEstimado(Paginator):
+    """
+    Paginador del admin para tablas grandes: en el listado sin filtros ni búsqueda
+    usa la estimación del motor en lugar de COUNT(*). Con filtros, o si la tabla
+    tiene menos de UMBRAL filas, cuenta de forma exacta.
+    """
+    UMBRAL = 20_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, 'query') and not queryset.query.where:
+            estimado = estimar_filas(queryset.model, queryset.db)
+            if estimado is not None and estimado >= self.UMBRAL:
+                return estimado
+        return super().count
+
+
+def filtro_empresa(campo, titulo="Empresa"):
+    """
+    Filtro lateral por empresa sobre 'campo' (ruta hasta la FK a Empresa, ej: 'vehiculo__empresa').
+    Las opciones salen de Empresa.opciones() (en caché), no de un DISTINCT sobre la tabla filtrada.
+    """
+    class FiltroEmpresa(admin.SimpleListFilter):
+        title = titulo
+        parameter_name = campo # El admin solo acepta parámetros que sean rutas de relaciones o filtros declarados
+
+        def lookups(self, request, model_admin):
+            return Empresa.opciones()
+
+        def queryset(self, request, queryset):
+            if self.value():
+                return queryset.filter(**{f"{campo}_id": self.value()})
+            return queryset
+
+    FiltroEmpresa.__name__ = f"FiltroEmpresa_{campo}"
+    return FiltroEmpresa
+
+
+class FiltroMarcaVehiculo(admin.SimpleListFilter):
+    """Marca del vehículo de la reserva; las opciones salen de la tabla de vehículos, no de las reservas."""
+    title = "Marca"
+    parameter_name = 'vehiculo__marca'
+
+    def lookups(self, request, model_admin):
+        marcas = Vehiculo.objects.order_by('marca').values_list('marca', flat=True).distinct()
+        return [(marca, marca) for marca in marcas]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(vehiculo__marca=self.value())
+        return queryset
+
+
+class HorarioOperacionInline(admin.TabularInline):
+    model = HorarioOperacion
+    extra = 0
+
+
+@admin.register(Empresa)
+class EmpresaAdmin(admin.ModelAdmin):
+    """
+    Configuración del panel de administración para el modelo Empresa.
+    Sin horarios la empresa opera todos los días en el horario por defecto.
+    """
+    list_display = ('razon_social', 'razon_social2', 'rut')
+    search_fields = ('razon_social', 'razon_social2', 'rut')
+    ordering = ('razon_social',)
+    inlines = (HorarioOperacionInline,)
+
+@admin.register(DiaNoOperativo)
+class DiaNoOperativoAdmin(admin.ModelAdmin):
+    list_display = ('fecha', 'descripcion', 'empresa')
+    list_filter = (filtro_empresa('empresa'),)
+    list_select_related = ('empresa',)
+    autocomplete_fields = ('empresa',)
+    date_hierarchy = 'fecha'
+    ordering = ('-fecha',)
 
 @admin.register(Vehiculo)
 class VehiculoAdmin(admin.ModelAdmin):
     """
     Configuración del panel de administración para el modelo Vehiculo.
     """
-    list_display = ('patente', 'marca', 'modelo', 'tipo_vehiculo', 'razon_social', 'rut', 'estado')
-    search_fields = ('patente', 'marca', 'modelo', 'razon_social', 'rut')
-    list_filter = ('marca', 'modelo', 'tipo_vehiculo', 'razon_social', 'estado')
+    list_display = ('patente', 'marca', 'modelo', 'tipo_vehiculo', 'empresa', 'estado')
+    search_fields = ('patente', 'marca', 'modelo', 'empresa__razon_social', 'empresa__rut')
+    list_filter = ('marca', 'modelo', 'tipo_vehiculo', filtro_empresa('empresa'), 'estado')
+    autocomplete_fields = ('empresa',)
     ordering = ('marca', 'modelo', 'patente')
     # raw_id_fields = () # Para campos ForeignKey o ManyToManyField con muchas opciones
 
@@ -19,7 +128,7 @@ class VehiculoAdmin(admin.ModelAdmin):
             'fields': ('patente', 'marca', 'modelo', 'tipo_vehiculo')
         }),
         ('Empresa Propietaria', {
-            'fields': ('razon_social', 'razon_social2', 'rut')
+            'fields': ('empresa',)
         }),
         ('Detalles Adicionales', {
             'fields': ('tipo_transmision', 'estado'),
@@ -27,53 +136,28 @@ class VehiculoAdmin(admin.ModelAdmin):
         }),
     )
 
-class UsuarioSistemaAdminForm(forms.ModelForm):
-    class Meta:
-        model = UsuarioSistema
-        fields = '__all__'
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        # Razón Social Empresa Asignada (únicos, no nulos ni vacíos)
-        razones = UsuarioSistema.objects.values_list('razon_social_empresa', flat=True).distinct()
-        razones_unicas = sorted(set(r for r in razones if r))
-        self.fields['razon_social_empresa'] = forms.ChoiceField(
-            choices=[('', '---------')] + [(r, r) for r in razones_unicas],
-            required=True,
-            label="Razón Social Empresa Asignada"
-        )
-        # Razón Social Secundaria Empresa (únicos, no nulos ni vacíos)
-        razones2 = UsuarioSistema.objects.values_list('razon_social2_empresa', flat=True).distinct()
-        razones2_unicas = sorted(set(r for r in razones2 if r))
-        self.fields['razon_social2_empresa'] = forms.ChoiceField(
-            choices=[('', '---------')] + [(r, r) for r in razones2_unicas],
-            required=False,
-            label="Razón Social Secundaria Empresa"
-        )
-        # RUT Empresa Asignada (únicos, no nulos ni vacíos)
-        ruts = UsuarioSistema.objects.values_list('rut_empresa', flat=True).distinct()
-        ruts_unicos = sorted(set(r for r in ruts if r))
-        self.fields['rut_empresa'] = forms.ChoiceField(
-            choices=[('', '---------')] + [(r, r) for r in ruts_unicos],
-            required=True,
-            label="RUT Empresa Asignada"
-        )
+    def get_queryset(self, request):
+        # __str__ incluye la empresa (ej: resultados del autocompletado de Reserva). Con un select_related
+        # ya aplicado el listado ignora list_select_related, por eso el join se declara solo aquí
+        return super().get_queryset(request).select_related('empresa')
 
 @admin.register(UsuarioSistema)
 class UsuarioSistemaAdmin(admin.ModelAdmin):
-    form = UsuarioSistemaAdminForm
-    list_display = ('nombre_usuario_completo', 'user_email', 'razon_social_empresa', 'rut_empresa', 'ciudad')
-    search_fields = ('nombre_usuario_completo', 'user__username', 'user__email', 'razon_social_empresa', 'rut_empresa')
-    list_filter = ('razon_social_empresa', 'ciudad')
+    list_display = ('nombre_usuario_completo', 'user_email', 'empresa', 'ciudad')
+    search_fields = ('nombre_usuario_completo', 'user__username', 'user__email', 'empresa__razon_social', 'empresa__rut')
+    list_filter = (filtro_empresa('empresa'), 'ciudad')
     ordering = ('nombre_usuario_completo',)
     raw_id_fields = ('user',)
+    autocomplete_fields = ('empresa',)
+    paginator = PaginadorConteoEstimado
+    show_full_result_count = False # Evita un COUNT(*) extra de toda la tabla al filtrar
 
     fieldsets = (
         ('Información del Usuario', {
             'fields': ('user', 'nombre_usuario_completo')
         }),
         ('Información de la Empresa Asignada', {
-            'fields': ('razon_social_empresa', 'razon_social2_empresa', 'rut_empresa', 'ciudad')
+            'fields': ('empresa', 'ciudad')
         }),
     )
 
@@ -82,6 +166,10 @@ class UsuarioSistemaAdmin(admin.ModelAdmin):
     user_email.short_description = 'Email Usuario Django'
     user_email.admin_order_field = 'user__email'
 
+    def get_queryset(self, request):
+        # user_email y __str__ (autocompletado de Reserva) usan user y empresa; reemplaza a list_select_related
+        return super().get_queryset(request).select_related('user', 'empresa')
+
 @admin.register(Reserva)
 class ReservaAdmin(admin.ModelAdmin):
     """
@@ -93,10 +181,19 @@ class ReservaAdmin(admin.ModelAdmin):
         'usuario__nombre_usuario_completo', 'usuario__user__username',
         'fecha_reserva'
     )
-    list_filter = ('fecha_reserva', 'vehiculo__razon_social', 'vehiculo__marca', 'usuario__razon_social_empresa')
+    # fecha_reserva usa DateFieldListFilter (hoy, últimos 7 días, este mes, ...): rangos sobre el índice,
+    # sin el SELECT DISTINCT de fechas sobre toda la tabla que hace date_hierarchy
+    list_filter = (
+        'fecha_reserva',
+        filtro_empresa('vehiculo__empresa', "Empresa del vehículo"),
+        FiltroMarcaVehiculo,
+        filtro_empresa('usuario__empresa', "Empresa del usuario"),
+    )
+    list_select_related = ('vehiculo', 'usuario')
     ordering = ('-fecha_reserva', '-hora_inicio_reserva')
-    date_hierarchy = 'fecha_reserva' # Permite navegar por fechas
-    # raw_id_fields = ('vehiculo', 'usuario')
+    autocomplete_fields = ('vehiculo', 'usuario')
+    paginator = PaginadorConteoEstimado
+    show_full_result_count = False # Evita un COUNT(*) extra de toda la tabla al filtrar
 
     fieldsets = (
         (None, {
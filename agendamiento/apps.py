@@ -4,4 +4,8 @@ class AgendamientoConfig(AppConfig):
     name = 'agendamiento'
 
     def ready(self):
-        import agendamiento.signals
\ No newline at end of file
+        import agendamiento.signals
+        import agendamiento.checks
+        from django.db.backends.signals import connection_created
+        from . import metricas
+        connection_created.connect(metricas.instalar_en_conexion)
\ No newline at end of file
@@ -0,0 +1,105 @@
+# agendamiento/asgi_eventos.py
+"""
+Aplicación ASGI que sirve los flujos de eventos_disponibilidad fuera del
+manejador de Django (ver proyecto_agendamiento/asgi.py).
+
+ASGIHandler atiende cada solicitud dentro de un ThreadSensitiveContext: lo
+síncrono de la solicitud (sesión, usuario, perfil) corre en un hilo propio de
+esa solicitud, que vive hasta que se cierra la respuesta. En un flujo de
+eventos eso es un hilo por conexión abierta. Aquí la sesión, el usuario y el
+perfil se resuelven antes de abrir el flujo, en el hilo compartido de
+sync_to_async, y el flujo abierto es solo una corrutina y su cola.
+
+Lo que no termina en un flujo abierto (otra URL, método distinto de GET, fecha
+inválida, usuario anónimo o sin empresa) pasa tal cual a la aplicación de
+Django, que responde como siempre.
+"""
+import asyncio
+import io
+from datetime import date
+from functools import partial
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import aget_user
+from django.core.handlers.asgi import ASGIRequest
+from django.core import signals
+from django.urls import Resolver404, resolve
+
+from .perfiles import aperfil_sistema
+from .views import eventos_disponibilidad_view, flujo_eventos
+
+
+ENCABEZADOS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'), # Que nginx no acumule el flujo
+]
+
+
+async def _esperar_desconexion(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class ConEventosDisponibilidad:
+    """Envuelve la aplicación ASGI de Django y atiende los flujos de eventos de disponibilidad."""
+
+    def __init__(self, aplicacion):
+        self.aplicacion = aplicacion
+
+    async def __call__(self, scope, receive, send):
+        flujo = await self._abrir(scope) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+        if flujo is None:
+            return await self.aplicacion(scope, receive, send)
+        await self._transmitir(flujo, receive, send)
+
+    async def _abrir(self, scope):
+        """Generador de eventos de la solicitud, o None si debe responderla Django."""
+        ruta = scope['path'].removeprefix(scope.get('root_path', '')) or '/'
+        try:
+            coincidencia = resolve(ruta)
+        except Resolver404:
+            return None
+        if coincidencia.func is not eventos_disponibilidad_view:
+            return None
+        try:
+            fecha = date.fromisoformat(coincidencia.kwargs['fecha_str'])
+        except ValueError:
+            return None
+
+        request = ASGIRequest(scope, io.BytesIO())
+        motor = import_module(settings.SESSION_ENGINE)
+        request.session = motor.SessionStore(request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+        request.auser = partial(aget_user, request)
+        # Como en ASGIHandler: request_finished cierra las conexiones a la BD del hilo (respeta CONN_MAX_AGE)
+        await sync_to_async(signals.request_started.send)(sender=self.__class__, scope=scope)
+        try:
+            perfil = await aperfil_sistema(request)
+        finally:
+            await sync_to_async(signals.request_finished.send)(sender=self.__class__)
+        if perfil is None or perfil.empresa_id is None:
+            return None
+        return flujo_eventos(perfil.empresa_id, fecha, perfil.id, reconexion=request.headers.get('Last-Event-ID') is not None)
+
+    async def _transmitir(self, flujo, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': ENCABEZADOS})
+
+        async def enviar():
+            async for trozo in flujo:
+                await send({'type': 'http.response.body', 'body': trozo.encode(), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+        envio = asyncio.ensure_future(enviar())
+        desconexion = asyncio.ensure_future(_esperar_desconexion(receive))
+        try:
+            await asyncio.wait({envio, desconexion}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Cancelar el envío cierra el generador, que anula la suscripción (ver flujo_eventos)
+            for tarea in (envio, desconexion):
+                tarea.cancel()
+            await asyncio.gather(envio, desconexion, return_exceptions=True)
+            await flujo.aclose()
+        if envio.done() and not envio.cancelled() and envio.exception() is not None:
+            raise envio.exception()
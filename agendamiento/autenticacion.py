@@ -0,0 +1,125 @@
+# agendamiento/autenticacion.py
+"""
+Backend de autenticación que carga el usuario junto con su perfil
+(UsuarioSistema) y la empresa del perfil en una sola consulta, y lo guarda en
+caché (ver settings.AUTHENTICATION_BACKENDS).
+
+En cada solicitud con sesión iniciada, AuthenticationMiddleware le pide el
+usuario al backend (get_user/aget_user). Con ModelBackend eso es una consulta
+por el User, otra por user.perfil_sistema en la vista y otra por la empresa que
+muestra base.html. Aquí es una consulta con JOIN la primera vez y, mientras el
+usuario siga en la caché, solo la de su contraseña por clave primaria.
+
+En la caché el User va sin 'password' ni 'last_login' (quedan diferidos): la
+contraseña no sale de la base de datos, y como Django compara el hash de sesión
+con el de la contraseña recién leída, un cambio de contraseña cierra la sesión
+en la solicitud siguiente aunque el usuario siga en la caché.
+
+Las señales (signals.py) borran la entrada cuando se guarda o borra el User o su
+perfil (desde el admin o desde cualquier otro lado) y, al editar una Empresa, las
+de sus usuarios. Cada login también la borra (user_logged_in): cada sesión nueva
+empieza con el usuario y el perfil recién leídos.
+
+Esas señales solo borran la entrada en todos los procesos si la caché es
+compartida (ver caches.py). Con una caché local a cada proceso, otro worker
+seguiría autenticando a un usuario desactivado hasta que expirara su entrada:
+en ese caso no se usa la caché, y cada solicitud hace la consulta con JOIN.
+El timeout (AGENDAMIENTO_CACHE_PERFILES_TIMEOUT) acota además lo que dura una
+invalidación perdida.
+"""
+import copy
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import transaction
+
+from .caches import es_compartida
+from .models import UsuarioSistema
+
+
+def _alias():
+    return getattr(settings, 'AGENDAMIENTO_CACHE_PERFILES_ALIAS', 'default')
+
+
+def _cache():
+    return caches[_alias()]
+
+
+def activa():
+    """La caché de perfiles solo se usa si todos los procesos ven sus invalidaciones."""
+    return es_compartida(_alias())
+
+
+# La contraseña no se guarda en la caché, y last_login quedaría desfasado
+CAMPOS_FUERA_DE_CACHE = ('password', 'last_login')
+
+
+def _clave(user_id):
+    return f"perfil:usuario:{user_id}"
+
+
+def _timeout():
+    return getattr(settings, 'AGENDAMIENTO_CACHE_PERFILES_TIMEOUT', 60)
+
+
+def _para_cache(user):
+    # copy.copy pasa por Model.__getstate__: copia __dict__ y las relaciones cargadas (perfil y empresa).
+    # Un campo que falta en __dict__ queda diferido y se lee de la BD si se usa.
+    copia = copy.copy(user)
+    for campo in CAMPOS_FUERA_DE_CACHE:
+        copia.__dict__.pop(campo, None)
+    return copia
+
+
+def _usuarios():
+    # perfil_sistema se llena también si el usuario no tiene perfil: hasattr() no vuelve a consultar
+    return get_user_model()._default_manager.select_related('perfil_sistema__empresa')
+
+
+class BackendConPerfil(ModelBackend):
+    """ModelBackend con get_user()/aget_user() en una consulta, y en caché si es compartida."""
+
+    def get_user(self, user_id):
+        en_cache = activa()
+        user = _cache().get(_clave(user_id)) if en_cache else None
+        if user is None:
+            try:
+                user = _usuarios().get(pk=user_id)
+            except get_user_model().DoesNotExist:
+                return None
+            if en_cache:
+                _cache().set(_clave(user_id), _para_cache(user), _timeout())
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        en_cache = activa()
+        user = await _cache().aget(_clave(user_id)) if en_cache else None
+        if user is None:
+            try:
+                user = await _usuarios().aget(pk=user_id)
+            except get_user_model().DoesNotExist:
+                return None
+            if en_cache:
+                await _cache().aset(_clave(user_id), _para_cache(user), _timeout())
+        return user if self.user_can_authenticate(user) else None
+
+
+def _borrar(user_ids):
+    _cache().delete_many([_clave(user_id) for user_id in user_ids])
+
+
+# Como en cache_disponibilidad: se borra de inmediato y otra vez al confirmar la transacción,
+# por si otra solicitud volvió a guardar el usuario sin los cambios aún no confirmados
+
+def invalidar_usuario(user_id):
+    _borrar([user_id])
+    transaction.on_commit(lambda: _borrar([user_id]))
+
+
+def invalidar_empresa(empresa_id):
+    user_ids = list(UsuarioSistema.objects.filter(empresa_id=empresa_id).values_list('user_id', flat=True))
+    if user_ids:
+        _borrar(user_ids)
+        transaction.on_commit(lambda: _borrar(user_ids))
@@ -0,0 +1,215 @@
+# agendamiento/cache_disponibilidad.py
+"""
+Caché de la ocupación diaria por (empresa, fecha) delante de cargar_ocupacion_dia().
+
+Se guarda solo la parte de la grilla que no depende del usuario (vehículos y
+{vehiculo_id: {hora_inicio: usuario_id}}), así una misma entrada sirve a todos
+los usuarios de la empresa. Funciona con cualquier backend de caché de Django
+(local-memory, file-based, ...): el tamaño se acota con un índice LRU propio
+porque no todos los backends desalojan por uso reciente.
+
+Cada (empresa, fecha) tiene además un sello de versión (ver version()) que
+cambia con cada invalidación; las vistas lo usan como ETag/Last-Modified para
+responder 304 sin consultar las reservas (ver condicional.py). El sello solo
+sirve para eso si el alias es compartido por todos los procesos: con una caché
+local al proceso, una reserva atendida por otro worker no lo cambiaría aquí,
+y condicional.py no responde 304. Sellos y generaciones expiran
+(timeout_version); si se pierden se crean otros, que a lo más invalidan de más.
+
+La invalidación la hacen las señales de Reserva y Vehiculo (ver signals.py), y
+solo llega a todos los procesos si el alias es compartido (ver caches.py). Con
+una caché local a cada proceso, los demás workers seguirían sirviendo la grilla
+vieja (y las filas de fragmentos.py, que se arman con sus máscaras) hasta que
+expirara la entrada: ahí las entradas duran a lo más timeout_local segundos, lo
+justo para absorber ráfagas de solicitudes del mismo día.
+Los métodos con prefijo 'a' (aobtener, aversion) son para las vistas async.
+"""
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+from django.db import transaction
+from django.utils import timezone
+
+from .caches import es_compartida
+from .disponibilidad import acargar_ocupacion_dia, cargar_ocupacion_dia
+from .enrutador import leyendo_de_replica, primaria_fijada, ventana_fijacion
+
+
+class CacheDisponibilidad:
+    """
+    Caché LRU acotada de la ocupación por (empresa, fecha), con contadores
+    de aciertos y fallos.
+    """
+
+    def __init__(self, alias='disponibilidad', max_entradas=512, timeout=300, timeout_version=3600, timeout_local=5):
+        self.alias = alias
+        self.max_entradas = max_entradas
+        self.timeout = timeout
+        self.timeout_local = timeout_local
+        self.timeout_version = timeout_version
+        self.aciertos = 0
+        self.fallos = 0
+        self._claves = OrderedDict() # Orden de uso de las claves guardadas por este proceso
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        # Se resuelve en cada uso para respetar cambios de settings (ej: override_settings en tests)
+        try:
+            return caches[self.alias]
+        except InvalidCacheBackendError:
+            return caches['default']
+
+    def _clave_generacion(self, empresa_id):
+        return f"disponibilidad:gen:{empresa_id}"
+
+    def _generacion(self, empresa_id):
+        # Si la generación se desalojó se crea otra al azar (nunca se vuelve a un valor anterior,
+        # lo que revivería entradas o sellos viejos); si otro proceso se adelantó, add no la pisa
+        clave = self._clave_generacion(empresa_id)
+        generacion = self.cache.get(clave)
+        if generacion is None:
+            self.cache.add(clave, uuid.uuid4().hex, self.timeout_version)
+            generacion = self.cache.get(clave)
+        return generacion
+
+    async def _ageneracion(self, empresa_id):
+        clave = self._clave_generacion(empresa_id)
+        generacion = await self.cache.aget(clave)
+        if generacion is None:
+            await self.cache.aadd(clave, uuid.uuid4().hex, self.timeout_version)
+            generacion = await self.cache.aget(clave)
+        return generacion
+
+    def _clave(self, empresa_id, fecha, generacion=None):
+        # La generación de la empresa permite invalidar todas sus fechas de una vez
+        generacion = generacion or self._generacion(empresa_id)
+        return f"disponibilidad:{empresa_id}:{generacion}:{fecha.isoformat()}"
+
+    def _clave_version(self, empresa_id, fecha, generacion=None):
+        generacion = generacion or self._generacion(empresa_id)
+        return f"disponibilidad:version:{empresa_id}:{generacion}:{fecha.isoformat()}"
+
+    def version(self, empresa_id, fecha):
+        """
+        Sello (id, instante) de la ocupación del (empresa, fecha): cambia cada vez que se
+        invalida el día o la empresa. Si se perdió de la caché se crea uno nuevo, así que a lo
+        más cambia de más, nunca de menos.
+        """
+        clave = self._clave_version(empresa_id, fecha)
+        sello = self.cache.get(clave)
+        if sello is None:
+            self.cache.add(clave, (uuid.uuid4().hex, timezone.now()), self.timeout_version)
+            sello = self.cache.get(clave)
+        return sello
+
+    async def aversion(self, empresa_id, fecha):
+        clave = self._clave_version(empresa_id, fecha, await self._ageneracion(empresa_id))
+        sello = await self.cache.aget(clave)
+        if sello is None:
+            await self.cache.aadd(clave, (uuid.uuid4().hex, timezone.now()), self.timeout_version)
+            sello = await self.cache.aget(clave)
+        return sello
+
+    def _acierto(self, clave):
+        with self._lock:
+            self.aciertos += 1
+            if clave in self._claves:
+                self._claves.move_to_end(clave)
+
+    def _timeout(self):
+        # Con una caché local al proceso, las invalidaciones de otros workers no llegan aquí
+        timeout = self.timeout if es_compartida(self.alias) else min(self.timeout, self.timeout_local)
+        # Lo leído de una réplica puede venir atrasado: no se guarda más allá de lo que puede durar el atraso
+        return min(timeout, ventana_fijacion()) if leyendo_de_replica() else timeout
+
+    def _fallo(self, clave):
+        """Registra la clave recién guardada; retorna las claves a desalojar."""
+        with self._lock:
+            self.fallos += 1
+            self._claves[clave] = None
+            self._claves.move_to_end(clave)
+            desalojadas = []
+            while len(self._claves) > self.max_entradas:
+                desalojadas.append(self._claves.popitem(last=False)[0])
+        return desalojadas
+
+    def obtener(self, empresa_id, fecha):
+        """Retorna (vehiculos, reservas_por_vehiculo) desde la caché o la base de datos."""
+        clave = self._clave(empresa_id, fecha)
+        # Con la sesión fijada a la primaria no se lee la caché: pudo llenarse desde una réplica atrasada
+        datos = None if primaria_fijada() else self.cache.get(clave)
+        if datos is not None:
+            self._acierto(clave)
+            return datos
+
+        datos = cargar_ocupacion_dia(empresa_id, fecha)
+        self.cache.set(clave, datos, self._timeout())
+        desalojadas = self._fallo(clave)
+        if desalojadas:
+            self.cache.delete_many(desalojadas)
+        return datos
+
+    async def aobtener(self, empresa_id, fecha):
+        """Versión async de obtener()."""
+        clave = self._clave(empresa_id, fecha, await self._ageneracion(empresa_id))
+        datos = None if primaria_fijada() else await self.cache.aget(clave)
+        if datos is not None:
+            self._acierto(clave)
+            return datos
+
+        datos = await acargar_ocupacion_dia(empresa_id, fecha)
+        await self.cache.aset(clave, datos, self._timeout())
+        desalojadas = self._fallo(clave)
+        if desalojadas:
+            await self.cache.adelete_many(desalojadas)
+        return datos
+
+    def _borrar_dia(self, empresa_id, fecha):
+        clave = self._clave(empresa_id, fecha)
+        self.cache.delete(clave)
+        self.cache.set(self._clave_version(empresa_id, fecha), (uuid.uuid4().hex, timezone.now()), self.timeout_version)
+        with self._lock:
+            self._claves.pop(clave, None)
+
+    def _rotar_generacion(self, empresa_id):
+        # Las entradas anteriores quedan inalcanzables y las desaloja el LRU o el timeout.
+        # Un valor nuevo cualquiera basta; no hace falta un incr atómico entre procesos.
+        self.cache.set(self._clave_generacion(empresa_id), uuid.uuid4().hex, self.timeout_version)
+
+    # Las invalidaciones se aplican de inmediato y otra vez al confirmar la transacción:
+    # entre ambos momentos otra petición podría haber vuelto a llenar la caché con datos
+    # aún sin confirmar. Fuera de una transacción on_commit ejecuta en el acto.
+
+    def invalidar_dia(self, empresa_id, fecha):
+        self._borrar_dia(empresa_id, fecha)
+        transaction.on_commit(lambda: self._borrar_dia(empresa_id, fecha))
+
+    def invalidar_empresa(self, empresa_id):
+        self._rotar_generacion(empresa_id)
+        transaction.on_commit(lambda: self._rotar_generacion(empresa_id))
+
+    def limpiar(self):
+        """Vacía la caché (se asume un alias dedicado) y reinicia los contadores."""
+        self.cache.clear()
+        with self._lock:
+            self._claves.clear()
+            self.aciertos = 0
+            self.fallos = 0
+
+    def estadisticas(self):
+        with self._lock:
+            return {'aciertos': self.aciertos, 'fallos': self.fallos, 'entradas': len(self._claves)}
+
+
+cache_disponibilidad = CacheDisponibilidad(
+    alias=getattr(settings, 'AGENDAMIENTO_CACHE_DISPONIBILIDAD_ALIAS', 'disponibilidad'),
+    max_entradas=getattr(settings, 'AGENDAMIENTO_CACHE_DISPONIBILIDAD_MAX_ENTRADAS', 512),
+    timeout=getattr(settings, 'AGENDAMIENTO_CACHE_DISPONIBILIDAD_TIMEOUT', 300),
+    timeout_version=getattr(settings, 'AGENDAMIENTO_CACHE_DISPONIBILIDAD_VERSION_TIMEOUT', 3600),
+    timeout_local=getattr(settings, 'AGENDAMIENTO_CACHE_DISPONIBILIDAD_TIMEOUT_LOCAL', 5),
+)
@@ -0,0 +1,26 @@
+# agendamiento/caches.py
+"""
+Qué alias de caché comparten todos los procesos.
+
+LocMemCache y DummyCache viven en la memoria de cada proceso: con varios
+workers (ver proyecto_agendamiento/asgi.py), lo que una señal borra o rota en
+un proceso no se ve en los demás. Lo que necesita que una invalidación llegue a
+todos los procesos se activa solo con un backend compartido (Redis, Memcached,
+base de datos, archivos); ver checks.py.
+"""
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.base import InvalidCacheBackendError
+
+
+BACKENDS_LOCALES = (LocMemCache, DummyCache)
+
+
+def es_compartida(alias):
+    """True si el alias (o 'default' si no existe, como en cache_disponibilidad) no es local al proceso."""
+    try:
+        backend = caches[alias]
+    except InvalidCacheBackendError:
+        backend = caches['default']
+    return not isinstance(backend, BACKENDS_LOCALES)
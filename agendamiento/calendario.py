@@ -0,0 +1,224 @@
+# agendamiento/calendario.py
+"""
+Calendarios de operación por empresa, compilados en tablas de bloques.
+
+Cada conjunto de horas se compila una sola vez (por proceso) en una
+TablaBloques inmutable con todo lo que las vistas y el formulario de reserva
+muestran de un bloque: horas de inicio y fin, etiquetas, claves, ids de
+checkbox y el bit del bloque en las máscaras de OcupacionVehiculoDia. Las
+vistas solo leen la tabla; no formatean horas por celda.
+
+El calendario de una empresa (tabla por día de la semana + días no
+operativos) se compila al primer uso y se guarda en memoria junto con su
+versión, que vive en la caché por defecto. Las señales de HorarioOperacion y
+DiaNoOperativo rotan la versión, y cada proceso recompila el calendario la
+próxima vez que lo usa.
+
+Solo si CACHES['default'] es compartido (ver caches.py) la versión rotada la
+ven todos los procesos de inmediato. Con una caché local al proceso (la de
+settings.py) solo la ve el proceso que atendió el cambio; los demás recompilan
+cuando su versión expira, a lo más AGENDAMIENTO_CALENDARIO_VERSION_TIMEOUT_LOCAL
+segundos después (manage.py check --deploy lo advierte). Con caché compartida
+las versiones también expiran (AGENDAMIENTO_CALENDARIO_VERSION_TIMEOUT), por si
+alguna invalidación se perdiera.
+"""
+import threading
+import uuid
+from dataclasses import dataclass
+from datetime import time
+from functools import lru_cache
+from types import MappingProxyType
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from .caches import es_compartida
+from .models import HorarioOperacion, DiaNoOperativo
+
+
+# Horario por defecto de las empresas sin HorarioOperacion: 8 AM a 6 PM (último bloque a las 5 PM)
+HORARIOS_OPERACION = [time(h) for h in range(8, 18)]
+
+
+@dataclass(frozen=True)
+class Bloque:
+    """Un bloque de reserva de una hora con sus textos ya formateados."""
+    inicio: time
+    fin: time
+    clave: str        # '08:00:00': clave de la grilla y valor del checkbox
+    hora: str         # '08:00'
+    etiqueta: str     # '08:00 - 09:00'
+    id_checkbox: str  # 'id_bloque_080000'
+    bit: int          # 1 << 8, como en OcupacionVehiculoDia
+
+
+@dataclass(frozen=True)
+class TablaBloques:
+    """Bloques de un día en orden, con índices por clave y la máscara de todos sus bits."""
+    bloques: tuple
+    por_clave: MappingProxyType
+    mascara: int
+
+    def __iter__(self):
+        return iter(self.bloques)
+
+    def __len__(self):
+        return len(self.bloques)
+
+    def __bool__(self):
+        return bool(self.bloques)
+
+    def horas(self):
+        return [bloque.inicio for bloque in self.bloques]
+
+    def libres(self, mascara_ocupada):
+        """Bloques cuyo bit no está en 'mascara_ocupada'."""
+        return [bloque for bloque in self.bloques if not mascara_ocupada & bloque.bit]
+
+
+@lru_cache(maxsize=None)
+def compilar_tabla(horas):
+    """TablaBloques de una tupla ordenada de horas de inicio (enteros 0-23); una por tupla distinta."""
+    bloques = tuple(
+        Bloque(
+            inicio=time(h), fin=time(h + 1) if h < 23 else time(0),
+            clave=f"{h:02d}:00:00", hora=f"{h:02d}:00",
+            etiqueta=f"{h:02d}:00 - {(h + 1) % 24:02d}:00",
+            id_checkbox=f"id_bloque_{h:02d}0000", bit=1 << h,
+        )
+        for h in horas
+    )
+    mascara = 0
+    for bloque in bloques:
+        mascara |= bloque.bit
+    return TablaBloques(bloques=bloques, por_clave=MappingProxyType({b.clave: b for b in bloques}), mascara=mascara)
+
+
+TABLA_VACIA = compilar_tabla(())
+TABLA_POR_DEFECTO = compilar_tabla(tuple(hora.hour for hora in HORARIOS_OPERACION))
+
+
+@dataclass(frozen=True)
+class CalendarioEmpresa:
+    """Tabla de bloques por día de la semana (lunes = 0) y fechas en que no se opera."""
+    tablas_por_dia: tuple
+    dias_no_operativos: frozenset = frozenset()
+
+    def tabla_para(self, fecha):
+        if fecha in self.dias_no_operativos:
+            return TABLA_VACIA
+        return self.tablas_por_dia[fecha.weekday()]
+
+
+CALENDARIO_POR_DEFECTO = CalendarioEmpresa(tablas_por_dia=(TABLA_POR_DEFECTO,) * 7)
+
+
+def compilar_calendario(empresa_id):
+    """Lee los horarios y días no operativos de la empresa (dos consultas) y arma su CalendarioEmpresa."""
+    horas_por_dia = [set() for _ in range(7)]
+    rangos = HorarioOperacion.objects.filter(empresa_id=empresa_id).values_list('dia_semana', 'hora_apertura', 'hora_cierre')
+    for dia_semana, apertura, cierre in rangos:
+        horas_por_dia[dia_semana].update(range(apertura.hour, cierre.hour))
+    if any(horas_por_dia):
+        tablas = tuple(compilar_tabla(tuple(sorted(horas))) for horas in horas_por_dia)
+    else:
+        tablas = CALENDARIO_POR_DEFECTO.tablas_por_dia
+
+    dias_no_operativos = frozenset(
+        DiaNoOperativo.objects.filter(Q(empresa_id=empresa_id) | Q(empresa__isnull=True)).values_list('fecha', flat=True)
+    )
+    return CalendarioEmpresa(tablas_por_dia=tablas, dias_no_operativos=dias_no_operativos)
+
+
+def _timeout_version():
+    if es_compartida('default'):
+        return getattr(settings, 'AGENDAMIENTO_CALENDARIO_VERSION_TIMEOUT', 3600)
+    return getattr(settings, 'AGENDAMIENTO_CALENDARIO_VERSION_TIMEOUT_LOCAL', 60)
+
+
+class Calendarios:
+    """Calendarios compilados por empresa, en memoria del proceso y validados contra su versión en la caché."""
+    CLAVE_VERSION = 'agendamiento:calendario:version:{}'
+    GLOBAL = 'global' # Versión de los días no operativos de todas las empresas
+
+    def __init__(self):
+        self._compilados = {} # {empresa_id: (versiones, CalendarioEmpresa)}
+        self._lock = threading.Lock()
+
+    def _claves_version(self, empresa_id):
+        return [self.CLAVE_VERSION.format(self.GLOBAL), self.CLAVE_VERSION.format(empresa_id)]
+
+    def versiones(self, empresa_id):
+        """Versiones (global, de la empresa) del calendario; cambian con cada invalidación."""
+        claves = self._claves_version(empresa_id)
+        versiones = cache.get_many(claves)
+        if len(versiones) < len(claves):
+            # Sin versión (primer uso o desalojada): se crea una; si otro proceso se adelantó, add no la pisa
+            for clave in claves:
+                if clave not in versiones:
+                    cache.add(clave, uuid.uuid4().hex, _timeout_version())
+            versiones = cache.get_many(claves)
+        return tuple(versiones.get(clave) for clave in claves)
+
+    async def aversiones(self, empresa_id):
+        claves = self._claves_version(empresa_id)
+        versiones = await cache.aget_many(claves)
+        if len(versiones) < len(claves):
+            for clave in claves:
+                if clave not in versiones:
+                    await cache.aadd(clave, uuid.uuid4().hex, _timeout_version())
+            versiones = await cache.aget_many(claves)
+        return tuple(versiones.get(clave) for clave in claves)
+
+    def _compilado(self, empresa_id, versiones):
+        compilado = self._compilados.get(empresa_id)
+        if compilado is not None and compilado[0] == versiones:
+            return compilado[1]
+        return None
+
+    def _guardar(self, empresa_id, versiones, calendario):
+        with self._lock:
+            self._compilados[empresa_id] = (versiones, calendario)
+        return calendario
+
+    def de_empresa(self, empresa_id):
+        """CalendarioEmpresa de la empresa; solo consulta la base de datos si el calendario cambió."""
+        if empresa_id is None:
+            return CALENDARIO_POR_DEFECTO
+        versiones = self.versiones(empresa_id)
+        return self._compilado(empresa_id, versiones) or self._guardar(empresa_id, versiones, compilar_calendario(empresa_id))
+
+    async def ade_empresa(self, empresa_id):
+        """Versión async de de_empresa(); la compilación (poco frecuente) corre en un hilo."""
+        if empresa_id is None:
+            return CALENDARIO_POR_DEFECTO
+        versiones = await self.aversiones(empresa_id)
+        calendario = self._compilado(empresa_id, versiones)
+        if calendario is None:
+            calendario = self._guardar(empresa_id, versiones, await sync_to_async(compilar_calendario)(empresa_id))
+        return calendario
+
+    def tabla(self, empresa_id, fecha):
+        return self.de_empresa(empresa_id).tabla_para(fecha)
+
+    async def atabla(self, empresa_id, fecha):
+        return (await self.ade_empresa(empresa_id)).tabla_para(fecha)
+
+    def _rotar_version(self, empresa_id):
+        cache.set(self.CLAVE_VERSION.format(self.GLOBAL if empresa_id is None else empresa_id), uuid.uuid4().hex, _timeout_version())
+
+    def invalidar(self, empresa_id):
+        """Invalida el calendario de la empresa (None: el de todas). De inmediato y otra vez al confirmar."""
+        self._rotar_version(empresa_id)
+        transaction.on_commit(lambda: self._rotar_version(empresa_id))
+
+    def limpiar(self):
+        """Descarta los calendarios compilados de este proceso."""
+        with self._lock:
+            self._compilados.clear()
+
+
+calendarios = Calendarios()
@@ -0,0 +1,49 @@
+# agendamiento/checks.py
+"""Verificaciones de sistema (manage.py check) de la configuración de cachés de agendamiento."""
+from django.conf import settings
+from django.core import checks
+
+from .caches import es_compartida
+from .condicional import caches_compartidas
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def revisar_cache_por_defecto(app_configs, **kwargs):
+    alias = getattr(settings, 'AGENDAMIENTO_CACHE_DISPONIBILIDAD_ALIAS', 'disponibilidad')
+    locales = [nombre for nombre in ('default', alias) if not es_compartida(nombre)]
+    if not locales:
+        return []
+    efectos = []
+    if 'default' in locales:
+        efectos.append(
+            "un cambio de HorarioOperacion o DiaNoOperativo tarda hasta "
+            f"{getattr(settings, 'AGENDAMIENTO_CALENDARIO_VERSION_TIMEOUT_LOCAL', 60)} s en verse en los demás procesos, "
+            "y usuario, perfil y empresa se consultan en cada solicitud (sin caché de perfiles)"
+        )
+    if alias in locales:
+        efectos.append(
+            "la grilla de disponibilidad se guarda solo "
+            f"{getattr(settings, 'AGENDAMIENTO_CACHE_DISPONIBILIDAD_TIMEOUT_LOCAL', 5)} s (las reservas atendidas por "
+            "otro worker no la invalidan en este) y se consulta más seguido la base de datos"
+        )
+    return [checks.Warning(
+        f"Cachés locales a cada proceso: {', '.join(f'CACHES[{nombre!r}]' for nombre in locales)}.",
+        hint=f"Con varios workers, {'; '.join(efectos)}. Use un backend compartido (Redis, Memcached).",
+        id='agendamiento.W001',
+    )]
+
+
+@checks.register(checks.Tags.caches)
+def revisar_respuestas_condicionales(app_configs, **kwargs):
+    if getattr(settings, 'AGENDAMIENTO_RESPUESTAS_CONDICIONALES', None) is not True or caches_compartidas():
+        return []
+    return [checks.Error(
+        "AGENDAMIENTO_RESPUESTAS_CONDICIONALES = True con una caché local a cada proceso.",
+        hint=(
+            "Una reserva atendida por un worker no cambia el ETag en los demás, que seguirían respondiendo 304 "
+            "con la grilla vieja. Use un backend compartido en CACHES['default'] y "
+            f"CACHES['{getattr(settings, 'AGENDAMIENTO_CACHE_DISPONIBILIDAD_ALIAS', 'disponibilidad')}'], "
+            "o deje el valor en None."
+        ),
+        id='agendamiento.E002',
+    )]
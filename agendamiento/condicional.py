@@ -0,0 +1,144 @@
+# agendamiento/condicional.py
+"""
+ETag y Last-Modified de las páginas de disponibilidad y de reserva, para
+responder 304 Not Modified (ver django.views.decorators.http.condition).
+
+El ETag se arma con el sello de versión del (empresa, fecha) de
+cache_disponibilidad, las versiones del calendario de la empresa y lo que de
+la página depende del usuario (perfil, secreto CSRF). Calcularlo solo lee la
+caché y el perfil del usuario: si el navegador ya tiene la página, no se
+consultan las reservas ni se renderiza la plantilla.
+
+Los sellos y las versiones del calendario solo cambian en todos los procesos
+si sus cachés son compartidas (ver caches.py). Por eso las respuestas 304 se
+activan solo con cachés compartidas, o si AGENDAMIENTO_RESPUESTAS_CONDICIONALES
+es True; checks.py rechaza forzarlas con cachés locales al proceso.
+
+En vistas async las funciones de sello también son async (ver respuesta_condicional).
+"""
+import hashlib
+from datetime import date
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib import messages
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .cache_disponibilidad import cache_disponibilidad
+from .caches import es_compartida
+from .calendario import calendarios
+from .enrutador import leyendo_de_replica, ventana_fijacion
+from .models import Vehiculo
+from .perfiles import aperfil_sistema
+
+
+def caches_compartidas():
+    return es_compartida(cache_disponibilidad.alias) and es_compartida('default')
+
+
+def activas():
+    """AGENDAMIENTO_RESPUESTAS_CONDICIONALES; si es None (por defecto), solo con cachés compartidas."""
+    valor = getattr(settings, 'AGENDAMIENTO_RESPUESTAS_CONDICIONALES', None)
+    return caches_compartidas() if valor is None else valor
+
+
+def _hay_mensajes(request):
+    # Con mensajes pendientes la página debe renderizarse para mostrarlos (y consumirlos)
+    return len(messages.get_messages(request)) > 0
+
+
+def _firmar(request, prefijo, empresa_id, fecha, version, versiones_calendario, *partes):
+    texto = '|'.join(map(str, (
+        prefijo, empresa_id, fecha.isoformat(), version, *versiones_calendario,
+        request.META.get('CSRF_COOKIE', ''), *partes,
+    )))
+    return hashlib.blake2b(texto.encode(), digest_size=16).hexdigest()
+
+
+def _fecha(request, fecha_str):
+    # Solo GET/HEAD: un POST siempre se procesa y su respuesta no lleva ETag
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    try:
+        return date.fromisoformat(fecha_str)
+    except ValueError:
+        return None # La vista responde 404
+
+
+async def sello_disponibilidad(request, fecha_str):
+    """(etag, last_modified) de mostrar_disponibilidad, o None si no aplica una respuesta condicional."""
+    fecha = _fecha(request, fecha_str)
+    perfil = await aperfil_sistema(request) if fecha else None
+    if perfil is None or perfil.empresa_id is None:
+        return None
+    # La sesión ya se cargó (async) al obtener el usuario: leer los mensajes no consulta la BD
+    if _hay_mensajes(request):
+        return None
+    version, modificado = await cache_disponibilidad.aversion(perfil.empresa_id, fecha)
+    if leyendo_de_replica() and (timezone.now() - modificado).total_seconds() < ventana_fijacion():
+        return None # Cambio reciente: la réplica podría no tenerlo, no fijar en el navegador una página atrasada
+    versiones_calendario = await calendarios.aversiones(perfil.empresa_id)
+    etag = _firmar(request, 'disponibilidad', perfil.empresa_id, fecha, version, versiones_calendario, perfil.id)
+    return etag, modificado
+
+
+def sello_reserva(request, vehiculo_id, fecha_str):
+    """(etag, last_modified) de reservar_vehiculo, o None si no aplica una respuesta condicional."""
+    fecha = _fecha(request, fecha_str)
+    perfil = getattr(request.user, 'perfil_sistema', None) if fecha else None
+    if perfil is None or _hay_mensajes(request):
+        return None
+    empresa_id = Vehiculo.objects.filter(id=vehiculo_id).values_list('empresa_id', flat=True).first()
+    if empresa_id is None or empresa_id != perfil.empresa_id:
+        return None # Vehículo inexistente o de otra empresa: la vista responde 404 o redirige
+    version, modificado = cache_disponibilidad.version(empresa_id, fecha)
+    # El vehículo cambia la página; la fecha de hoy decide si la fecha ya pasó
+    etag = _firmar(request, 'reserva', empresa_id, fecha, version, calendarios.versiones(empresa_id),
+                   perfil.id, vehiculo_id, timezone.localdate())
+    return etag, modificado
+
+
+def _responder(request, sello):
+    """Respuesta 304/412 si corresponde, o None para ejecutar la vista."""
+    if sello is None:
+        return None
+    etag, modificado = sello
+    return get_conditional_response(request, etag=quote_etag(etag), last_modified=int(modificado.timestamp()))
+
+
+def _agregar_encabezados(request, response, sello):
+    if sello is not None and request.method in ('GET', 'HEAD'):
+        etag, modificado = sello
+        response.headers.setdefault('ETag', quote_etag(etag))
+        response.headers.setdefault('Last-Modified', http_date(int(modificado.timestamp())))
+    return response
+
+
+def respuesta_condicional(funcion_sello):
+    """
+    Como django.views.decorators.http.condition, con una sola función que retorna
+    (etag, last_modified) o None. Para una vista async, 'funcion_sello' debe ser async:
+    condition() llama a sus funciones de forma síncrona dentro del event loop.
+    """
+    def decorador(vista):
+        if iscoroutinefunction(vista):
+            @wraps(vista)
+            async def interna(request, *args, **kwargs):
+                sello = await funcion_sello(request, *args, **kwargs) if activas() else None
+                response = _responder(request, sello)
+                if response is None:
+                    response = await vista(request, *args, **kwargs)
+                return _agregar_encabezados(request, response, sello)
+        else:
+            @wraps(vista)
+            def interna(request, *args, **kwargs):
+                sello = funcion_sello(request, *args, **kwargs) if activas() else None
+                response = _responder(request, sello)
+                if response is None:
+                    response = vista(request, *args, **kwargs)
+                return _agregar_encabezados(request, response, sello)
+        return interna
+    return decorador
@@ -0,0 +1,151 @@
+# agendamiento/disponibilidad.py
+from collections import defaultdict
+
+from .calendario import HORARIOS_OPERACION, TABLA_POR_DEFECTO
+from .models import Vehiculo, Reserva, OcupacionVehiculoDia
+
+# Máximo de días que se pueden consultar de una vez en la API de rango
+MAX_DIAS_RANGO = 31
+
+# vehiculo_id con que se invierte la URL de reservar_vehiculo una vez por página; luego se
+# reemplaza por el de cada vehículo. No puede confundirse con otra parte de la URL (como '0')
+VEHICULO_MARCADOR = 987654321
+
+
+def _vehiculos_activos(empresa_id):
+    return Vehiculo.objects.filter(empresa_id=empresa_id, estado='Activo').order_by('marca', 'modelo')
+
+
+def _reservas_dia(empresa_id, fecha):
+    # Se filtra por la empresa vía JOIN en lugar de pasar la lista de ids,
+    # así la consulta no crece con el tamaño de la flota.
+    return Reserva.objects.filter(
+        vehiculo__empresa_id=empresa_id,
+        vehiculo__estado='Activo',
+        fecha_reserva=fecha,
+    ).order_by().values_list('vehiculo_id', 'hora_inicio_reserva', 'usuario_id')
+
+
+def cargar_ocupacion_dia(empresa_id, fecha):
+    """
+    Carga los vehículos activos de una empresa y las reservas del día en un
+    número fijo de consultas (una para vehículos y una para reservas),
+    sin importar el tamaño de la flota.
+
+    Retorna (vehiculos, reservas_por_vehiculo), donde reservas_por_vehiculo es
+    {vehiculo_id: {hora_inicio: usuario_id}}.
+    """
+    vehiculos = list(_vehiculos_activos(empresa_id))
+    if not vehiculos:
+        return vehiculos, {}
+
+    reservas_por_vehiculo = defaultdict(dict)
+    for vehiculo_id, hora_inicio, usuario_id in _reservas_dia(empresa_id, fecha):
+        reservas_por_vehiculo[vehiculo_id][hora_inicio] = usuario_id
+    return vehiculos, dict(reservas_por_vehiculo)
+
+
+async def acargar_ocupacion_dia(empresa_id, fecha):
+    """Versión async de cargar_ocupacion_dia(), con las mismas dos consultas."""
+    vehiculos = [vehiculo async for vehiculo in _vehiculos_activos(empresa_id)]
+    if not vehiculos:
+        return vehiculos, {}
+
+    reservas_por_vehiculo = defaultdict(dict)
+    async for vehiculo_id, hora_inicio, usuario_id in _reservas_dia(empresa_id, fecha):
+        reservas_por_vehiculo[vehiculo_id][hora_inicio] = usuario_id
+    return vehiculos, dict(reservas_por_vehiculo)
+
+
+def _celda(bloque, disponible, reservado_por_mi, texto_reserva, clase, url=''):
+    return {
+        'display': bloque.etiqueta,
+        'disponible': disponible,
+        'reservado_por_mi': reservado_por_mi,
+        'texto_reserva': texto_reserva,
+        'hora_inicio_obj': bloque.inicio, # para el form
+        'hora': bloque.hora,  # data-hora de la celda (la usan los eventos de la grilla)
+        'clase': clase,
+        'url': url,           # Enlace a reservar_vehiculo; vacío si el bloque no está disponible
+    }
+
+
+def construir_grilla_disponibilidad(vehiculos, reservas_por_vehiculo, usuario_id, tabla=TABLA_POR_DEFECTO, url_reserva=''):
+    """
+    Arma la estructura que consume 'mostrar_disponibilidad.html' a partir de los
+    datos de cargar_ocupacion_dia() y la TablaBloques del día (ver calendario.py).
+    No realiza consultas: "reservado por mí" se resuelve comparando ids enteros
+    en lugar de cargar la FK usuario.
+
+    Cada celda trae ya su clase CSS y su enlace, para que la plantilla no invierta
+    URLs ni aplique filtros por bloque. 'url_reserva' es la URL de reservar_vehiculo
+    invertida una sola vez con vehiculo_id=VEHICULO_MARCADOR; aquí se completa por
+    vehículo y bloque.
+    """
+    antes, _, despues = url_reserva.rpartition(f"/{VEHICULO_MARCADOR}/")
+    # Las celdas reservadas son iguales en todas las filas: se comparten entre vehículos
+    reservadas = {
+        bloque.clave: (_celda(bloque, False, False, "Reservado", 'bloque-reservado'),
+                       _celda(bloque, False, True, "Reservado por ti", 'bloque-reservado-por-mi'))
+        for bloque in tabla.bloques
+    }
+    disponibilidad_data = {}
+    for vehiculo in vehiculos:
+        horas_reservadas_vehiculo = reservas_por_vehiculo.get(vehiculo.id, {})
+        url_vehiculo = f"{antes}/{vehiculo.id}/{despues}?hora_inicio="
+        horarios_vehiculo = {}
+
+        for bloque in tabla.bloques:
+            usuario_reserva_id = horas_reservadas_vehiculo.get(bloque.inicio)
+            if usuario_reserva_id is not None:
+                horarios_vehiculo[bloque.clave] = reservadas[bloque.clave][usuario_reserva_id == usuario_id]
+            else:
+                horarios_vehiculo[bloque.clave] = _celda(bloque, True, False, "Disponible", 'bloque-disponible',
+                                                         url_vehiculo + bloque.clave)
+
+        disponibilidad_data[vehiculo.id] = {
+            'vehiculo': vehiculo,
+            'horarios': horarios_vehiculo
+        }
+    return disponibilidad_data
+
+
+def _reservas_rango(empresa_id, desde, hasta):
+    return Reserva.objects.filter(
+        vehiculo__empresa_id=empresa_id,
+        vehiculo__estado='Activo',
+        fecha_reserva__range=(desde, hasta),
+    ).order_by().values_list('vehiculo_id', 'fecha_reserva', 'hora_inicio_reserva')
+
+
+def cargar_ocupacion_rango(empresa_id, desde, hasta):
+    """
+    Carga la ocupación de los vehículos activos de una empresa entre 'desde' y
+    'hasta' (inclusive) con una sola consulta de rango sobre Reserva.
+
+    Retorna (vehiculos, ocupacion_por_vehiculo), donde ocupacion_por_vehiculo es
+    {vehiculo_id: [mascara_dia_0, mascara_dia_1, ...]} y en cada máscara el bit N
+    indica que el bloque que empieza a la hora N está reservado.
+    """
+    vehiculos = list(_vehiculos_activos(empresa_id))
+    dias = (hasta - desde).days + 1
+    ocupacion_por_vehiculo = {vehiculo.id: [0] * dias for vehiculo in vehiculos}
+    if not vehiculos:
+        return vehiculos, ocupacion_por_vehiculo
+
+    for vehiculo_id, fecha, hora_inicio in _reservas_rango(empresa_id, desde, hasta):
+        ocupacion_por_vehiculo[vehiculo_id][(fecha - desde).days] |= OcupacionVehiculoDia.bit_de_hora(hora_inicio)
+    return vehiculos, ocupacion_por_vehiculo
+
+
+async def acargar_ocupacion_rango(empresa_id, desde, hasta):
+    """Versión async de cargar_ocupacion_rango()."""
+    vehiculos = [vehiculo async for vehiculo in _vehiculos_activos(empresa_id)]
+    dias = (hasta - desde).days + 1
+    ocupacion_por_vehiculo = {vehiculo.id: [0] * dias for vehiculo in vehiculos}
+    if not vehiculos:
+        return vehiculos, ocupacion_por_vehiculo
+
+    async for vehiculo_id, fecha, hora_inicio in _reservas_rango(empresa_id, desde, hasta):
+        ocupacion_por_vehiculo[vehiculo_id][(fecha - desde).days] |= OcupacionVehiculoDia.bit_de_hora(hora_inicio)
+    return vehiculos, ocupacion_por_vehiculo
@@ -0,0 +1,112 @@
+# agendamiento/enrutador.py
+"""
+Lecturas de las vistas de disponibilidad y listados en réplicas de solo lectura.
+
+Las vistas decoradas con @lecturas_en_replica leen los modelos de la app desde
+una de las réplicas de settings.AGENDAMIENTO_BD_REPLICAS (una por solicitud,
+al azar) en los GET/HEAD. Todo lo demás (reservas, cancelaciones,
+importaciones, sesiones y usuarios) va a 'default'.
+
+Las réplicas pueden ir atrasadas. Después de reservar o cancelar, la sesión
+queda fijada a la primaria por AGENDAMIENTO_BD_FIJACION_SEGUNDOS (ver
+fijar_primaria()): quien acaba de reservar nunca ve su bloque libre. Mientras
+dura la fijación tampoco se lee la caché de disponibilidad, que otro usuario
+pudo llenar desde una réplica atrasada.
+
+Sin réplicas configuradas el decorador no hace nada.
+"""
+import random
+import time as time_module
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+
+CLAVE_SESION = 'agendamiento_primaria_hasta'
+PRIMARIA = 'default'
+
+# Alias de donde leer en la solicitud en curso: una réplica, PRIMARIA (sesión fijada) o None (sin decorador)
+lecturas_actuales = ContextVar('agendamiento_lecturas', default=None)
+
+
+def replicas():
+    return list(getattr(settings, 'AGENDAMIENTO_BD_REPLICAS', []))
+
+
+def ventana_fijacion():
+    """Segundos que se asume puede atrasarse una réplica."""
+    return getattr(settings, 'AGENDAMIENTO_BD_FIJACION_SEGUNDOS', 10)
+
+
+def leyendo_de_replica():
+    return lecturas_actuales.get() not in (None, PRIMARIA)
+
+
+def primaria_fijada():
+    return lecturas_actuales.get() == PRIMARIA
+
+
+def fijar_primaria(request):
+    """Después de una escritura del usuario: sus lecturas van a la primaria por un rato."""
+    if replicas():
+        request.session[CLAVE_SESION] = time_module.time() + ventana_fijacion()
+
+
+async def afijar_primaria(request):
+    if replicas():
+        await request.session.aset(CLAVE_SESION, time_module.time() + ventana_fijacion())
+
+
+def _alias_lecturas(request, fijada_hasta):
+    if request.method not in ('GET', 'HEAD'):
+        return None # Un POST puede leer lo que acaba de escribir otro POST: siempre a la primaria
+    if fijada_hasta and fijada_hasta > time_module.time():
+        return PRIMARIA
+    return random.choice(replicas())
+
+
+def lecturas_en_replica(vista):
+    """Decorador de vistas de solo lectura (sync o async): ver el docstring del módulo."""
+    if iscoroutinefunction(vista):
+        @wraps(vista)
+        async def interna(request, *args, **kwargs):
+            if not replicas():
+                return await vista(request, *args, **kwargs)
+            token = lecturas_actuales.set(_alias_lecturas(request, await request.session.aget(CLAVE_SESION)))
+            try:
+                return await vista(request, *args, **kwargs)
+            finally:
+                lecturas_actuales.reset(token)
+    else:
+        @wraps(vista)
+        def interna(request, *args, **kwargs):
+            if not replicas():
+                return vista(request, *args, **kwargs)
+            token = lecturas_actuales.set(_alias_lecturas(request, request.session.get(CLAVE_SESION)))
+            try:
+                return vista(request, *args, **kwargs)
+            finally:
+                lecturas_actuales.reset(token)
+    return interna
+
+
+class EnrutadorLecturas:
+    """Router de settings.DATABASE_ROUTERS: lecturas de los modelos de la app según lecturas_actuales."""
+    APP = 'agendamiento'
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == self.APP:
+            return lecturas_actuales.get() # None: que decida el siguiente router ('default')
+        return None
+
+    def db_for_write(self, model, **hints):
+        return PRIMARIA
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # La primaria y sus réplicas tienen los mismos datos (con atraso)
+        alias = {PRIMARIA, *replicas()}
+        if obj1._state.db in alias and obj2._state.db in alias:
+            return True
+        return None
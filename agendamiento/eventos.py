@@ -0,0 +1,115 @@
+# agendamiento/eventos.py
+"""
+Difusión en el proceso de los cambios de bloques de un (empresa, fecha) a las
+grillas abiertas, vía server-sent events (ver eventos_disponibilidad_view).
+
+Las señales de Reserva publican al confirmar la transacción (desde el hilo que
+sea); cada suscriptor es una cola asyncio en el event loop del servidor ASGI.
+Los flujos abiertos se sirven fuera del manejador de Django (ver
+asgi_eventos.py), así que una conexión inactiva cuesta una corrutina y una
+cola, no un hilo.
+Los suscriptores de otros procesos (otros workers) no reciben los eventos de
+este: el cliente igual se resincroniza al reconectarse, que recarga la página.
+"""
+import asyncio
+import itertools
+import threading
+from collections import defaultdict
+
+from django.db import transaction
+
+
+# Estados de un bloque en los eventos 'bloques'
+RESERVADO = 'reservado'
+LIBRE = 'libre'
+
+# Eventos pendientes por suscriptor; un cliente que se atrasa más que esto recibe 'recargar'
+MAX_PENDIENTES = 100
+
+
+class Suscripcion:
+    """Cola de eventos de una conexión, ligada al event loop en que se creó."""
+
+    def __init__(self, clave):
+        self.clave = clave
+        self.loop = asyncio.get_running_loop()
+        self.cola = asyncio.Queue(maxsize=MAX_PENDIENTES)
+        self.desbordada = False
+
+    def entregar(self, evento):
+        # Corre en self.loop
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            self.desbordada = True
+
+    async def siguiente(self, timeout):
+        """Próximo evento, o None si pasan 'timeout' segundos sin eventos."""
+        try:
+            return await asyncio.wait_for(self.cola.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class DifusorDisponibilidad:
+    """Suscripciones por (empresa_id, fecha) y publicación segura entre hilos."""
+
+    def __init__(self):
+        self._suscripciones = defaultdict(set)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def suscribir(self, empresa_id, fecha):
+        """Crea una Suscripcion en el event loop actual; debe liberarse con desuscribir()."""
+        suscripcion = Suscripcion((empresa_id, fecha))
+        with self._lock:
+            self._suscripciones[suscripcion.clave].add(suscripcion)
+        return suscripcion
+
+    def desuscribir(self, suscripcion):
+        with self._lock:
+            suscripciones = self._suscripciones.get(suscripcion.clave)
+            if suscripciones is not None:
+                suscripciones.discard(suscripcion)
+                if not suscripciones:
+                    del self._suscripciones[suscripcion.clave]
+
+    def suscriptores(self, empresa_id=None, fecha=None):
+        with self._lock:
+            if empresa_id is None:
+                return sum(len(s) for s in self._suscripciones.values())
+            return len(self._suscripciones.get((empresa_id, fecha), ()))
+
+    def publicar(self, empresa_id, fecha, datos):
+        """
+        Entrega {'id': n, **datos} a los suscriptores del (empresa, fecha). Puede
+        llamarse desde cualquier hilo: se agenda una sola entrega por event loop.
+        """
+        with self._lock:
+            suscripciones = list(self._suscripciones.get((empresa_id, fecha), ()))
+        if not suscripciones:
+            return 0
+        evento = {'id': next(self._ids), **datos}
+        por_loop = defaultdict(list)
+        for suscripcion in suscripciones:
+            por_loop[suscripcion.loop].append(suscripcion)
+        for loop, grupo in por_loop.items():
+            try:
+                loop.call_soon_threadsafe(_entregar, grupo, evento)
+            except RuntimeError:
+                # Loop cerrado (servidor detenido): sus conexiones ya no existen
+                for suscripcion in grupo:
+                    self.desuscribir(suscripcion)
+        return len(suscripciones)
+
+    def publicar_al_confirmar(self, empresa_id, fecha, datos):
+        """Publica cuando se confirme la transacción actual (de inmediato fuera de una)."""
+        transaction.on_commit(lambda: self.publicar(empresa_id, fecha, datos))
+
+
+def _entregar(suscripciones, evento):
+    for suscripcion in suscripciones:
+        suscripcion.entregar(evento)
+
+
+difusor = DifusorDisponibilidad()
@@ -1,10 +1,19 @@
+import logging
+
 from django import forms
-from .models import Reserva, Vehiculo
+from .calendario import TABLA_VACIA, calendarios
+from .models import Reserva, Vehiculo, OcupacionVehiculoDia
+from .reservas import (
+    DIARIA, DIAS_DE_SEMANA, MAX_OCURRENCIAS, SEMANAL, fechas_de_serie, reservar_bloques, reservar_serie,
+)
 from django.utils import timezone
 from datetime import time, date, timedelta, datetime
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
+
+logger = logging.getLogger(__name__)
+
 class ReservaForm(forms.Form):
     vehiculo_id = forms.IntegerField(widget=forms.HiddenInput())
     fecha_reserva = forms.DateField(widget=forms.HiddenInput())
@@ -16,41 +25,30 @@ class ReservaForm(forms.Form):
         self.usuario_sistema = kwargs.pop('usuario_sistema', None)
         super().__init__(*args, **kwargs) # Llamar a super() es buena práctica aquí
 
-        print(f"\n[DEBUG ReservaForm.__init__] Iniciando para Vehículo: {self.vehiculo}, Fecha: {self.fecha}")
-
+        # Bloques del día según el calendario de la empresa del vehículo (ver calendario.py)
+        self.tabla = TABLA_VACIA
         if self.vehiculo and self.fecha:
             self.fields['vehiculo_id'].initial = self.vehiculo.id
             self.fields['fecha_reserva'].initial = self.fecha
-            
-            # Horarios de operación: 08:00 a 18:00 (configurable)
-            HORARIOS_OPERACION = [time(h) for h in range(8, 18)] # 8 AM a 5 PM (último bloque empieza a las 17:00)
-            print(f"[DEBUG ReservaForm.__init__] HORARIOS_OPERACION: {HORARIOS_OPERACION}")
-            
-            bloques_disponibles_choices = []
-            
-            # Obtener reservas existentes para este vehículo y fecha
-            reservas_existentes_actuales = Reserva.objects.filter(
-                vehiculo=self.vehiculo,
-                fecha_reserva=self.fecha
-            ).values_list('hora_inicio_reserva', flat=True)
-            
-            # Convertir a lista para facilitar la depuración y evitar múltiples accesos a la BD si es un QuerySet grande
-            lista_horas_reservadas = list(reservas_existentes_actuales)
-            print(f"[DEBUG ReservaForm.__init__] Horas ya reservadas (BD): {lista_horas_reservadas}")
-
-            for hora_inicio in HORARIOS_OPERACION:
-                hora_fin = (datetime.combine(date.today(), hora_inicio) + timedelta(hours=1)).time()
-                label = f"{hora_inicio.strftime('%H:%M')} - {hora_fin.strftime('%H:%M')}"
-                
-                # Comprobar si esta hora_inicio está en la lista de horas ya reservadas
-                if hora_inicio not in lista_horas_reservadas:
-                    bloques_disponibles_choices.append((hora_inicio.strftime('%H:%M:%S'), label))
-                    print(f"[DEBUG ReservaForm.__init__] Añadiendo choice disponible: {label}")
-                else:
-                    print(f"[DEBUG ReservaForm.__init__] Hora {hora_inicio.strftime('%H:%M')} ya está reservada, no se añade como choice.")
-            
-            print(f"[DEBUG ReservaForm.__init__] Choices generados para el formulario: {bloques_disponibles_choices}")
-            
+            self.tabla = calendarios.tabla(self.vehiculo.empresa_id, self.fecha)
+
+            # Ocupación actual del vehículo en la fecha (una fila del índice de bits)
+            self.ocupacion = OcupacionVehiculoDia.obtener(self.vehiculo.id, self.fecha)
+
+            # Bloques cuyo bit está libre en la máscara; claves y etiquetas ya vienen formateadas en la tabla
+            bloques_disponibles_choices = [(bloque.clave, bloque.etiqueta) for bloque in self.tabla.libres(self.ocupacion.mascara)]
+
+            # El 'extra' solo se arma si el nivel DEBUG está activo (ver LOGGING en settings)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "ReservaForm con %d bloques disponibles", len(bloques_disponibles_choices),
+                    extra={
+                        'vehiculo_id': self.vehiculo.id, 'fecha': self.fecha.isoformat(),
+                        'mascara': f"{self.ocupacion.mascara:024b}",
+                        'bloques_disponibles': [valor for valor, _ in bloques_disponibles_choices],
+                    },
+                )
+
             if bloques_disponibles_choices:
                 self.fields['bloques_seleccionados'] = forms.MultipleChoiceField(
                     choices=bloques_disponibles_choices,
@@ -58,12 +56,8 @@ class ReservaForm(forms.Form):
                     label="Seleccione los bloques horarios",
                     required=True
                 )
-                print(f"[DEBUG ReservaForm.__init__] CAMPO 'bloques_seleccionados' CREADO con {len(bloques_disponibles_choices)} opciones.")
-            else:
-                print(f"[DEBUG ReservaForm.__init__] CAMPO 'bloques_seleccionados' NO CREADO porque la lista de choices disponibles está vacía.")
         else:
-            print(f"[DEBUG ReservaForm.__init__] CAMPO 'bloques_seleccionados' NO CREADO porque self.vehiculo o self.fecha es None.")
-        print("[DEBUG ReservaForm.__init__] Fin de inicialización.\n")
+            logger.debug("ReservaForm sin vehículo o fecha: no se crea el campo 'bloques_seleccionados'")
 
 
     def clean_bloques_seleccionados(self):
@@ -81,56 +75,93 @@ class ReservaForm(forms.Form):
         except ValueError:
             raise forms.ValidationError("Formato de hora inválido en los bloques seleccionados.")
 
-        # Validar nuevamente contra la base de datos en el momento de la sumisión (race condition)
-        if self.vehiculo and self.fecha:
-            for hora_inicio_str in bloques:
-                hora_inicio = time.fromisoformat(hora_inicio_str)
-                if Reserva.objects.filter(
-                    vehiculo=self.vehiculo,
-                    fecha_reserva=self.fecha,
-                    hora_inicio_reserva=hora_inicio
-                ).exists():
-                    raise forms.ValidationError(
-                        f"El bloque {hora_inicio.strftime('%H:%M')} para el vehículo {self.vehiculo.patente} "
-                        f"fue reservado mientras realizaba su selección. Por favor, intente de nuevo."
-                    )
+        # La disponibilidad se verifica en save() con una sola consulta para todos los bloques
+        # (ver agendamiento.reservas); las choices ya excluyen lo reservado al construir el formulario.
         return horas_seleccionadas # Devolver objetos time
 
     def save(self):
         if not self.is_valid():
             return [] # No guardar si el formulario no es válido
 
-        vehiculo_id = self.cleaned_data['vehiculo_id']
-        fecha_reserva = self.cleaned_data['fecha_reserva']
         horas_inicio_seleccionadas = self.cleaned_data['bloques_seleccionados'] # Ya son objetos time
 
-        vehiculo_obj = Vehiculo.objects.get(id=vehiculo_id)
-        
-        reservas_creadas = []
-        for hora_inicio in horas_inicio_seleccionadas:
-            # Calcular hora_fin
-            hora_fin = (datetime.combine(date.today(), hora_inicio) + timedelta(hours=1)).time()
-            
-            reserva = Reserva(
-                vehiculo=vehiculo_obj,
-                usuario=self.usuario_sistema, # Asignado en la vista
-                fecha_reserva=fecha_reserva,
-                hora_inicio_reserva=hora_inicio,
-                hora_fin_reserva=hora_fin # Se recalculará en el save() del modelo, pero es bueno tenerlo
-            )
-            try:
-                reserva.save() # El save del modelo incluye full_clean()
-                reservas_creadas.append(reserva)
-            except ValidationError as e:
-                # Si hay un error de validación (ej. duplicado por race condition)
-                # Se podría agregar al form.errors o manejarlo.
-                # Por ahora, si una falla, las anteriores podrían haberse creado.
-                # Idealmente, esto se manejaría con una transacción.
-                # (El save del form ya está dentro de un @transaction.atomic en la vista)
-                self.add_error(None, e) # Añade error no ligado a un campo específico
-                return [] # Detener y no devolver reservas parciales
-        
-        return reservas_creadas
+        # El vehículo y la fecha vienen de la vista (ya validados contra la empresa del usuario)
+        self.resultado = reservar_bloques(self.vehiculo, self.fecha, self.usuario_sistema, horas_inicio_seleccionadas)
+        for mensaje in self.resultado.errores.values():
+            self.add_error(None, mensaje) # Añade error no ligado a un campo específico
+        if self.resultado.mensaje:
+            self.add_error(None, self.resultado.mensaje)
+        return self.resultado.reservas
+
+class ReservaSerieForm(forms.Form):
+    """
+    Reserva recurrente de un vehículo: los mismos bloques cada día, cada semana o
+    en días de la semana elegidos, hasta N ocurrencias o una fecha de término.
+    """
+    DIAS_SEMANA_CHOICES = [(str(dia), nombre) for dia, nombre in enumerate(
+        ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo'])]
+
+    fecha_inicio = forms.DateField(label="Desde", widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+    frecuencia = forms.ChoiceField(
+        label="Repetir",
+        choices=[(SEMANAL, "Cada semana"), (DIARIA, "Todos los días"), (DIAS_DE_SEMANA, "Los días de la semana elegidos")],
+        initial=SEMANAL, widget=forms.RadioSelect,
+    )
+    dias_semana = forms.TypedMultipleChoiceField(
+        label="Días de la semana", choices=DIAS_SEMANA_CHOICES, coerce=int, required=False,
+        widget=forms.CheckboxSelectMultiple,
+    )
+    repeticiones = forms.IntegerField(label="Número de fechas", min_value=1, max_value=MAX_OCURRENCIAS, required=False)
+    hasta = forms.DateField(label="Hasta (incluida)", required=False,
+                            widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+
+    def __init__(self, *args, **kwargs):
+        self.vehiculo = kwargs.pop('vehiculo')
+        self.usuario_sistema = kwargs.pop('usuario_sistema', None)
+        super().__init__(*args, **kwargs)
+        # Bloques de cualquier día del calendario de la empresa; los que no operan en una fecha quedan como conflicto
+        calendario = calendarios.de_empresa(self.vehiculo.empresa_id)
+        bloques = {bloque.clave: bloque for tabla in calendario.tablas_por_dia for bloque in tabla}
+        self.fields['bloques_seleccionados'] = forms.MultipleChoiceField(
+            choices=[(clave, bloques[clave].etiqueta) for clave in sorted(bloques)],
+            widget=forms.CheckboxSelectMultiple,
+            label="Seleccione los bloques horarios",
+        )
+
+    def clean_fecha_inicio(self):
+        fecha = self.cleaned_data['fecha_inicio']
+        if fecha < timezone.now().date():
+            raise forms.ValidationError("No puede reservar en fechas pasadas.")
+        return fecha
+
+    def clean_bloques_seleccionados(self):
+        # Las choices ya validan el formato
+        return sorted(time.fromisoformat(b) for b in self.cleaned_data['bloques_seleccionados'])
+
+    def clean(self):
+        cleaned_data = super().clean()
+        inicio = cleaned_data.get('fecha_inicio')
+        hasta = cleaned_data.get('hasta')
+        if cleaned_data.get('repeticiones') is None and hasta is None:
+            raise forms.ValidationError("Indique el número de fechas o la fecha de término de la serie.")
+        if cleaned_data.get('frecuencia') == DIAS_DE_SEMANA and not cleaned_data.get('dias_semana'):
+            self.add_error('dias_semana', "Seleccione al menos un día de la semana.")
+        if inicio and hasta and hasta < inicio:
+            self.add_error('hasta', "La fecha de término no puede ser anterior a la de inicio.")
+        if inicio and not self.errors:
+            self.fechas = fechas_de_serie(inicio, cleaned_data['frecuencia'], cleaned_data.get('dias_semana') or (),
+                                          cleaned_data.get('repeticiones'), hasta)
+            if not self.fechas:
+                raise forms.ValidationError("La serie no tiene ninguna fecha entre el inicio y el término.")
+        return cleaned_data
+
+    def save(self):
+        if not self.is_valid():
+            return None
+        self.resultado = reservar_serie(self.vehiculo, self.usuario_sistema, self.fechas, self.cleaned_data['bloques_seleccionados'])
+        if self.resultado.mensaje:
+            self.add_error(None, self.resultado.mensaje)
+        return self.resultado
 
 class FechaSeleccionForm(forms.Form):
     """
@@ -0,0 +1,118 @@
+# agendamiento/fragmentos.py
+"""
+Caché de las filas ya renderizadas de la grilla de disponibilidad, una por
+vehículo y fecha (plantilla 'fila_disponibilidad.html').
+
+La clave de una fila se arma con lo que la fila muestra: los datos del
+vehículo, la fecha y su URL de reserva, los bloques del día (TablaBloques.mascara)
+y la máscara de los bloques reservados del vehículo ese día. Esa máscara hace de
+versión del (vehículo, día): cambia con cada Reserva que se crea, mueve o borra,
+sin que las señales tengan que hacer nada, y no puede quedar desfasada respecto
+de los datos con que se renderizó la fila. Las filas viejas solo dejan de usarse
+y expiran.
+
+Las filas se guardan sin "Reservado por ti" (todas las celdas reservadas dicen
+"Reservado"), así una misma fila sirve a todos los usuarios de la empresa. Las
+celdas del usuario se reemplazan al armar su página: en una página sin cambios
+el costo es el de leer la caché y unir strings.
+"""
+import hashlib
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+
+PLANTILLA_FILA = 'agendamiento/fila_disponibilidad.html'
+
+# Súbase al cambiar PLANTILLA_FILA: las filas guardadas con el formato anterior dejan de usarse
+FORMATO = 1
+
+# Celda reservada tal como la escribe PLANTILLA_FILA, y cómo la ve quien la reservó
+CELDA_RESERVADA = '<td data-vehiculo="{}" data-hora="{}" title="{}" class="bloque-reservado">Reservado</td>'
+CELDA_RESERVADA_POR_MI = '<td data-vehiculo="{}" data-hora="{}" title="{}" class="bloque-reservado-por-mi">Reservado por ti</td>'
+
+
+def _con_celdas_propias(fila, vehiculo_id, horas_reservadas, usuario_id, tabla):
+    for bloque in tabla.bloques:
+        if horas_reservadas.get(bloque.inicio) == usuario_id:
+            # data-vehiculo y data-hora hacen única a la celda dentro de la fila
+            fila = fila.replace(CELDA_RESERVADA.format(vehiculo_id, bloque.hora, bloque.etiqueta),
+                                CELDA_RESERVADA_POR_MI.format(vehiculo_id, bloque.hora, bloque.etiqueta), 1)
+    return fila
+
+
+class CacheFilas:
+    """Filas renderizadas de la grilla por contenido, con contadores de aciertos y fallos."""
+
+    def __init__(self, alias='disponibilidad', timeout=300):
+        self.alias = alias
+        self.timeout = timeout
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        try:
+            return caches[self.alias]
+        except InvalidCacheBackendError:
+            return caches['default']
+
+    def _clave(self, vehiculo, fecha, tabla, url_reserva, mascara_reservada):
+        texto = '|'.join(map(str, (
+            FORMATO, vehiculo.id, vehiculo.marca, vehiculo.modelo, vehiculo.patente, vehiculo.tipo_vehiculo,
+            fecha.isoformat(), url_reserva, tabla.mascara, mascara_reservada,
+        )))
+        return 'fila:' + hashlib.blake2b(texto.encode(), digest_size=16).hexdigest()
+
+    async def ahtml(self, disponibilidad_data, reservas_por_vehiculo, usuario_id, fecha, tabla, url_reserva):
+        """
+        HTML de las filas de la grilla (un <tr> por vehículo, en el orden de
+        'disponibilidad_data', ver construir_grilla_disponibilidad()) para 'usuario_id'.
+        Solo se renderizan las filas que no están en la caché.
+        """
+        claves = {}
+        for vehiculo_id, data in disponibilidad_data.items():
+            horas_reservadas = reservas_por_vehiculo.get(vehiculo_id, {})
+            mascara_reservada = 0
+            for bloque in tabla.bloques:
+                if bloque.inicio in horas_reservadas:
+                    mascara_reservada |= bloque.bit
+            claves[vehiculo_id] = self._clave(data['vehiculo'], fecha, tabla, url_reserva, mascara_reservada)
+        # aget_many() de BaseCache espera un aget() por clave, cada uno en un hilo: una sola pasada a un hilo
+        guardadas = await sync_to_async(self.cache.get_many)(list(claves.values())) if claves else {}
+
+        nuevas = {}
+        partes = []
+        plantilla = None
+        for vehiculo_id, data in disponibilidad_data.items():
+            clave = claves[vehiculo_id]
+            fila = guardadas.get(clave)
+            if fila is None:
+                plantilla = plantilla or get_template(PLANTILLA_FILA)
+                fila = nuevas[clave] = str(plantilla.render({'data': data}))
+            horas_reservadas = reservas_por_vehiculo.get(vehiculo_id, {})
+            if usuario_id in horas_reservadas.values():
+                fila = _con_celdas_propias(fila, vehiculo_id, horas_reservadas, usuario_id, tabla)
+            partes.append(fila)
+        if nuevas:
+            await sync_to_async(self.cache.set_many)(nuevas, self.timeout)
+        with self._lock:
+            self.aciertos += len(claves) - len(nuevas)
+            self.fallos += len(nuevas)
+        return mark_safe(''.join(partes))
+
+    def estadisticas(self):
+        with self._lock:
+            return {'aciertos': self.aciertos, 'fallos': self.fallos}
+
+
+cache_filas = CacheFilas(
+    alias=getattr(settings, 'AGENDAMIENTO_CACHE_DISPONIBILIDAD_ALIAS', 'disponibilidad'),
+    timeout=getattr(settings, 'AGENDAMIENTO_CACHE_DISPONIBILIDAD_TIMEOUT', 300),
+)
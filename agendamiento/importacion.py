@@ -0,0 +1,148 @@
+# agendamiento/importacion.py
+"""
+Etapa de parseo y validación de las filas CSV del comando load_csv_data.
+
+Son funciones puras (sin acceso a la base de datos ni a stdout) para poder
+ejecutarlas en un pool de procesos: los mensajes se retornan junto al número
+de línea original y el comando los imprime en orden.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from django.contrib.auth.hashers import make_password
+
+from .validadores import normalizar_patente, normalizar_patentes, verificar_rut, verificar_ruts
+
+
+ADVERTENCIA = 'WARNING'
+ERROR = 'ERROR'
+
+
+def clave_empresa(razon_social):
+    """Clave del mapa de empresas: variantes con distinto espaciado o mayúsculas son la misma empresa."""
+    return ' '.join(razon_social.split()).casefold()
+
+
+@dataclass
+class LoteVehiculos:
+    """Resultado de parsear un lote de filas del CSV de vehículos."""
+    primera_fila: int = 0
+    ultima_fila: int = 0
+    filas_leidas: int = 0
+    vehiculos: dict = field(default_factory=dict) # {patente: vehiculo_data}; si se repite, gana la última fila
+    mensajes: list = field(default_factory=list) # [(numero_fila, nivel, texto)]
+    omitidas: int = 0
+
+
+def parsear_fila_vehiculo(numero_fila, row, patente_normalizada=None, rut_verificado=None):
+    """
+    Limpia y valida una fila (dict) del CSV de vehículos.
+    patente_normalizada y rut_verificado son los resultados ya calculados por
+    columna (ver parsear_lote_vehiculos); si no se entregan se calculan aquí.
+    Retorna (patente, vehiculo_data, mensajes); patente es None si la fila se omite.
+    """
+    mensajes = []
+    patente, advertencia = patente_normalizada or normalizar_patente(row.get('PATENTE', ''))
+    if advertencia:
+        mensajes.append((numero_fila, ADVERTENCIA, advertencia))
+    if not patente:
+        mensajes.append((numero_fila, ADVERTENCIA, f"Fila {numero_fila}: Patente faltante. Se omite esta fila."))
+        return None, None, mensajes
+
+    rut_empresa, error_rut = rut_verificado or verificar_rut(row.get('RUT', ''))
+    if error_rut:
+        mensajes.append((numero_fila, ADVERTENCIA, f"Fila {numero_fila} (Patente: {patente}): {error_rut} Se omite esta fila."))
+        return None, None, mensajes
+    if not rut_empresa:
+        mensajes.append((numero_fila, ADVERTENCIA, f"Fila {numero_fila} (Patente: {patente}): RUT faltante. Se omite esta fila."))
+        return None, None, mensajes
+
+    razon_social = row.get('RAZON SOCIAL', '').strip()
+    if not razon_social:
+        mensajes.append((numero_fila, ADVERTENCIA, f"Fila {numero_fila} (Patente: {patente}): RAZON SOCIAL faltante. Se omite esta fila."))
+        return None, None, mensajes
+
+    vehiculo_data = {
+        'empresa': (razon_social, row.get('RAZON SOCIAL2', '').strip() or None, rut_empresa), # Se resuelve a empresa_id al escribir
+        'tipo_vehiculo': row.get('TIPO VEHICULO', '').strip(),
+        'marca': row.get('MARCA', '').strip(),
+        'modelo': row.get('MODELO', '').strip(),
+        'tipo_transmision': row.get('TIPO', '').strip(), # 'TIPO' en CSV es 'tipo_transmision' en modelo
+        'estado': row.get('ESTADO', '').strip() or None,
+    }
+    return patente, vehiculo_data, mensajes
+
+
+def parsear_lote_vehiculos(fieldnames, filas):
+    """
+    Parsea un lote de filas [(numero_fila, valores)] del CSV de vehículos.
+    Las filas llegan como listas (no dicts) para abaratar el envío entre procesos.
+    """
+    lote = LoteVehiculos(primera_fila=filas[0][0], ultima_fila=filas[-1][0], filas_leidas=len(filas))
+    rows = [dict(zip(fieldnames, valores)) for _, valores in filas]
+    # Patentes y RUTs se validan por columna, una llamada por lote
+    patentes = normalizar_patentes([row.get('PATENTE', '') for row in rows])
+    ruts = verificar_ruts([row.get('RUT', '') for row in rows])
+    for (numero_fila, _), row, patente_normalizada, rut_verificado in zip(filas, rows, patentes, ruts):
+        patente, vehiculo_data, mensajes = parsear_fila_vehiculo(numero_fila, row, patente_normalizada, rut_verificado)
+        lote.mensajes.extend(mensajes)
+        if patente:
+            lote.vehiculos[patente] = vehiculo_data
+        else:
+            lote.omitidas += 1
+    return lote
+
+
+def parsear_fila_usuario(numero_fila, row):
+    """
+    Limpia y valida una fila (dict) del CSV de usuarios del sistema.
+    Retorna (datos_perfil, mensajes); datos_perfil es None si la fila se omite.
+    """
+    nombre_usuario_csv = row.get('USUARIO', '').strip() # Este es el nombre completo, ej: "RICARDO CLAVIJO"
+    if not nombre_usuario_csv:
+        return None, [(numero_fila, ADVERTENCIA, f"Fila {numero_fila}: Nombre de USUARIO CSV faltante. Se omite esta fila.")]
+
+    rut_empresa, error_rut = verificar_rut(row.get('RUT', ''))
+    if error_rut:
+        return None, [(numero_fila, ADVERTENCIA, f"Fila {numero_fila} (Usuario: {nombre_usuario_csv}): {error_rut} Se omite esta fila.")]
+    if not rut_empresa:
+        return None, [(numero_fila, ADVERTENCIA, f"Fila {numero_fila} (Usuario: {nombre_usuario_csv}): RUT de empresa faltante. Se omite esta fila.")]
+
+    razon_social_empresa = row.get('RAZON SOCIAL', '').strip()
+    if not razon_social_empresa:
+        return None, [(numero_fila, ADVERTENCIA, f"Fila {numero_fila} (Usuario: {nombre_usuario_csv}): RAZON SOCIAL de empresa faltante. Se omite esta fila.")]
+
+    return {
+        'nombre_usuario_completo': nombre_usuario_csv,
+        'empresa': (razon_social_empresa, row.get('RAZON SOCIAL2', '').strip() or None, rut_empresa), # Se resuelve a empresa_id al escribir
+        'ciudad': row.get('CIUDAD', '').strip(),
+    }, []
+
+
+def username_disponible(nombre_completo, usados):
+    """
+    Genera un username a partir del nombre completo que no esté en 'usados'
+    (un set cargado una sola vez) y lo agrega al set.
+    """
+    username_base = "".join(nombre_completo.split()).lower()
+    username = username_base
+    counter = 1
+    while username in usados:
+        username = f"{username_base}{counter}"
+        counter += 1
+    usados.add(username)
+    return username
+
+
+def _inicializar_proceso_django():
+    # Con el método 'spawn' los procesos hijos no heredan la configuración de Django
+    import django
+    django.setup()
+
+
+def hashear_claves(claves, workers=1):
+    """Aplica make_password (PBKDF2 u otro hasher configurado) a cada clave, en paralelo si workers > 1."""
+    if workers <= 1:
+        return [make_password(clave) for clave in claves]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_inicializar_proceso_django) as pool:
+        return list(pool.map(make_password, claves, chunksize=max(1, len(claves) // (workers * 4))))
@@ -0,0 +1,18 @@
+# agendamiento/logs.py
+import logging
+
+
+# Atributos que todo LogRecord trae; el resto viene del 'extra' de la llamada
+_ATRIBUTOS_ESTANDAR = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class FormateadorClaveValor(logging.Formatter):
+    """
+    Agrega al mensaje los campos de 'extra' como pares clave=valor, ej:
+    "... Solicitud GET agendamiento:mis_reservas vista=agendamiento:mis_reservas consultas=4".
+    """
+
+    def format(self, record):
+        mensaje = super().format(record)
+        campos = [f"{clave}={valor}" for clave, valor in vars(record).items() if clave not in _ATRIBUTOS_ESTANDAR]
+        return f"{mensaje} {' '.join(campos)}" if campos else mensaje
@@ -0,0 +1,223 @@
+# agendamiento/management/commands/_bench.py
+"""
+Utilidades compartidas por los comandos de benchmark (bench_*).
+Los benchmarks corren sobre una base de datos de prueba temporal, nunca sobre
+la base de datos configurada.
+"""
+import csv
+import os
+import random
+import shutil
+import tempfile
+import time as time_module
+from contextlib import contextmanager
+from datetime import time
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from agendamiento.disponibilidad import HORARIOS_OPERACION
+from agendamiento.metricas import MedicionSolicitud
+from agendamiento.models import Empresa, Vehiculo, UsuarioSistema, Reserva, OcupacionVehiculoDia
+from agendamiento.validadores import digito_verificador
+
+
+@contextmanager
+def base_de_datos_temporal(en_archivo=False):
+    """
+    Crea (y destruye al salir) una base de datos de prueba con las migraciones aplicadas.
+    Con en_archivo=True, en SQLite se usa un archivo temporal en lugar de memoria,
+    necesario para que varios hilos usen conexiones propias.
+    """
+    setup_test_environment()
+    directorio = None
+    if en_archivo and connection.vendor == 'sqlite':
+        directorio = tempfile.mkdtemp()
+        connection.settings_dict['TEST']['NAME'] = os.path.join(directorio, 'bench.sqlite3')
+    nombre_original = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(nombre_original, verbosity=0)
+        teardown_test_environment()
+        if directorio:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+
+def crear_empresa_sintetica(razon_social, num_vehiculos, num_usuarios, fechas, ocupacion=0.5, semilla=0):
+    """
+    Crea una flota y usuarios de una empresa, y reservas aleatorias (pero
+    deterministas según 'semilla') en las fechas indicadas. Usa bulk_create,
+    por lo que el índice de ocupación se llena aparte.
+    Retorna la lista de usuarios Django creados.
+    """
+    rnd = random.Random(semilla)
+    empresa = Empresa.objects.create(razon_social=razon_social, rut='80.010.900-0')
+    Vehiculo.objects.bulk_create([
+        Vehiculo(empresa=empresa, patente=f"B{semilla % 10}{i:06d}",
+                 tipo_vehiculo='Camioneta', marca='MARCA', modelo=f"M{i % 7}", tipo_transmision='4x2', estado='Activo')
+        for i in range(num_vehiculos)
+    ], batch_size=1000)
+    vehiculo_ids = list(Vehiculo.objects.filter(empresa=empresa).values_list('id', flat=True))
+
+    users = []
+    for i in range(num_usuarios):
+        user = User.objects.create(username=f"bench{semilla}_{i}")
+        UsuarioSistema.objects.filter(user=user).update(
+            empresa=empresa, ciudad='SANTIAGO'
+        )
+        users.append(user)
+    perfil_ids = list(UsuarioSistema.objects.filter(user__in=users).values_list('id', flat=True))
+
+    reservas = []
+    mascaras = {}
+    for fecha in fechas:
+        for vehiculo_id in vehiculo_ids:
+            for hora in HORARIOS_OPERACION:
+                if rnd.random() < ocupacion:
+                    reservas.append(Reserva(
+                        vehiculo_id=vehiculo_id, usuario_id=rnd.choice(perfil_ids), fecha_reserva=fecha,
+                        hora_inicio_reserva=hora, hora_fin_reserva=time(hora.hour + 1),
+                    ))
+                    clave = (vehiculo_id, fecha)
+                    mascaras[clave] = mascaras.get(clave, 0) | OcupacionVehiculoDia.bit_de_hora(hora)
+    Reserva.objects.bulk_create(reservas, batch_size=5000)
+    OcupacionVehiculoDia.objects.bulk_create(
+        [OcupacionVehiculoDia(vehiculo_id=v, fecha=f, mascara=m) for (v, f), m in mascaras.items()],
+        batch_size=5000,
+    )
+    return users
+
+
+@contextmanager
+def _sin_indices(cursor, tabla):
+    # En SQLite los índices se borran y se recrean al final con su SQL original: construir un índice
+    # de una vez es mucho más rápido que mantenerlo fila a fila (en otros motores no se hace nada)
+    if connection.vendor != 'sqlite':
+        yield
+        return
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL", [tabla])
+    indices = cursor.fetchall()
+    for nombre, _ in indices:
+        cursor.execute(f"DROP INDEX {connection.ops.quote_name(nombre)}")
+    yield
+    for _, sql in indices:
+        cursor.execute(sql)
+
+
+def insertar_filas(modelo, campos, filas, lote=10_000):
+    """
+    Inserta 'filas' (iterable de tuplas con los valores de 'campos', ya en el formato de la BD)
+    con executemany, sin instanciar modelos como bulk_create. Para cargar millones de filas
+    sintéticas en segundos; no dispara señales. Retorna el número de filas insertadas.
+    """
+    quote_name = connection.ops.quote_name
+    tabla = modelo._meta.db_table
+    columnas = ', '.join(quote_name(modelo._meta.get_field(campo).column) for campo in campos)
+    sql = f"INSERT INTO {quote_name(tabla)} ({columnas}) VALUES ({', '.join(['%s'] * len(campos))})"
+    total = 0
+    filas = iter(filas)
+    with transaction.atomic(), connection.cursor() as cursor, _sin_indices(cursor, tabla):
+        while lote_filas := list(islice(filas, lote)):
+            cursor.executemany(sql, lote_filas)
+            total += len(lote_filas)
+    return total
+
+
+def generar_datos_sinteticos(empresas, vehiculos_por_empresa, usuarios_por_empresa, fechas, ocupacion=0.5, semilla=0):
+    """
+    Carga empresas, flotas, usuarios (sin clave utilizable) y reservas aleatorias pero
+    deterministas según 'semilla', junto con su índice de ocupación. Todo con inserciones
+    masivas: no se disparan las señales de User ni de Reserva.
+    Retorna {empresa_id: {'vehiculos': [ids], 'users': [ids]}} y el número de reservas creadas.
+    """
+    rnd = random.Random(semilla)
+    Empresa.objects.bulk_create([
+        Empresa(razon_social=f"Empresa sintética {e:03d}", rut='80.010.900-0') for e in range(empresas)
+    ])
+    empresas_ids = list(Empresa.objects.filter(razon_social__startswith='Empresa sintética').values_list('id', flat=True))
+
+    Vehiculo.objects.bulk_create([
+        Vehiculo(empresa_id=empresa_id, patente=f"S{e:03d}{v:05d}", tipo_vehiculo='Camioneta',
+                 marca=rnd.choice(['MITSUBISHI', 'TOYOTA', 'NISSAN']), modelo=f"M{v % 7}", tipo_transmision='4x2', estado='Activo')
+        for e, empresa_id in enumerate(empresas_ids) for v in range(vehiculos_por_empresa)
+    ], batch_size=5000)
+    clave_inutilizable = make_password(None)
+    User.objects.bulk_create([
+        User(username=f"sintetico{e:03d}_{u:05d}", password=clave_inutilizable)
+        for e in range(len(empresas_ids)) for u in range(usuarios_por_empresa)
+    ], batch_size=5000)
+    user_ids = dict(User.objects.filter(username__startswith='sintetico').values_list('username', 'id'))
+    UsuarioSistema.objects.bulk_create([
+        UsuarioSistema(user_id=user_ids[f"sintetico{e:03d}_{u:05d}"], nombre_usuario_completo=f"USUARIO {e:03d} {u:05d}",
+                       empresa_id=empresa_id, ciudad='SANTIAGO')
+        for e, empresa_id in enumerate(empresas_ids) for u in range(usuarios_por_empresa)
+    ], batch_size=5000)
+
+    datos = {empresa_id: {'vehiculos': [], 'users': [], 'perfiles': []} for empresa_id in empresas_ids}
+    for vehiculo_id, empresa_id in Vehiculo.objects.filter(empresa_id__in=empresas_ids).values_list('id', 'empresa_id'):
+        datos[empresa_id]['vehiculos'].append(vehiculo_id)
+    for perfil_id, user_id, empresa_id in UsuarioSistema.objects.filter(empresa_id__in=empresas_ids).values_list('id', 'user_id', 'empresa_id'):
+        datos[empresa_id]['perfiles'].append(perfil_id)
+        datos[empresa_id]['users'].append(user_id)
+
+    # Fechas y horas como texto ISO: las acepta cualquier backend y evita los adaptadores de sqlite3
+    horas = [(hora.isoformat(), time(hora.hour + 1).isoformat(), OcupacionVehiculoDia.bit_de_hora(hora)) for hora in HORARIOS_OPERACION]
+    fechas_iso = [fecha.isoformat() for fecha in fechas]
+    mascaras = []
+
+    def reservas():
+        aleatorio = rnd.random
+        for empresa in datos.values():
+            perfiles = empresa['perfiles']
+            cantidad_perfiles = len(perfiles)
+            for vehiculo_id in empresa['vehiculos']:
+                for fecha in fechas_iso:
+                    mascara = 0
+                    for inicio, fin, bit in horas:
+                        if aleatorio() < ocupacion:
+                            mascara |= bit
+                            yield vehiculo_id, perfiles[int(aleatorio() * cantidad_perfiles)], fecha, inicio, fin
+                    if mascara:
+                        mascaras.append((vehiculo_id, fecha, mascara))
+
+    total = insertar_filas(Reserva, ('vehiculo', 'usuario', 'fecha_reserva', 'hora_inicio_reserva', 'hora_fin_reserva'), reservas())
+    insertar_filas(OcupacionVehiculoDia, ('vehiculo', 'fecha', 'mascara'), mascaras)
+    return datos, total
+
+
+def escribir_csv_vehiculos(ruta, filas, semilla=0):
+    """Escribe un CSV de vehículos sintético en el formato de load_csv_data, con ~1% de filas sin RUT."""
+    rnd = random.Random(semilla)
+    with open(ruta, 'w', newline='', encoding='utf-8') as archivo:
+        writer = csv.writer(archivo)
+        writer.writerow(['RAZON SOCIAL', 'RAZON SOCIAL2', 'RUT', 'PATENTE', 'TIPO VEHICULO', 'MARCA', 'MODELO', 'TIPO', 'ESTADO'])
+        for i in range(filas):
+            cuerpo = str(rnd.randint(1_000_000, 99_999_999))
+            rut = f"{cuerpo}{digito_verificador(cuerpo)}"
+            patente = f"{i:08X}"[-6:] if i < 16 ** 6 else f"{i:X}"
+            if rnd.random() < 0.01:
+                rut = '' # ~1% de filas inválidas que se deben omitir y reportar
+            writer.writerow([f"Empresa {i % 50}", '', rut, patente.lower(), 'Camioneta',
+                             rnd.choice(['MITSUBISHI', 'TOYOTA', 'NISSAN']), 'MODELO', '4x2', 'Activo'])
+
+
+def percentil(valores, p):
+    """Percentil 'p' (0-100) por rango más cercano de una lista no vacía."""
+    ordenados = sorted(valores)
+    return ordenados[max(0, -(-len(ordenados) * p // 100) - 1)]
+
+
+def medir(funcion):
+    """Ejecuta 'funcion' y retorna (resultado, segundos, numero_de_consultas)."""
+    # Cuenta con un execute_wrapper: a diferencia de CaptureQueriesContext no guarda el SQL
+    # (sin el límite de 9000 consultas registradas) ni se reinicia en cada solicitud
+    medicion = MedicionSolicitud()
+    with connection.execute_wrapper(medicion):
+        inicio = time_module.perf_counter()
+        resultado = funcion()
+        segundos = time_module.perf_counter() - inicio
+    return resultado, segundos, medicion.consultas
@@ -0,0 +1,163 @@
+# agendamiento/management/commands/bench_agendamiento.py
+import json
+import os
+import platform
+import random
+import tempfile
+import time as time_module
+from datetime import timedelta
+from io import StringIO
+
+import django
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from agendamiento.cache_disponibilidad import cache_disponibilidad
+from agendamiento.disponibilidad import HORARIOS_OPERACION
+from agendamiento.models import OcupacionVehiculoDia
+from agendamiento.paginacion import PASADAS, PROXIMAS
+
+from ._bench import base_de_datos_temporal, escribir_csv_vehiculos, generar_datos_sinteticos, medir, percentil
+
+
+# Días futuros con reservas sintéticas (el resto de las fechas generadas son pasadas)
+DIAS_FUTUROS = 14
+
+
+class Command(BaseCommand):
+    help = ('Genera datos sintéticos deterministas (empresas, flotas, usuarios y meses de reservas) en una BD '
+            'temporal y mide con el cliente de pruebas las vistas mostrar_disponibilidad, reservar_vehiculo y '
+            'mis_reservas, y el comando load_csv_data. Reporta latencia p50/p95/máx y consultas por escenario.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--empresas', type=int, default=5)
+        parser.add_argument('--vehiculos', type=int, default=50, help='Vehículos por empresa.')
+        parser.add_argument('--usuarios', type=int, default=20, help='Usuarios por empresa.')
+        parser.add_argument('--meses', type=int, default=3, help='Meses de reservas hacia atrás (más 2 semanas hacia adelante).')
+        parser.add_argument('--ocupacion', type=float, default=0.4, help='Fracción de bloques reservados.')
+        parser.add_argument('--iteraciones', type=int, default=100, help='Solicitudes medidas por vista.')
+        parser.add_argument('--filas-csv', type=int, default=2000, help='Filas del CSV de vehículos a importar.')
+        parser.add_argument('--iteraciones-csv', type=int, default=3)
+        parser.add_argument('--cache-fria', action='store_true',
+                            help='Vacía la caché de disponibilidad antes de cada solicitud a mostrar_disponibilidad.')
+        parser.add_argument('--json', dest='ruta_json', help="Escribe los resultados en este archivo JSON ('-' para stdout).")
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['semilla'])
+        with base_de_datos_temporal():
+            hoy = timezone.localdate()
+            fechas = [hoy + timedelta(days=d) for d in range(-30 * options['meses'], DIAS_FUTUROS + 1)]
+            inicio = time_module.perf_counter()
+            datos, total_reservas = generar_datos_sinteticos(
+                options['empresas'], options['vehiculos'], options['usuarios'], fechas, options['ocupacion'], options['semilla'],
+            )
+            segundos_generacion = time_module.perf_counter() - inicio
+            self.stdout.write(f"Datos: {options['empresas']} empresas, {options['empresas'] * options['vehiculos']} vehículos, "
+                              f"{options['empresas'] * options['usuarios']} usuarios, {total_reservas} reservas "
+                              f"en {segundos_generacion:.1f} s ({total_reservas / segundos_generacion:,.0f} reservas/s)")
+
+            # Un cliente con sesión por empresa; el login no entra en las mediciones
+            clientes = []
+            for empresa_id, empresa in datos.items():
+                client = Client()
+                client.force_login(User.objects.get(id=empresa['users'][0]))
+                clientes.append((client, empresa_id))
+            fechas_futuras = [hoy + timedelta(days=d) for d in range(1, DIAS_FUTUROS + 1)]
+
+            def mostrar_disponibilidad():
+                client, _ = rnd.choice(clientes)
+                url = reverse('agendamiento:mostrar_disponibilidad', kwargs={'fecha_str': rnd.choice(fechas_futuras).isoformat()})
+                if options['cache_fria']:
+                    cache_disponibilidad.limpiar()
+                return lambda: client.get(url)
+
+            def reservar_vehiculo():
+                client, empresa_id = rnd.choice(clientes)
+                while True:
+                    vehiculo_id = rnd.choice(datos[empresa_id]['vehiculos'])
+                    fecha = rnd.choice(fechas_futuras)
+                    ocupacion = OcupacionVehiculoDia.obtener(vehiculo_id, fecha)
+                    libres = [hora for hora in HORARIOS_OPERACION if ocupacion.esta_libre(hora)]
+                    if libres:
+                        break
+                url = reverse('agendamiento:reservar_vehiculo', kwargs={'vehiculo_id': vehiculo_id, 'fecha_str': fecha.isoformat()})
+                datos_post = {'vehiculo_id': vehiculo_id, 'fecha_reserva': fecha.isoformat(),
+                              'bloques_seleccionados': [rnd.choice(libres).isoformat()]}
+                return lambda: client.post(url, datos_post)
+
+            def mis_reservas():
+                client, _ = rnd.choice(clientes)
+                url = reverse('agendamiento:mis_reservas')
+                parametros = {'vista': rnd.choice([PROXIMAS, PASADAS])}
+                return lambda: client.get(url, parametros)
+
+            resultados = {}
+            for nombre, preparar in (('mostrar_disponibilidad', mostrar_disponibilidad),
+                                     ('reservar_vehiculo', reservar_vehiculo),
+                                     ('mis_reservas', mis_reservas)):
+                preparar()() # Calentamiento (carga de plantillas, conexiones)
+                resultados[nombre] = self._medir(preparar, options['iteraciones'])
+
+            with tempfile.TemporaryDirectory() as directorio:
+                ruta = os.path.join(directorio, 'vehiculos.csv')
+                escribir_csv_vehiculos(ruta, options['filas_csv'], options['semilla'])
+                # La primera importación crea los vehículos; las siguientes los actualizan
+                resultados['load_csv_data'] = self._medir(
+                    lambda: lambda: call_command('load_csv_data', ruta, 'Vehiculo', stdout=StringIO()),
+                    options['iteraciones_csv'],
+                )
+
+        self._reportar(resultados)
+        if options['ruta_json']:
+            informe = {
+                'version': 1,
+                'fecha': timezone.now().isoformat(),
+                'entorno': {'python': platform.python_version(), 'django': django.get_version(), 'bd': connection.vendor},
+                'parametros': {clave: options[clave] for clave in (
+                    'empresas', 'vehiculos', 'usuarios', 'meses', 'ocupacion', 'iteraciones', 'filas_csv',
+                    'iteraciones_csv', 'cache_fria', 'semilla',
+                )},
+                'datos': {'reservas': total_reservas, 'segundos_generacion': round(segundos_generacion, 3)},
+                'escenarios': resultados,
+            }
+            texto = json.dumps(informe, indent=2, ensure_ascii=False)
+            if options['ruta_json'] == '-':
+                self.stdout.write(texto)
+            else:
+                with open(options['ruta_json'], 'w', encoding='utf-8') as archivo:
+                    archivo.write(texto + '\n')
+                self.stdout.write(f"Resultados escritos en {options['ruta_json']}")
+
+    def _medir(self, preparar, iteraciones):
+        """Ejecuta 'iteraciones' solicitudes (preparar() arma cada una fuera de la medición) y resume latencia y consultas."""
+        tiempos, consultas, estados = [], [], {}
+        for _ in range(iteraciones):
+            solicitud = preparar()
+            response, segundos, numero_consultas = medir(solicitud)
+            tiempos.append(segundos * 1000)
+            consultas.append(numero_consultas)
+            estado = str(getattr(response, 'status_code', 'ok'))
+            estados[estado] = estados.get(estado, 0) + 1
+        return {
+            'iteraciones': iteraciones,
+            'p50_ms': round(percentil(tiempos, 50), 3),
+            'p95_ms': round(percentil(tiempos, 95), 3),
+            'max_ms': round(max(tiempos), 3),
+            'consultas_p50': percentil(consultas, 50),
+            'consultas_max': max(consultas),
+            'estados': estados,
+        }
+
+    def _reportar(self, resultados):
+        self.stdout.write(f"{'Escenario':<24} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'máx ms':>9} {'consultas p50/máx':>18}  estados")
+        for nombre, r in resultados.items():
+            self.stdout.write(
+                f"{nombre:<24} {r['iteraciones']:>5} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['max_ms']:>9.1f} "
+                f"{r['consultas_p50']:>8}/{r['consultas_max']:<9}  {r['estados']}"
+            )
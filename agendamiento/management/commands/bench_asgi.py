@@ -0,0 +1,228 @@
+# agendamiento/management/commands/bench_asgi.py
+import asyncio
+import json
+import random
+import threading
+import time as time_module
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client, RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+
+from agendamiento.cache_disponibilidad import cache_disponibilidad
+from agendamiento.paginacion import PASADAS, PROXIMAS
+
+from ._bench import base_de_datos_temporal, generar_datos_sinteticos, percentil
+
+
+DIAS_FUTUROS = 14
+ESCENARIOS = ('mostrar_disponibilidad', 'mis_reservas', 'disponibilidad_rango')
+
+
+class MuestreoHilos:
+    """
+    Máximo de hilos vivos (sin contar el del muestreo) durante el bloque. Bajo ASGI, Django
+    corre las partes síncronas de cada solicitud en un hilo creado para esa solicitud.
+    """
+
+    def __init__(self, intervalo=0.002):
+        self.intervalo = intervalo
+        self.pico = 0
+        self._fin = threading.Event()
+
+    def _muestrear(self):
+        while not self._fin.wait(self.intervalo):
+            self.pico = max(self.pico, threading.active_count() - 1)
+
+    def __enter__(self):
+        self._hilo = threading.Thread(target=self._muestrear, daemon=True)
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._fin.set()
+        self._hilo.join()
+
+
+class Command(BaseCommand):
+    help = ('Compara solicitudes por segundo, latencia y memoria por cliente concurrente de las vistas de lectura '
+            '(disponibilidad, Mis Reservas y la API de rango) bajo WSGI, con un hilo por cliente, y bajo ASGI, '
+            'con una corrutina por cliente. Ambos handlers se llaman en el proceso, sin red ni servidor.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--empresas', type=int, default=3)
+        parser.add_argument('--vehiculos', type=int, default=100, help='Vehículos por empresa.')
+        parser.add_argument('--usuarios', type=int, default=5, help='Usuarios por empresa.')
+        parser.add_argument('--meses', type=int, default=1, help='Meses de reservas hacia atrás (más 2 semanas hacia adelante).')
+        parser.add_argument('--ocupacion', type=float, default=0.4)
+        parser.add_argument('--clientes', default='8,64', help='Niveles de concurrencia separados por coma.')
+        parser.add_argument('--solicitudes', type=int, default=400, help='Solicitudes por escenario, modo y nivel.')
+        parser.add_argument('--cache-fria', action='store_true', help='Desactiva la caché de disponibilidad (cada grilla va a la BD).')
+        parser.add_argument('--json', dest='ruta_json', help="Escribe los resultados en este archivo JSON ('-' para stdout).")
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def handle(self, *args, **options):
+        niveles = [int(n) for n in options['clientes'].split(',')]
+        with base_de_datos_temporal(en_archivo=True):
+            hoy = timezone.localdate()
+            fechas = [hoy + timedelta(days=d) for d in range(-30 * options['meses'], DIAS_FUTUROS + 1)]
+            datos, total_reservas = generar_datos_sinteticos(
+                options['empresas'], options['vehiculos'], options['usuarios'], fechas, options['ocupacion'], options['semilla'],
+            )
+            self.stdout.write(f"Datos: {options['empresas'] * options['vehiculos']} vehículos, {total_reservas} reservas")
+            cookies = []
+            for empresa in datos.values():
+                client = Client()
+                client.force_login(User.objects.get(id=empresa['users'][0]))
+                cookies.append(f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}")
+            if options['cache_fria']:
+                cache_disponibilidad.max_entradas = 0 # Cada entrada se desaloja apenas se guarda
+
+            rnd = random.Random(options['semilla'])
+            resultados = []
+            for escenario in ESCENARIOS:
+                solicitudes = [self._solicitud(escenario, hoy, rnd.choice(cookies), rnd) for _ in range(options['solicitudes'])]
+                for clientes in niveles:
+                    for modo, correr in (('wsgi', self._correr_wsgi), ('asgi', self._correr_asgi)):
+                        correr(solicitudes[:clientes], clientes) # Calentamiento
+                        resultado = self._medir(correr, solicitudes, clientes)
+                        resultados.append({'escenario': escenario, 'modo': modo, 'clientes': clientes, **resultado})
+                        self._reportar(resultados[-1])
+
+        if options['ruta_json']:
+            texto = json.dumps({
+                'version': 1, 'fecha': timezone.now().isoformat(), 'bd': connection.vendor,
+                'parametros': {clave: options[clave] for clave in (
+                    'empresas', 'vehiculos', 'usuarios', 'meses', 'ocupacion', 'clientes', 'solicitudes', 'cache_fria', 'semilla')},
+                'resultados': resultados,
+            }, indent=2, ensure_ascii=False)
+            if options['ruta_json'] == '-':
+                self.stdout.write(texto)
+            else:
+                with open(options['ruta_json'], 'w', encoding='utf-8') as archivo:
+                    archivo.write(texto + '\n')
+
+    def _solicitud(self, escenario, hoy, cookie, rnd):
+        """(path, query_string, cookie) de una solicitud del escenario."""
+        if escenario == 'mostrar_disponibilidad':
+            fecha = hoy + timedelta(days=rnd.randint(1, DIAS_FUTUROS))
+            return reverse('agendamiento:mostrar_disponibilidad', kwargs={'fecha_str': fecha.isoformat()}), '', cookie
+        if escenario == 'mis_reservas':
+            return reverse('agendamiento:mis_reservas'), urlencode({'vista': rnd.choice([PROXIMAS, PASADAS])}), cookie
+        desde = hoy + timedelta(days=rnd.randint(0, DIAS_FUTUROS))
+        query = urlencode({'desde': desde.isoformat(), 'hasta': (desde + timedelta(days=6)).isoformat()})
+        return reverse('agendamiento:disponibilidad_rango'), query, cookie
+
+    def _medir(self, correr, solicitudes, clientes):
+        with MuestreoHilos() as muestreo:
+            inicio = time_module.perf_counter()
+            tiempos, estados = correr(solicitudes, clientes)
+            segundos = time_module.perf_counter() - inicio
+
+        # Memoria en una pasada aparte: tracemalloc frena mucho las solicitudes
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        correr(solicitudes[:clientes * 2], clientes)
+        pico = tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+        return {
+            'solicitudes': len(tiempos),
+            'solicitudes_por_segundo': round(len(tiempos) / segundos, 1),
+            'p50_ms': round(percentil(tiempos, 50), 3),
+            'p95_ms': round(percentil(tiempos, 95), 3),
+            'kib_por_cliente': round(pico / clientes / 1024, 1), # Heap de Python; no incluye la pila de cada hilo
+            'hilos_pico': muestreo.pico,
+            'estados': estados,
+        }
+
+    def _correr_wsgi(self, solicitudes, clientes):
+        """Un hilo por cliente, cada uno llamando al WSGIHandler como lo haría un servidor con hilos."""
+        handler = WSGIHandler()
+        fabrica = RequestFactory()
+        pendientes = iter(solicitudes)
+        lock = threading.Lock()
+        tiempos, estados = [], {}
+
+        def cliente():
+            while True:
+                with lock:
+                    solicitud = next(pendientes, None)
+                if solicitud is None:
+                    break
+                path, query, cookie = solicitud
+                environ = fabrica.get(path, QUERY_STRING=query, HTTP_COOKIE=cookie).environ
+                estado = []
+                inicio = time_module.perf_counter()
+                respuesta = handler(environ, lambda status, headers: estado.append(status.split()[0]))
+                b''.join(respuesta)
+                respuesta.close()
+                with lock:
+                    tiempos.append((time_module.perf_counter() - inicio) * 1000)
+                    estados[estado[0]] = estados.get(estado[0], 0) + 1
+            connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=clientes) as ejecutor:
+            for futuro in [ejecutor.submit(cliente) for _ in range(clientes)]:
+                futuro.result()
+        return tiempos, estados
+
+    def _correr_asgi(self, solicitudes, clientes):
+        """Una corrutina por cliente en un solo event loop, llamando a la aplicación ASGI."""
+        aplicacion = get_asgi_application()
+        pendientes = iter(solicitudes)
+        tiempos, estados = [], {}
+
+        async def solicitar(path, query, cookie):
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+                'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+                'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+                'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+            }
+            recibido = []
+
+            async def receive():
+                if not recibido:
+                    recibido.append(True)
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await asyncio.Event().wait() # El cliente no se desconecta; Django cancela esta espera al responder
+
+            estado = []
+
+            async def send(mensaje):
+                if mensaje['type'] == 'http.response.start':
+                    estado.append(str(mensaje['status']))
+
+            await aplicacion(scope, receive, send)
+            return estado[0]
+
+        async def cliente():
+            while (solicitud := next(pendientes, None)) is not None:
+                inicio = time_module.perf_counter()
+                estado = await solicitar(*solicitud)
+                tiempos.append((time_module.perf_counter() - inicio) * 1000)
+                estados[estado] = estados.get(estado, 0) + 1
+
+        async def correr():
+            await asyncio.gather(*(cliente() for _ in range(clientes)))
+
+        asyncio.run(correr())
+        connections.close_all()
+        return tiempos, estados
+
+    def _reportar(self, r):
+        self.stdout.write(
+            f"{r['escenario']:<24} {r['modo']:<5} clientes={r['clientes']:<4} {r['solicitudes_por_segundo']:>8.1f} sol/s "
+            f"p50 {r['p50_ms']:>7.1f} ms  p95 {r['p95_ms']:>7.1f} ms  {r['kib_por_cliente']:>7.1f} KiB/cliente  "
+            f"hilos={r['hilos_pico']}  {r['estados']}"
+        )
@@ -0,0 +1,114 @@
+# agendamiento/management/commands/bench_consultas.py
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from agendamiento.cache_disponibilidad import cache_disponibilidad
+from agendamiento.disponibilidad import HORARIOS_OPERACION
+from agendamiento.models import OcupacionVehiculoDia, Reserva, UsuarioSistema
+
+from ._bench import base_de_datos_temporal, crear_empresa_sintetica, medir
+
+
+CLAVE = 'clave-bench-123'
+
+
+class Command(BaseCommand):
+    help = ('Cuenta las consultas a la base de datos de una solicitud típica a cada vista de agendamiento/urls.py, '
+            'con un usuario con sesión iniciada (login y registro, sin sesión) y las cachés ya calientes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehiculos', type=int, default=20, help='Vehículos de la empresa sintética.')
+        parser.add_argument('--sesiones', default='db,cached_db,signed_cookies',
+                            help='Motores de sesión a comparar (módulos de django.contrib.sessions.backends), separados por coma.')
+        parser.add_argument('--json', dest='ruta_json', help="Escribe los resultados en este archivo JSON ('-' para stdout).")
+
+    def handle(self, *args, **options):
+        fecha = timezone.localdate() + timedelta(days=1)
+        with base_de_datos_temporal():
+            user, = crear_empresa_sintetica('Bench', options['vehiculos'], 1, [fecha], ocupacion=0.3)
+            user.set_password(CLAVE)
+            user.save()
+            resultados = {}
+            for motor in options['sesiones'].split(','):
+                with override_settings(SESSION_ENGINE=f"django.contrib.sessions.backends.{motor}"):
+                    resultados[motor] = self._escenarios(user, fecha)
+
+        nombres = list(next(iter(resultados.values())))
+        self.stdout.write(f"{'':<28} " + ''.join(f"{motor:>16}" for motor in resultados))
+        for nombre in nombres:
+            self.stdout.write(f"{nombre:<28} " + ''.join(
+                f"{'%s: %d' % (por_motor[nombre]['estado'], por_motor[nombre]['consultas']):>16}" for por_motor in resultados.values()
+            ))
+        if options['ruta_json']:
+            texto = json.dumps({'version': 1, 'fecha': timezone.now().isoformat(),
+                                'parametros': {clave: options[clave] for clave in ('vehiculos', 'sesiones')},
+                                'resultados': resultados}, indent=2, ensure_ascii=False)
+            if options['ruta_json'] == '-':
+                self.stdout.write(texto)
+            else:
+                with open(options['ruta_json'], 'w', encoding='utf-8') as archivo:
+                    archivo.write(texto + '\n')
+
+    def _escenarios(self, user, fecha):
+        # Cada corrida reserva un bloque libre y cancela una reserva distinta
+        perfil = UsuarioSistema.objects.select_related('empresa').get(user=user)
+        vehiculo_id = perfil.empresa.vehiculos.values_list('id', flat=True).first()
+        reserva = Reserva.objects.filter(usuario=perfil).first()
+        ocupacion = OcupacionVehiculoDia.obtener(vehiculo_id, fecha)
+        libre = next(hora for hora in HORARIOS_OPERACION if ocupacion.esta_libre(hora))
+        # La serie semanal de un año va en un vehículo sin reservas desde la semana siguiente (uno por corrida)
+        vehiculo_serie_id = perfil.empresa.vehiculos.exclude(reservas__fecha_reserva__gt=fecha).values_list('id', flat=True).first()
+        fecha_iso = fecha.isoformat()
+
+        escenarios = [
+            ('pagina_inicio_o_perfil', 'get', reverse('agendamiento:pagina_inicio_o_perfil'), {}),
+            ('seleccionar_fecha', 'get', reverse('agendamiento:seleccionar_fecha'), {}),
+            ('seleccionar_fecha (POST)', 'post', reverse('agendamiento:seleccionar_fecha'), {'fecha': fecha_iso}),
+            ('mostrar_disponibilidad', 'get', reverse('agendamiento:mostrar_disponibilidad', kwargs={'fecha_str': fecha_iso}), {}),
+            ('eventos_disponibilidad', 'get', reverse('agendamiento:eventos_disponibilidad', kwargs={'fecha_str': fecha_iso}), {}),
+            ('disponibilidad_rango', 'get', reverse('agendamiento:disponibilidad_rango'),
+             {'desde': fecha_iso, 'hasta': (fecha + timedelta(days=6)).isoformat()}),
+            ('reservar_vehiculo', 'get', reverse('agendamiento:reservar_vehiculo', kwargs={'vehiculo_id': vehiculo_id, 'fecha_str': fecha_iso}), {}),
+            ('reservar_vehiculo (POST)', 'post', reverse('agendamiento:reservar_vehiculo', kwargs={'vehiculo_id': vehiculo_id, 'fecha_str': fecha_iso}),
+             {'vehiculo_id': vehiculo_id, 'fecha_reserva': fecha_iso, 'bloques_seleccionados': [libre.isoformat()]}),
+            ('reservar_serie (52 semanas)', 'post', reverse('agendamiento:reservar_serie', kwargs={'vehiculo_id': vehiculo_serie_id}),
+             {'fecha_inicio': (fecha + timedelta(weeks=1)).isoformat(), 'frecuencia': 'semanal', 'repeticiones': 52,
+              'bloques_seleccionados': [HORARIOS_OPERACION[0].isoformat()]}),
+            ('mis_reservas', 'get', reverse('agendamiento:mis_reservas'), {}),
+            ('mis_reservas (cancelar)', 'post', reverse('agendamiento:mis_reservas'), {'reserva_id': reserva.id}),
+            ('metricas', 'get', reverse('agendamiento:metricas'), {}),
+            ('logout', 'get', reverse('agendamiento:logout'), {}),
+        ]
+        resultados = {}
+        client = Client()
+        client.force_login(user)
+        for nombre, metodo, url, datos in escenarios:
+            # Se mide la segunda solicitud de cada GET: la primera calienta las cachés de plantillas, datos y perfil
+            if nombre == 'logout':
+                getattr(client, metodo)(url, datos)
+                client.force_login(user)
+            elif metodo == 'get':
+                client.get(url, datos)
+            resultados[nombre] = self._contar(client, metodo, url, datos)
+        cache_disponibilidad.limpiar()
+
+        # Sin sesión iniciada
+        anonimo = Client()
+        for nombre, metodo, url, datos in (
+            ('login', 'get', reverse('agendamiento:login'), {}),
+            ('login (POST)', 'post', reverse('agendamiento:login'), {'username': user.username, 'password': CLAVE}),
+            ('registro', 'get', reverse('agendamiento:registro'), {}),
+        ):
+            anonimo.get(url)
+            resultados[nombre] = self._contar(anonimo, metodo, url, datos)
+            anonimo.logout()
+        return resultados
+
+    def _contar(self, client, metodo, url, datos):
+        respuesta, _, consultas = medir(lambda: getattr(client, metodo)(url, datos))
+        return {'estado': respuesta.status_code, 'consultas': consultas}
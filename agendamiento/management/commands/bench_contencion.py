@@ -0,0 +1,94 @@
+# agendamiento/management/commands/bench_contencion.py
+import random
+import threading
+import time as time_module
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.db.models import Count
+from django.utils import timezone
+
+from agendamiento.disponibilidad import HORARIOS_OPERACION
+from agendamiento.models import Vehiculo, UsuarioSistema, Reserva, OcupacionVehiculoDia
+from agendamiento.reservas import reservar_bloques, RESERVADA
+
+from ._bench import base_de_datos_temporal, crear_empresa_sintetica
+
+
+class Command(BaseCommand):
+    help = ('Dispara cientos de reservas simultáneas sobre el mismo vehículo-día desde varios hilos y '
+            'reporta throughput, reintentos, reservas perdidas y duplicadas (el objetivo es cero).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--solicitudes', type=int, default=300, help='Reservas a disparar.')
+        parser.add_argument('--hilos', type=int, default=32, help='Hilos concurrentes.')
+        parser.add_argument('--bloques-por-solicitud', type=int, default=1, help='Bloques pedidos en cada reserva.')
+        parser.add_argument('--timeout-bd', type=float, default=None,
+                            help='Timeout de espera por bloqueo de la BD en segundos (SQLite). Bajo = más reintentos.')
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['timeout_bd'] is not None:
+            connection.settings_dict.setdefault('OPTIONS', {})['timeout'] = options['timeout_bd']
+
+        with base_de_datos_temporal(en_archivo=True):
+            fecha = timezone.now().date() + timedelta(days=1)
+            crear_empresa_sintetica('Contencion', 1, options['hilos'], [], semilla=options['semilla'])
+            vehiculo = Vehiculo.objects.get(empresa__razon_social='Contencion')
+            perfiles = list(UsuarioSistema.objects.filter(empresa__razon_social='Contencion'))
+
+            rnd = random.Random(options['semilla'])
+            pedidos = [
+                (rnd.choice(perfiles), rnd.sample(HORARIOS_OPERACION, options['bloques_por_solicitud']))
+                for _ in range(options['solicitudes'])
+            ]
+            barrera = threading.Barrier(min(options['hilos'], len(pedidos)))
+
+            def reservar(pedido):
+                perfil, horas = pedido
+                try:
+                    try:
+                        barrera.wait(timeout=5) # Los primeros pedidos parten todos a la vez
+                    except threading.BrokenBarrierError:
+                        pass
+                    return reservar_bloques(vehiculo, fecha, perfil, horas)
+                except Exception as e:
+                    return e
+                finally:
+                    connections.close_all()
+
+            inicio = time_module.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['hilos']) as pool:
+                resultados = list(pool.map(reservar, pedidos))
+            segundos = time_module.perf_counter() - inicio
+
+            estados = Counter(r.estado if not isinstance(r, Exception) else type(r).__name__ for r in resultados)
+            reintentos = sum(r.reintentos for r in resultados if not isinstance(r, Exception))
+            ids_confirmados = {reserva.id for r in resultados if not isinstance(r, Exception) and r.estado == RESERVADA for reserva in r.reservas}
+
+            ids_en_bd = set(Reserva.objects.filter(vehiculo=vehiculo, fecha_reserva=fecha).values_list('id', flat=True))
+            perdidas = len(ids_confirmados - ids_en_bd)
+            duplicadas = sum(
+                fila['n'] - 1 for fila in
+                Reserva.objects.filter(vehiculo=vehiculo, fecha_reserva=fecha)
+                .values('hora_inicio_reserva').annotate(n=Count('id')).filter(n__gt=1)
+            )
+            fantasmas = len(ids_en_bd - ids_confirmados) # En BD pero informadas como fallidas
+            mascara_esperada = OcupacionVehiculoDia.mascara_de_horas(
+                Reserva.objects.filter(vehiculo=vehiculo, fecha_reserva=fecha).values_list('hora_inicio_reserva', flat=True)
+            )
+            indice_consistente = OcupacionVehiculoDia.obtener(vehiculo.id, fecha).mascara == mascara_esperada
+
+            self.stdout.write(f"Solicitudes: {len(pedidos)} en {segundos:.2f} s ({len(pedidos) / segundos:.1f} solicitudes/s) con {options['hilos']} hilos")
+            for estado, cantidad in sorted(estados.items()):
+                self.stdout.write(f"  {estado:<24} {cantidad}")
+            self.stdout.write(f"Reintentos por bloqueo: {reintentos}")
+            self.stdout.write(f"Reservas confirmadas: {len(ids_confirmados)}  en BD: {len(ids_en_bd)}")
+            self.stdout.write(f"Perdidas: {perdidas}  Duplicadas: {duplicadas}  No informadas: {fantasmas}  Índice consistente: {indice_consistente}")
+            if perdidas or duplicadas or fantasmas or not indice_consistente:
+                self.stdout.write(self.style.ERROR("Se detectaron inconsistencias."))
+            else:
+                self.stdout.write(self.style.SUCCESS("Sin reservas perdidas ni duplicadas."))
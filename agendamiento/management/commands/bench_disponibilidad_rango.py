@@ -0,0 +1,48 @@
+# agendamiento/management/commands/bench_disponibilidad_rango.py
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from ._bench import base_de_datos_temporal, crear_empresa_sintetica, medir
+
+
+class Command(BaseCommand):
+    help = ('Compara la API JSON de disponibilidad por rango contra N cargas de la vista '
+            'mostrar_disponibilidad (una por día), sobre una base de datos temporal.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehiculos', type=int, default=100, help='Vehículos de la empresa sintética.')
+        parser.add_argument('--dias', type=int, default=7, help='Días a consultar (máximo 31).')
+        parser.add_argument('--repeticiones', type=int, default=5, help='Repeticiones de cada medición.')
+
+    def handle(self, *args, **options):
+        dias = options['dias']
+        with base_de_datos_temporal():
+            desde = timezone.now().date()
+            fechas = [desde + timedelta(days=d) for d in range(dias)]
+            user, = crear_empresa_sintetica('Bench', options['vehiculos'], 1, fechas)
+            client = Client()
+            client.force_login(user)
+
+            def vista_por_dia():
+                for fecha in fechas:
+                    client.get(reverse('agendamiento:mostrar_disponibilidad', kwargs={'fecha_str': fecha.isoformat()}))
+
+            url_rango = reverse('agendamiento:disponibilidad_rango')
+            parametros = {'desde': fechas[0].isoformat(), 'hasta': fechas[-1].isoformat()}
+
+            def api_rango():
+                client.get(url_rango, parametros)
+
+            for nombre, funcion in ((f"Vista HTML x {dias}", vista_por_dia), ("API JSON de rango", api_rango)):
+                tiempos = []
+                for _ in range(options['repeticiones']):
+                    _, segundos, consultas = medir(funcion)
+                    tiempos.append(segundos)
+                self.stdout.write(
+                    f"{nombre:<22} mejor={min(tiempos) * 1000:8.1f} ms  "
+                    f"promedio={sum(tiempos) / len(tiempos) * 1000:8.1f} ms  consultas={consultas}"
+                )
@@ -0,0 +1,180 @@
+# agendamiento/management/commands/bench_eventos.py
+import asyncio
+import json
+import random
+import threading
+import time as time_module
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client
+from django.utils.module_loading import import_string
+from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils import timezone
+
+from agendamiento.disponibilidad import HORARIOS_OPERACION
+from agendamiento.eventos import difusor
+from agendamiento.models import Vehiculo, UsuarioSistema
+from agendamiento.reservas import reservar_bloques
+
+from ._bench import base_de_datos_temporal, generar_datos_sinteticos, percentil
+
+
+class ConexionSimulada:
+    """Un navegador con EventSource abierto, hablando ASGI directo con la aplicación (sin sockets)."""
+
+    def __init__(self, path, cookie):
+        self.scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'accept', b'text/event-stream'), (b'cookie', cookie.encode())],
+            'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+        }
+        self.estado = None
+        self.suscrita = asyncio.Event()
+        self.cerrar = asyncio.Event()
+        self.solicitud_enviada = False
+        self.recibidos = [] # perf_counter() de cada evento 'bloques'
+
+    async def receive(self):
+        if not self.solicitud_enviada:
+            self.solicitud_enviada = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.cerrar.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, mensaje):
+        if mensaje['type'] == 'http.response.start':
+            self.estado = mensaje['status']
+        elif mensaje['type'] == 'http.response.body':
+            cuerpo = mensaje.get('body', b'')
+            if cuerpo.startswith(b'retry:'):
+                self.suscrita.set() # El primer trozo se envía después de suscribirse
+            elif b'event: bloques' in cuerpo:
+                self.recibidos.append(time_module.perf_counter())
+            if not mensaje.get('more_body', False):
+                self.suscrita.set() # Respuesta terminada (error): no esperar más
+
+
+class Command(BaseCommand):
+    help = ('Abre miles de conexiones de eventos de disponibilidad contra la aplicación ASGI (en el proceso, sin red), '
+            'crea reservas y mide la latencia desde la reserva hasta que cada conexión recibe el evento.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conexiones', type=int, default=2000, help='Conexiones abiertas (repartidas entre empresas).')
+        parser.add_argument('--empresas', type=int, default=2)
+        parser.add_argument('--vehiculos', type=int, default=20, help='Vehículos por empresa.')
+        parser.add_argument('--reservas', type=int, default=20, help='Reservas a difundir.')
+        parser.add_argument('--json', dest='ruta_json', help="Escribe los resultados en este archivo JSON ('-' para stdout).")
+        parser.add_argument('--semilla', type=int, default=0)
+        parser.add_argument('--solo-django', action='store_true',
+                            help='Usa get_asgi_application() sin ConEventosDisponibilidad (un hilo por conexión abierta).')
+
+    def handle(self, *args, **options):
+        with base_de_datos_temporal(en_archivo=True):
+            fecha = timezone.localdate() + timedelta(days=1)
+            datos, _ = generar_datos_sinteticos(options['empresas'], options['vehiculos'], 1, [], semilla=options['semilla'])
+            # Una sesión por empresa, compartida por todas sus conexiones
+            sesiones = {}
+            for empresa_id, empresa in datos.items():
+                client = Client()
+                client.force_login(User.objects.get(id=empresa['users'][0]))
+                sesiones[empresa_id] = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+            resultados = asyncio.run(self._carga(datos, sesiones, fecha, options))
+
+        self._reportar(resultados)
+        if options['ruta_json']:
+            texto = json.dumps({'version': 1, 'fecha': timezone.now().isoformat(), 'bd': connection.vendor,
+                                'parametros': {clave: options[clave] for clave in ('conexiones', 'empresas', 'vehiculos', 'reservas', 'semilla', 'solo_django')},
+                                'resultados': resultados}, indent=2, ensure_ascii=False)
+            if options['ruta_json'] == '-':
+                self.stdout.write(texto)
+            else:
+                with open(options['ruta_json'], 'w', encoding='utf-8') as archivo:
+                    archivo.write(texto + '\n')
+
+    async def _carga(self, datos, sesiones, fecha, options):
+        aplicacion = get_asgi_application() if options['solo_django'] else import_string(settings.ASGI_APPLICATION)
+        hilos_iniciales = threading.active_count()
+        path = reverse('agendamiento:eventos_disponibilidad', kwargs={'fecha_str': fecha.isoformat()})
+        empresas = list(datos)
+        conexiones = {empresa_id: [] for empresa_id in empresas}
+
+        tracemalloc.start()
+        memoria_inicial = tracemalloc.get_traced_memory()[0]
+        inicio = time_module.perf_counter()
+        tareas = []
+        for i in range(options['conexiones']):
+            empresa_id = empresas[i % len(empresas)]
+            conexion = ConexionSimulada(path, sesiones[empresa_id])
+            conexiones[empresa_id].append(conexion)
+            tareas.append(asyncio.ensure_future(aplicacion(conexion.scope, conexion.receive, conexion.send)))
+        todas = [c for grupo in conexiones.values() for c in grupo]
+        await asyncio.gather(*(c.suscrita.wait() for c in todas))
+        segundos_conexion = time_module.perf_counter() - inicio
+        # Con todas las conexiones abiertas e inactivas: cada hilo de más es un hilo retenido por conexiones
+        hilos_max = threading.active_count()
+        bytes_por_conexion = (tracemalloc.get_traced_memory()[0] - memoria_inicial) / len(todas)
+        tracemalloc.stop()
+        errores = sum(1 for c in todas if c.estado != 200)
+        self.stdout.write(f"{len(todas)} conexiones abiertas en {segundos_conexion:.2f} s "
+                          f"({difusor.suscriptores()} suscritas, {errores} con error, ~{bytes_por_conexion / 1024:.1f} KiB c/u, "
+                          f"{hilos_max} hilos; {hilos_iniciales} antes de conectar)")
+
+        # Las reservas se escriben en un hilo propio, como lo haría una vista síncrona de otro cliente
+        rnd = random.Random(options['semilla'])
+        loop = asyncio.get_running_loop()
+        latencias, escrituras, perdidos = [], [], 0
+        with ThreadPoolExecutor(max_workers=1) as ejecutor:
+            bloques = {empresa_id: [(v, h) for v in datos[empresa_id]['vehiculos'] for h in HORARIOS_OPERACION] for empresa_id in empresas}
+            for n in range(options['reservas']):
+                empresa_id = empresas[n % len(empresas)]
+                vehiculo_id, hora = bloques[empresa_id].pop(rnd.randrange(len(bloques[empresa_id])))
+                destinatarios = conexiones[empresa_id]
+                previos = [len(c.recibidos) for c in destinatarios]
+                inicio = time_module.perf_counter()
+                await loop.run_in_executor(ejecutor, self._reservar, vehiculo_id, datos[empresa_id]['perfiles'][0], fecha, hora)
+                hilos_max = max(hilos_max, threading.active_count())
+                escrituras.append((time_module.perf_counter() - inicio) * 1000)
+                limite = time_module.perf_counter() + 10
+                while any(len(c.recibidos) == p for c, p in zip(destinatarios, previos)) and time_module.perf_counter() < limite:
+                    await asyncio.sleep(0.001)
+                for c, p in zip(destinatarios, previos):
+                    if len(c.recibidos) > p:
+                        latencias.append((c.recibidos[p] - inicio) * 1000)
+                    else:
+                        perdidos += 1
+            await loop.run_in_executor(ejecutor, connections.close_all)
+
+        for conexion in todas:
+            conexion.cerrar.set()
+        await asyncio.gather(*tareas)
+        return {
+            'conexiones': len(todas), 'conexiones_con_error': errores,
+            'segundos_conexion': round(segundos_conexion, 3), 'bytes_por_conexion': round(bytes_por_conexion),
+            'hilos_iniciales': hilos_iniciales, 'hilos_max': hilos_max,
+            'reservas': options['reservas'], 'entregas': len(latencias), 'perdidos': perdidos,
+            'escritura_p50_ms': round(percentil(escrituras, 50), 3),
+            'latencia_p50_ms': round(percentil(latencias, 50), 3) if latencias else None,
+            'latencia_p95_ms': round(percentil(latencias, 95), 3) if latencias else None,
+            'latencia_max_ms': round(max(latencias), 3) if latencias else None,
+            'suscriptores_al_terminar': difusor.suscriptores(),
+        }
+
+    def _reservar(self, vehiculo_id, perfil_id, fecha, hora):
+        reservar_bloques(Vehiculo.objects.select_related('empresa').get(id=vehiculo_id), fecha,
+                         UsuarioSistema.objects.get(id=perfil_id), [hora])
+
+    def _reportar(self, r):
+        self.stdout.write(f"Reservas: {r['reservas']}, entregas: {r['entregas']}, perdidas: {r['perdidos']}, "
+                          f"escritura p50 {r['escritura_p50_ms']:.1f} ms")
+        if r['latencia_p50_ms'] is not None:
+            self.stdout.write(f"Latencia reserva -> evento en el cliente: p50 {r['latencia_p50_ms']:.1f} ms, "
+                              f"p95 {r['latencia_p95_ms']:.1f} ms, máx {r['latencia_max_ms']:.1f} ms")
+        self.stdout.write(f"Suscriptores al cerrar las conexiones: {r['suscriptores_al_terminar']}")
@@ -0,0 +1,66 @@
+# agendamiento/management/commands/bench_importacion.py
+import csv
+import os
+import tempfile
+import time as time_module
+from io import StringIO
+from itertools import islice
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from agendamiento.importacion import parsear_lote_vehiculos
+
+from ._bench import base_de_datos_temporal, escribir_csv_vehiculos
+from .load_csv_data import Command as LoadCsvDataCommand
+
+
+class Command(BaseCommand):
+    help = ('Genera un CSV de vehículos sintético (500k filas por defecto) y mide la etapa de parseo y la '
+            'importación completa de load_csv_data con distintos números de procesos de parseo.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filas', type=int, default=500_000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--workers', type=str, default='1,2,4', help='Lista separada por comas.')
+        parser.add_argument('--solo-parseo', action='store_true', help='No mide la importación completa a la BD.')
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def _medir_parseo(self, ruta, batch_size, workers):
+        comando = LoadCsvDataCommand(stdout=StringIO())
+        with open(ruta, encoding='utf-8-sig') as archivo:
+            reader = csv.DictReader(archivo)
+            reader.fieldnames # Lee el encabezado
+            comando._fieldnames = reader.fieldnames
+            filas = comando._filas_numeradas(reader)
+            lotes = iter(lambda: list(islice(filas, batch_size)), [])
+            inicio = time_module.perf_counter()
+            if workers > 1:
+                lotes_parseados = comando._parsear_en_paralelo(lotes, workers)
+            else:
+                lotes_parseados = (parsear_lote_vehiculos(reader.fieldnames, lote) for lote in lotes)
+            total = sum(lote.filas_leidas for lote in lotes_parseados)
+            return total, time_module.perf_counter() - inicio
+
+    def handle(self, *args, **options):
+        lista_workers = [int(w) for w in options['workers'].split(',')]
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, 'vehiculos.csv')
+            inicio = time_module.perf_counter()
+            escribir_csv_vehiculos(ruta, options['filas'], options['semilla'])
+            self.stdout.write(f"CSV de {options['filas']} filas generado en {time_module.perf_counter() - inicio:.1f} s")
+
+            for workers in lista_workers:
+                total, segundos = self._medir_parseo(ruta, options['batch_size'], workers)
+                self.stdout.write(f"Parseo       workers={workers:<2} {total} filas en {segundos:6.2f} s ({total / segundos:10.0f} filas/s)")
+
+            if options['solo_parseo']:
+                return
+            for workers in lista_workers:
+                with base_de_datos_temporal(en_archivo=True): # Una BD nueva por medición
+                    salida = StringIO()
+                    inicio = time_module.perf_counter()
+                    call_command('load_csv_data', ruta, 'Vehiculo', batch_size=options['batch_size'], workers=workers, stdout=salida)
+                    segundos = time_module.perf_counter() - inicio
+                resumen = salida.getvalue().strip().splitlines()[-1]
+                self.stdout.write(f"Importación  workers={workers:<2} {segundos:6.2f} s | {resumen}")
@@ -0,0 +1,70 @@
+# agendamiento/management/commands/bench_plantillas.py
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from agendamiento import metricas
+
+from ._bench import base_de_datos_temporal, crear_empresa_sintetica
+
+
+VISTA = 'agendamiento:mostrar_disponibilidad'
+
+
+class Command(BaseCommand):
+    help = ('Mide cuánto del tiempo de mostrar_disponibilidad se va en renderizar la plantilla, con una flota '
+            'grande y la caché de disponibilidad caliente. Usa los histogramas de MetricasMiddleware.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehiculos', type=int, default=500, help='Vehículos de la empresa sintética.')
+        parser.add_argument('--repeticiones', type=int, default=50, help='Solicitudes medidas.')
+        parser.add_argument('--ocupacion', type=float, default=0.4)
+        parser.add_argument('--json', dest='ruta_json', help="Escribe los resultados en este archivo JSON ('-' para stdout).")
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'AGENDAMIENTO_METRICAS_ACTIVAS', True):
+            raise CommandError("Se necesita AGENDAMIENTO_METRICAS_ACTIVAS = True para medir el tiempo de plantillas.")
+        fecha = timezone.localdate() + timedelta(days=1)
+        with base_de_datos_temporal():
+            user, = crear_empresa_sintetica('Bench', options['vehiculos'], 1, [fecha], options['ocupacion'])
+            client = Client()
+            client.force_login(user)
+            url = reverse(VISTA, kwargs={'fecha_str': fecha.isoformat()})
+            client.get(url) # Calentamiento: carga la plantilla y llena la caché de disponibilidad
+
+            metricas.reiniciar()
+            tamano = 0
+            for _ in range(options['repeticiones']):
+                tamano = len(client.get(url).content)
+            segundos, solicitudes = metricas.SOLICITUD_SEGUNDOS.resumen(VISTA)
+            segundos_plantillas, _ = metricas.PLANTILLAS_SEGUNDOS.resumen(VISTA)
+            segundos_consultas, _ = metricas.CONSULTAS_BD_SEGUNDOS.resumen(VISTA)
+            metricas.reiniciar()
+
+        resultado = {
+            'solicitudes': solicitudes,
+            'solicitud_ms': round(segundos / solicitudes * 1000, 3),
+            'plantilla_ms': round(segundos_plantillas / solicitudes * 1000, 3),
+            'consultas_ms': round(segundos_consultas / solicitudes * 1000, 3),
+            'fraccion_plantilla': round(segundos_plantillas / segundos, 3),
+            'bytes_html': tamano,
+        }
+        self.stdout.write(
+            f"{options['vehiculos']} vehículos, {solicitudes} solicitudes: {resultado['solicitud_ms']:.1f} ms por solicitud, "
+            f"plantilla {resultado['plantilla_ms']:.1f} ms ({resultado['fraccion_plantilla']:.0%}), "
+            f"consultas {resultado['consultas_ms']:.1f} ms, HTML {tamano / 1024:.0f} KiB"
+        )
+        if options['ruta_json']:
+            texto = json.dumps({'version': 1, 'fecha': timezone.now().isoformat(),
+                                'parametros': {clave: options[clave] for clave in ('vehiculos', 'repeticiones', 'ocupacion')},
+                                'resultado': resultado}, indent=2, ensure_ascii=False)
+            if options['ruta_json'] == '-':
+                self.stdout.write(texto)
+            else:
+                with open(options['ruta_json'], 'w', encoding='utf-8') as archivo:
+                    archivo.write(texto + '\n')
@@ -0,0 +1,54 @@
+# agendamiento/management/commands/bench_validadores.py
+import random
+import re
+import time as time_module
+
+from django.core.management.base import BaseCommand
+
+from agendamiento.validadores import (
+    digito_verificador, normalizar_patente, normalizar_patentes, verificar_rut, verificar_ruts,
+)
+
+
+def _rut_formato_anterior(rut_str):
+    # Validación previa a agendamiento.validadores: solo formato, patrón recompilado vía re.match
+    return bool(re.match(r'^\d{1,2}\.\d{3}\.\d{3}-[\dkK]$', rut_str))
+
+
+class Command(BaseCommand):
+    help = ('Micro-benchmark de agendamiento.validadores: costo por valor (ns) de la verificación de RUTs '
+            'y la normalización de patentes, valor a valor y por columna (1 millón de valores por defecto).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--valores', type=int, default=1_000_000)
+        parser.add_argument('--distintos', type=int, default=500,
+                            help='RUTs distintos en la columna "repetida" (en un CSV real se repite el RUT de la empresa).')
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def _medir(self, nombre, funcion, cantidad):
+        inicio = time_module.perf_counter()
+        funcion()
+        segundos = time_module.perf_counter() - inicio
+        self.stdout.write(f"{nombre:<42} {segundos:7.2f} s {segundos / cantidad * 1e9:9.0f} ns/valor")
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['semilla'])
+        cantidad = options['valores']
+
+        def rut_aleatorio():
+            cuerpo = str(rnd.randint(1_000_000, 99_999_999))
+            return f"{cuerpo}-{digito_verificador(cuerpo)}"
+
+        ruts_distintos = [rut_aleatorio() for _ in range(cantidad)]
+        base = [rut_aleatorio() for _ in range(options['distintos'])]
+        ruts_repetidos = [rnd.choice(base) for _ in range(cantidad)]
+        ruts_formateados = [verificar_rut(rut)[0] for rut in ruts_distintos]
+        patentes = [f"{rnd.randrange(16 ** 6):06X}".lower() for _ in range(cantidad)]
+        self.stdout.write(f"{cantidad} valores por medición")
+
+        self._medir("RUT formato anterior (re.match)", lambda: [_rut_formato_anterior(r) for r in ruts_formateados], cantidad)
+        self._medir("verificar_rut valor a valor", lambda: [verificar_rut(r) for r in ruts_distintos], cantidad)
+        self._medir("verificar_ruts columna (distintos)", lambda: verificar_ruts(ruts_distintos), cantidad)
+        self._medir(f"verificar_ruts columna ({options['distintos']} distintos)", lambda: verificar_ruts(ruts_repetidos), cantidad)
+        self._medir("normalizar_patente valor a valor", lambda: [normalizar_patente(p) for p in patentes], cantidad)
+        self._medir("normalizar_patentes columna", lambda: normalizar_patentes(patentes), cantidad)
@@ -1,12 +1,26 @@
 # agendamiento/management/commands/load_csv_data.py
 import csv
 from django.core.management.base import BaseCommand, CommandError
+from django.core.exceptions import ValidationError
 from django.db import IntegrityError, transaction
-from agendamiento.models import Vehiculo, UsuarioSistema
+from agendamiento.models import Empresa, Vehiculo, UsuarioSistema
 from django.contrib.auth.models import User
+from django.contrib.auth.hashers import make_password
 from django.utils import timezone
-import re # Para validaciones
+import time as time_module
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from datetime import time
+from agendamiento.cache_disponibilidad import cache_disponibilidad
+from agendamiento.importacion import (
+    ERROR, clave_empresa, parsear_fila_vehiculo, parsear_lote_vehiculos,
+    parsear_fila_usuario, username_disponible, hashear_claves,
+)
+from agendamiento.validadores import normalizar_patente, verificar_rut
+from django.contrib.auth.tokens import default_token_generator
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
 
 class Command(BaseCommand):
     help = 'Carga datos desde un archivo CSV a los modelos Vehiculo o UsuarioSistema.'
@@ -14,6 +28,20 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('csv_file', type=str, help='La ruta completa al archivo CSV.')
         parser.add_argument('model_name', type=str, help='El nombre del modelo a cargar (Vehiculo o UsuarioSistema).')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='(Vehiculo) Procesa el CSV en lotes de este tamaño con bulk_create/bulk_update, '
+                                 'confirmando cada lote por separado. '
+                                 '(UsuarioSistema) Activa el aprovisionamiento masivo con bulk_create.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='(Vehiculo) Procesos para parsear y validar los lotes en paralelo. '
+                                 '(UsuarioSistema) Procesos para calcular los hashes de contraseña. '
+                                 'Implica el modo por lotes / masivo (--batch-size por defecto: 1000).')
+        parser.add_argument('--claves', choices=['inutilizables', 'temporal'], default='inutilizables',
+                            help='(UsuarioSistema, modo masivo) "inutilizables": sin contraseña utilizable, se generan '
+                                 'tokens de restablecimiento; "temporal": la contraseña temporal de la carga fila a fila.')
+        parser.add_argument('--tokens-salida', type=str, default=None,
+                            help='(UsuarioSistema, modo masivo) Archivo CSV donde escribir username, uid y token de '
+                                 'restablecimiento de contraseña de cada usuario creado.')
 
     def handle(self, *args, **options):
         csv_file_path = options['csv_file']
@@ -21,13 +49,22 @@ class Command(BaseCommand):
 
         if model_name not in ['vehiculo', 'usuariosistema']:
             raise CommandError(f"Nombre de modelo '{model_name}' no válido. Use 'Vehiculo' o 'UsuarioSistema'.")
+        if options['workers'] < 1:
+            raise CommandError("--workers debe ser al menos 1.")
+        self._empresas = None # Mapa {clave_empresa: empresa_id}, se carga al primer uso
 
         try:
             with open(csv_file_path, mode='r', encoding='utf-8-sig') as file: # utf-8-sig para manejar BOM
                 reader = csv.DictReader(file)
                 
-                if model_name == 'vehiculo':
+                if model_name == 'vehiculo' and (options['batch_size'] or options['workers'] > 1):
+                    self._load_vehiculos_por_lotes(reader, options['batch_size'] or 1000, options['workers'])
+                elif model_name == 'vehiculo':
                     self._load_vehiculos(reader)
+                elif model_name == 'usuariosistema' and (options['batch_size'] or options['workers'] > 1):
+                    self._load_usuarios_sistema_masivo(
+                        reader, options['batch_size'] or 1000, options['workers'], options['claves'], options['tokens_salida']
+                    )
                 elif model_name == 'usuariosistema':
                     self._load_usuarios_sistema(reader)
 
@@ -37,99 +74,95 @@ class Command(BaseCommand):
             raise CommandError(f"Error procesando el archivo CSV: {e}")
 
     def _clean_rut(self, rut_str):
-        if not rut_str:
-            return None
-        # Limpiar y formatear RUT si es necesario, ejemplo básico
-        rut_str = rut_str.replace('.', '').replace('-', '').strip().upper()
-        if not rut_str: return None
-        
-        cuerpo = rut_str[:-1]
-        dv = rut_str[-1]
-        
-        # Formatear cuerpo con puntos
-        cuerpo_formateado = ""
-        if len(cuerpo) > 0:
-            cuerpo_formateado = cuerpo[-3:]
-            cuerpo = cuerpo[:-3]
-        if len(cuerpo) > 0:
-            cuerpo_formateado = cuerpo[-3:] + "." + cuerpo_formateado
-            cuerpo = cuerpo[:-3]
-        if len(cuerpo) > 0:
-            cuerpo_formateado = cuerpo + "." + cuerpo_formateado
-        
-        return f"{cuerpo_formateado}-{dv}" if cuerpo_formateado else None
-
+        rut, error = verificar_rut(rut_str)
+        if error:
+            self.stdout.write(self.style.WARNING(error))
+        return rut
 
     def _clean_patente(self, patente_str):
-        if not patente_str:
-            return None
-        patente_str = patente_str.strip().upper()
-        # Validar y/o formatear patente si es necesario
-        # Ejemplo: asegurar que tenga un guion si es el formato esperado
-        if re.match(r'^[A-Z0-9]{4}[A-Z0-9]{2}$', patente_str) and len(patente_str) == 6: # Ej: RFWB77
-             patente_str = f"{patente_str[:4]}-{patente_str[4:]}" # RFWB-77
-        elif re.match(r'^[A-Z0-9]{2}[A-Z0-9]{2}[A-Z0-9]{2}$', patente_str) and len(patente_str) == 6: # Ej: RF WB 77 (sin espacios)
-             patente_str = f"{patente_str[:2]}-{patente_str[2:4]}-{patente_str[4:]}"
-        
-        # Re-validar con el regex del modelo
-        if not re.match(r'^[A-Z0-9]{2,4}-[A-Z0-9]{2,4}$', patente_str):
-            if not re.match(r'^[A-Z0-9]+(?:-[A-Z0-9]+)*$', patente_str): # Formato más genérico
-                self.stdout.write(self.style.WARNING(f"Formato de patente '{patente_str}' podría ser inválido. Se intentará guardar."))
-        return patente_str
+        patente, advertencia = normalizar_patente(patente_str)
+        if advertencia:
+            self.stdout.write(self.style.WARNING(advertencia))
+        return patente
+
+    def _escribir_mensajes(self, mensajes):
+        for _, nivel, texto in mensajes:
+            estilo = self.style.ERROR if nivel == ERROR else self.style.WARNING
+            self.stdout.write(estilo(texto))
+
+    def _resolver_empresas(self, datos_empresas):
+        """
+        Resuelve tuplas (razon_social, razon_social2, rut) del CSV a ids de Empresa con un
+        mapa en memoria cargado una sola vez; las empresas nuevas se crean con un solo
+        bulk_create. Las empresas existentes no se modifican. Retorna el mapa.
+        """
+        if self._empresas is None:
+            self._empresas = {
+                clave_empresa(razon_social): empresa_id
+                for empresa_id, razon_social in Empresa.objects.values_list('id', 'razon_social')
+            }
+        nuevas = {}
+        for razon_social, razon_social2, rut in datos_empresas:
+            clave = clave_empresa(razon_social)
+            if clave not in self._empresas and clave not in nuevas:
+                nuevas[clave] = Empresa(razon_social=razon_social, razon_social2=razon_social2, rut=rut)
+        if nuevas:
+            Empresa.objects.bulk_create(nuevas.values())
+            Empresa.invalidar_opciones() # bulk_create no dispara señales
+            for clave, empresa in nuevas.items():
+                self._empresas[clave] = empresa.id
+                self.stdout.write(self.style.SUCCESS(f"Empresa '{empresa.razon_social}' creada."))
+        return self._empresas
 
+    def _con_empresa_id(self, datos):
+        """Copia de vehiculo_data/datos de perfil con la tupla 'empresa' reemplazada por empresa_id."""
+        datos = dict(datos)
+        razon_social, _, _ = datos.pop('empresa')
+        datos['empresa_id'] = self._empresas[clave_empresa(razon_social)]
+        return datos
+
+    VEHICULO_REQUIRED_COLUMNS = ['RAZON SOCIAL', 'RUT', 'PATENTE', 'TIPO VEHICULO', 'MARCA', 'MODELO', 'TIPO']
+    VEHICULO_CAMPOS_ACTUALIZABLES = ['empresa', 'tipo_vehiculo', 'marca', 'modelo', 'tipo_transmision', 'estado']
+
+    def _verificar_columnas_vehiculo(self, reader):
+        # Verificar que todas las columnas requeridas estén en el CSV
+        if not all(col in reader.fieldnames for col in self.VEHICULO_REQUIRED_COLUMNS):
+            missing = [col for col in self.VEHICULO_REQUIRED_COLUMNS if col not in reader.fieldnames]
+            raise CommandError(f"Columnas CSV faltantes para Vehiculo: {', '.join(missing)}. Columnas disponibles: {', '.join(reader.fieldnames)}")
+
+    def _vehiculo_desde_fila(self, numero_fila, row):
+        """
+        Limpia y valida una fila del CSV de vehículos.
+        Retorna (patente, vehiculo_data), o (None, None) si la fila se omite (con advertencia).
+        """
+        patente, vehiculo_data, mensajes = parsear_fila_vehiculo(numero_fila, row)
+        self._escribir_mensajes(mensajes)
+        return patente, vehiculo_data
 
     @transaction.atomic
     def _load_vehiculos(self, reader):
         self.stdout.write(self.style.SUCCESS("Iniciando carga de Vehículos..."))
         # Mapeo esperado de columnas CSV a campos del modelo Vehiculo
         # CSV: RAZON SOCIAL,RAZON SOCIAL2,RUT,PATENTE,TIPO VEHICULO,MARCA,MODELO,TIPO,ESTADO
-        # Modelo: razon_social, razon_social2, rut, patente, tipo_vehiculo, marca, modelo, tipo_transmision, estado
-        
-        required_columns = ['RAZON SOCIAL', 'RUT', 'PATENTE', 'TIPO VEHICULO', 'MARCA', 'MODELO', 'TIPO']
+        # Modelo: empresa (RAZON SOCIAL, RAZON SOCIAL2, RUT), patente, tipo_vehiculo, marca, modelo, tipo_transmision, estado
         
-        # Verificar que todas las columnas requeridas estén en el CSV
-        if not all(col in reader.fieldnames for col in required_columns):
-            missing = [col for col in required_columns if col not in reader.fieldnames]
-            raise CommandError(f"Columnas CSV faltantes para Vehiculo: {', '.join(missing)}. Columnas disponibles: {', '.join(reader.fieldnames)}")
+        self._verificar_columnas_vehiculo(reader)
 
         count_created = 0
         count_updated = 0
         count_skipped = 0
 
         for i, row in enumerate(reader):
-            patente = self._clean_patente(row.get('PATENTE', '').strip())
+            patente, vehiculo_data = self._vehiculo_desde_fila(i + 2, row)
             if not patente:
-                self.stdout.write(self.style.WARNING(f"Fila {i+2}: Patente faltante. Se omite esta fila."))
                 count_skipped += 1
                 continue
 
-            rut_empresa = self._clean_rut(row.get('RUT', '').strip())
-            if not rut_empresa:
-                self.stdout.write(self.style.WARNING(f"Fila {i+2} (Patente: {patente}): RUT faltante. Se omite esta fila."))
-                count_skipped += 1
-                continue
-            
-            razon_social = row.get('RAZON SOCIAL', '').strip()
-            if not razon_social:
-                self.stdout.write(self.style.WARNING(f"Fila {i+2} (Patente: {patente}): RAZON SOCIAL faltante. Se omite esta fila."))
-                count_skipped += 1
-                continue
-
-            vehiculo_data = {
-                'razon_social': razon_social,
-                'razon_social2': row.get('RAZON SOCIAL2', '').strip() or None,
-                'rut': rut_empresa,
-                'tipo_vehiculo': row.get('TIPO VEHICULO', '').strip(),
-                'marca': row.get('MARCA', '').strip(),
-                'modelo': row.get('MODELO', '').strip(),
-                'tipo_transmision': row.get('TIPO', '').strip(), # 'TIPO' en CSV es 'tipo_transmision' en modelo
-                'estado': row.get('ESTADO', '').strip() or None,
-            }
-
             try:
+                self._resolver_empresas([vehiculo_data['empresa']])
                 vehiculo, created = Vehiculo.objects.update_or_create(
                     patente=patente,
-                    defaults=vehiculo_data
+                    defaults=self._con_empresa_id(vehiculo_data)
                 )
                 if created:
                     self.stdout.write(self.style.SUCCESS(f"Vehículo '{vehiculo.patente}' creado."))
@@ -149,12 +182,111 @@ class Command(BaseCommand):
         
         self.stdout.write(self.style.SUCCESS(f"Carga de Vehículos completada. Creados: {count_created}, Actualizados: {count_updated}, Omitidos: {count_skipped}."))
 
+    def _filas_numeradas(self, reader):
+        # Se lee con el csv.reader interno del DictReader: las filas viajan como listas y
+        # line_num da el número de línea original del archivo (para reportar errores).
+        for valores in reader.reader:
+            if valores: # DictReader también omite las líneas vacías
+                yield reader.reader.line_num, valores
+
+    def _parsear_en_paralelo(self, lotes, workers):
+        """
+        Parsea los lotes en un pool de procesos y los entrega en el orden original,
+        con a lo más 2 lotes pendientes por proceso para acotar la memoria.
+        """
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pendientes = deque()
+            for lote in lotes:
+                pendientes.append(pool.submit(parsear_lote_vehiculos, self._fieldnames, lote))
+                if len(pendientes) >= workers * 2:
+                    yield pendientes.popleft().result()
+            while pendientes:
+                yield pendientes.popleft().result()
+
+    def _load_vehiculos_por_lotes(self, reader, batch_size, workers=1):
+        """
+        Carga de vehículos en lotes: por cada lote se consultan las patentes existentes
+        una sola vez, se reparte entre bulk_create y bulk_update y se confirma el lote.
+        Un error en un lote no deshace los lotes anteriores.
+        Con workers > 1 el parseo y la validación corren en un pool de procesos y este
+        proceso es el único que escribe en la base de datos, en el orden del archivo.
+        """
+        self.stdout.write(self.style.SUCCESS(
+            f"Iniciando carga de Vehículos en lotes de {batch_size}" + (f" con {workers} procesos de parseo..." if workers > 1 else "...")
+        ))
+        self._verificar_columnas_vehiculo(reader)
+        self._fieldnames = reader.fieldnames
+
+        count_created = 0
+        count_updated = 0
+        count_skipped = 0
+        count_rows = 0
+        inicio = time_module.perf_counter()
+
+        filas = self._filas_numeradas(reader) # El CSV se lee como generador, nunca completo en memoria
+        lotes = iter(lambda: list(islice(filas, batch_size)), [])
+        if workers > 1:
+            lotes_parseados = self._parsear_en_paralelo(lotes, workers)
+        else:
+            lotes_parseados = (parsear_lote_vehiculos(self._fieldnames, lote) for lote in lotes)
+
+        for numero_lote, lote in enumerate(lotes_parseados, start=1):
+            count_rows += lote.filas_leidas
+            count_skipped += lote.omitidas
+            self._escribir_mensajes(lote.mensajes)
+
+            try:
+                # Fuera de la transacción del lote: las empresas creadas quedan en el mapa aunque el lote falle
+                self._resolver_empresas(data['empresa'] for data in lote.vehiculos.values())
+                with transaction.atomic():
+                    existentes = {
+                        patente: (vehiculo_id, empresa_id)
+                        for patente, vehiculo_id, empresa_id in Vehiculo.objects.filter(
+                            patente__in=list(lote.vehiculos)
+                        ).values_list('patente', 'id', 'empresa_id')
+                    }
+                    nuevos = []
+                    actualizados = []
+                    for patente, vehiculo_data in lote.vehiculos.items():
+                        if patente in existentes:
+                            actualizados.append(Vehiculo(id=existentes[patente][0], patente=patente, **self._con_empresa_id(vehiculo_data)))
+                        else:
+                            nuevos.append(Vehiculo(patente=patente, **self._con_empresa_id(vehiculo_data)))
+                    Vehiculo.objects.bulk_create(nuevos)
+                    Vehiculo.objects.bulk_update(actualizados, self.VEHICULO_CAMPOS_ACTUALIZABLES)
+
+                    # bulk_create/bulk_update no disparan señales: invalidar la caché de las empresas afectadas
+                    empresas = {vehiculo.empresa_id for vehiculo in nuevos + actualizados}
+                    empresas.update(empresa_id for _, empresa_id in existentes.values())
+                    for empresa_id in empresas:
+                        cache_disponibilidad.invalidar_empresa(empresa_id)
+            except IntegrityError as e:
+                self.stdout.write(self.style.ERROR(
+                    f"Lote {numero_lote} (filas {lote.primera_fila}-{lote.ultima_fila}): error de integridad: {e}. Se omite el lote."
+                ))
+                count_skipped += len(lote.vehiculos)
+                continue
+
+            count_created += len(nuevos)
+            count_updated += len(actualizados)
+            self.stdout.write(self.style.NOTICE(
+                f"Lote {numero_lote} (filas {lote.primera_fila}-{lote.ultima_fila}): Creados: {len(nuevos)}, "
+                f"Actualizados: {len(actualizados)}, Omitidos: {lote.filas_leidas - len(lote.vehiculos)}."
+            ))
+
+        segundos = time_module.perf_counter() - inicio
+        filas_por_segundo = count_rows / segundos if segundos else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Carga de Vehículos completada. Creados: {count_created}, Actualizados: {count_updated}, Omitidos: {count_skipped}. "
+            f"{count_rows} filas en {segundos:.2f} s ({filas_por_segundo:.0f} filas/s)."
+        ))
+
     @transaction.atomic
     def _load_usuarios_sistema(self, reader):
         self.stdout.write(self.style.SUCCESS("Iniciando carga de Usuarios del Sistema..."))
         # Mapeo esperado de columnas CSV a campos del modelo UsuarioSistema
         # CSV: USUARIO,RAZON SOCIAL,RAZON SOCIAL2,RUT,CIUDAD
-        # Modelo: user (Django User), nombre_usuario_completo, razon_social_empresa, razon_social2_empresa, rut_empresa, ciudad
+        # Modelo: user (Django User), nombre_usuario_completo, empresa (RAZON SOCIAL, RAZON SOCIAL2, RUT), ciudad
 
         required_columns = ['USUARIO', 'RAZON SOCIAL', 'RUT', 'CIUDAD']
         if not all(col in reader.fieldnames for col in required_columns):
@@ -217,13 +349,13 @@ class Command(BaseCommand):
                  continue
 
 
-            usuario_sistema_data = {
+            empresa = (razon_social_empresa, row.get('RAZON SOCIAL2', '').strip() or None, rut_empresa)
+            self._resolver_empresas([empresa])
+            usuario_sistema_data = self._con_empresa_id({
                 'nombre_usuario_completo': nombre_usuario_csv,
-                'razon_social_empresa': razon_social_empresa,
-                'razon_social2_empresa': row.get('RAZON SOCIAL2', '').strip() or None,
-                'rut_empresa': rut_empresa,
+                'empresa': empresa,
                 'ciudad': row.get('CIUDAD', '').strip(),
-            }
+            })
 
             try:
                 # Usar user (el objeto User de Django) para la relación
@@ -247,4 +379,84 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.ERROR(f"Error inesperado para UsuarioSistema '{nombre_usuario_csv}': {e}. Se omite."))
                 count_skipped += 1
 
-        self.stdout.write(self.style.SUCCESS(f"Carga de Usuarios del Sistema completada. Creados: {count_created}, Actualizados: {count_updated}, Omitidos: {count_skipped}."))
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS(f"Carga de Usuarios del Sistema completada. Creados: {count_created}, Actualizados: {count_updated}, Omitidos: {count_skipped}."))
+
+    def _load_usuarios_sistema_masivo(self, reader, batch_size, workers, claves, tokens_salida):
+        """
+        Aprovisionamiento masivo de usuarios: los usernames se resuelven contra un set cargado
+        una sola vez, los User y sus perfiles se crean con bulk_create (sin pasar por la señal
+        post_save que crea un perfil vacío) y las contraseñas se hashean en un pool de procesos
+        o se dejan inutilizables con un token de restablecimiento. Reporta el tiempo de cada fase.
+        """
+        self.stdout.write(self.style.SUCCESS("Iniciando carga masiva de Usuarios del Sistema..."))
+        tiempos = {}
+
+        def fase(nombre, inicio):
+            tiempos[nombre] = time_module.perf_counter() - inicio
+
+        inicio = time_module.perf_counter()
+        required_columns = ['USUARIO', 'RAZON SOCIAL', 'RUT', 'CIUDAD']
+        if not all(col in reader.fieldnames for col in required_columns):
+            missing = [col for col in required_columns if col not in reader.fieldnames]
+            raise CommandError(f"Columnas CSV faltantes para UsuarioSistema: {', '.join(missing)}. Columnas disponibles: {', '.join(reader.fieldnames)}")
+        perfiles_data = []
+        count_skipped = 0
+        for i, row in enumerate(reader):
+            datos, mensajes = parsear_fila_usuario(i + 2, row)
+            self._escribir_mensajes(mensajes)
+            if datos is None:
+                count_skipped += 1
+            else:
+                perfiles_data.append(datos)
+        fase('lectura', inicio)
+
+        inicio = time_module.perf_counter()
+        usados = set(User.objects.values_list('username', flat=True))
+        usernames = [username_disponible(datos['nombre_usuario_completo'], usados) for datos in perfiles_data]
+        fase('usernames', inicio)
+
+        inicio = time_module.perf_counter()
+        if claves == 'temporal':
+            hashes = hashear_claves(['password123'] * len(perfiles_data), workers) # ¡Contraseña insegura! Solo para ejemplo.
+        else:
+            hashes = [make_password(None) for _ in perfiles_data] # Contraseña inutilizable
+        fase('claves', inicio)
+
+        inicio = time_module.perf_counter()
+        with transaction.atomic():
+            self._resolver_empresas(datos['empresa'] for datos in perfiles_data)
+            users = []
+            for datos, username, hash_clave in zip(perfiles_data, usernames, hashes):
+                nombre = datos['nombre_usuario_completo']
+                users.append(User(
+                    username=username,
+                    first_name=nombre.split(' ')[0] if ' ' in nombre else nombre,
+                    last_name=' '.join(nombre.split(' ')[1:]) if ' ' in nombre else '',
+                    email=f"{username}@example.com", # Email de placeholder
+                    password=hash_clave,
+                ))
+            # bulk_create no envía post_save: no se crea el perfil vacío que luego habría que sobrescribir
+            User.objects.bulk_create(users, batch_size=batch_size)
+            if any(user.pk is None for user in users): # Backends sin RETURNING en inserciones masivas
+                ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+                for user in users:
+                    user.pk = ids[user.username]
+            UsuarioSistema.objects.bulk_create(
+                [UsuarioSistema(user=user, **self._con_empresa_id(datos)) for user, datos in zip(users, perfiles_data)],
+                batch_size=batch_size,
+            )
+        fase('escritura', inicio)
+
+        if tokens_salida:
+            inicio = time_module.perf_counter()
+            with open(tokens_salida, 'w', newline='', encoding='utf-8') as archivo:
+                writer = csv.writer(archivo)
+                writer.writerow(['username', 'uid', 'token'])
+                for user in users:
+                    writer.writerow([user.username, urlsafe_base64_encode(force_bytes(user.pk)), default_token_generator.make_token(user)])
+            fase('tokens', inicio)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Carga masiva de Usuarios del Sistema completada. Creados: {len(users)}, Omitidos: {count_skipped}."
+        ))
+        self.stdout.write("Tiempos por fase: " + ", ".join(f"{nombre}={segundos:.2f}s" for nombre, segundos in tiempos.items()))
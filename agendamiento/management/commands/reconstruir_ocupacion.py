@@ -0,0 +1,49 @@
+# agendamiento/management/commands/reconstruir_ocupacion.py
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from agendamiento.models import Reserva, OcupacionVehiculoDia
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye (o verifica con --verificar) el índice OcupacionVehiculoDia a partir de las reservas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verificar', action='store_true',
+                            help='Solo compara el índice con las reservas y reporta diferencias, sin modificar nada.')
+
+    def _mascaras_desde_reservas(self):
+        mascaras = {}
+        filas = Reserva.objects.values_list('vehiculo_id', 'fecha_reserva', 'hora_inicio_reserva').iterator()
+        for vehiculo_id, fecha, hora in filas:
+            clave = (vehiculo_id, fecha)
+            mascaras[clave] = mascaras.get(clave, 0) | OcupacionVehiculoDia.bit_de_hora(hora)
+        return mascaras
+
+    def handle(self, *args, **options):
+        esperadas = self._mascaras_desde_reservas()
+
+        if options['verificar']:
+            actuales = {
+                (vehiculo_id, fecha): mascara
+                for vehiculo_id, fecha, mascara in OcupacionVehiculoDia.objects.values_list('vehiculo_id', 'fecha', 'mascara').iterator()
+                if mascara # Las filas con máscara 0 equivalen a no tener fila
+            }
+            diferencias = 0
+            for clave in sorted(set(esperadas) | set(actuales)):
+                if esperadas.get(clave, 0) != actuales.get(clave, 0):
+                    diferencias += 1
+                    self.stdout.write(self.style.WARNING(
+                        f"Vehículo {clave[0]} el {clave[1]}: índice={actuales.get(clave, 0):024b} reservas={esperadas.get(clave, 0):024b}"
+                    ))
+            if diferencias:
+                raise CommandError(f"El índice de ocupación tiene {diferencias} diferencia(s) con las reservas.")
+            self.stdout.write(self.style.SUCCESS(f"Índice de ocupación consistente ({len(esperadas)} vehículo-día con reservas)."))
+            return
+
+        with transaction.atomic():
+            OcupacionVehiculoDia.objects.all().delete()
+            OcupacionVehiculoDia.objects.bulk_create(
+                [OcupacionVehiculoDia(vehiculo_id=v, fecha=f, mascara=m) for (v, f), m in esperadas.items()],
+                batch_size=1000,
+            )
+        self.stdout.write(self.style.SUCCESS(f"Índice de ocupación reconstruido: {len(esperadas)} vehículo-día."))
@@ -0,0 +1,188 @@
+# agendamiento/metricas.py
+"""
+Métricas por solicitud, agregadas en histogramas en memoria.
+
+MetricasMiddleware (ver middleware.py) mide, por cada URL con nombre de la app,
+la latencia de la solicitud, el número y el tiempo de las consultas a la base
+de datos y el tiempo de renderizado de plantillas. La vista 'metricas' las
+expone en el formato de texto de Prometheus.
+
+Los histogramas viven en la memoria de cada proceso: con varios workers cada
+uno expone sus propios contadores (Prometheus los suma al consultar).
+"""
+import threading
+import time as time_module
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from django.template.backends.django import DjangoTemplates
+
+
+# Límites superiores (inclusive) de los buckets; el bucket +Inf se agrega solo
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LIMITES_CONSULTAS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _escapar_etiqueta(valor):
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatear_numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Histograma:
+    """Histograma con una serie por vista; las observaciones se agregan bajo un lock."""
+
+    def __init__(self, nombre, ayuda, limites):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.limites = tuple(limites)
+        self._series = {} # {vista: [conteos por bucket (el último es +Inf), suma, total]}
+        self._lock = threading.Lock()
+
+    def observar(self, vista, valor):
+        indice = bisect_left(self.limites, valor)
+        with self._lock:
+            serie = self._series.get(vista)
+            if serie is None:
+                serie = self._series[vista] = [[0] * (len(self.limites) + 1), 0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def reiniciar(self):
+        with self._lock:
+            self._series.clear()
+
+    def resumen(self, vista):
+        """(suma, total) de las observaciones de 'vista'; (0, 0) si no hay."""
+        with self._lock:
+            serie = self._series.get(vista)
+            return (serie[1], serie[2]) if serie else (0, 0)
+
+    def exportar(self):
+        """Líneas del histograma en el formato de texto de Prometheus (buckets acumulados)."""
+        with self._lock:
+            series = {vista: (list(conteos), suma, total) for vista, (conteos, suma, total) in self._series.items()}
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for vista in sorted(series):
+            conteos, suma, total = series[vista]
+            etiqueta = f'vista="{_escapar_etiqueta(vista)}"'
+            acumulado = 0
+            for limite, conteo in zip(self.limites + ('+Inf',), conteos):
+                acumulado += conteo
+                lineas.append(f'{self.nombre}_bucket{{{etiqueta},le="{limite}"}} {acumulado}')
+            lineas.append(f"{self.nombre}_sum{{{etiqueta}}} {_formatear_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{{{etiqueta}}} {total}")
+        return lineas
+
+
+SOLICITUD_SEGUNDOS = Histograma(
+    'agendamiento_solicitud_segundos', 'Latencia de la solicitud, de la entrada del middleware a la respuesta.', LIMITES_SEGUNDOS,
+)
+CONSULTAS_BD = Histograma(
+    'agendamiento_consultas_bd', 'Consultas a la base de datos por solicitud.', LIMITES_CONSULTAS,
+)
+CONSULTAS_BD_SEGUNDOS = Histograma(
+    'agendamiento_consultas_bd_segundos', 'Tiempo total de las consultas a la base de datos por solicitud.', LIMITES_SEGUNDOS,
+)
+PLANTILLAS_SEGUNDOS = Histograma(
+    'agendamiento_plantillas_segundos', 'Tiempo de renderizado de plantillas por solicitud.', LIMITES_SEGUNDOS,
+)
+HISTOGRAMAS = (SOLICITUD_SEGUNDOS, CONSULTAS_BD, CONSULTAS_BD_SEGUNDOS, PLANTILLAS_SEGUNDOS)
+
+
+@dataclass
+class MedicionSolicitud:
+    """Acumuladores de la solicitud en curso."""
+    consultas: int = 0
+    segundos_consultas: float = 0.0
+    segundos_plantillas: float = 0.0
+    profundidad_plantillas: int = 0 # Plantillas renderizadas dentro de otra no se cuentan dos veces
+
+    def __call__(self, execute, sql, params, many, context):
+        # Envoltorio de connection.execute_wrapper()
+        inicio = time_module.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.segundos_consultas += time_module.perf_counter() - inicio
+            self.consultas += 1
+
+
+# Medición de la solicitud en curso (None fuera del middleware); ContextVar para que también sirva en vistas async
+medicion_actual = ContextVar('medicion_actual', default=None)
+
+
+def medir_consulta(execute, sql, params, many, context):
+    """
+    Envoltorio permanente de cada conexión (ver instalar_en_conexion): suma la consulta a la
+    medición en curso. Las consultas del ORM async corren en otro hilo, con otra conexión,
+    pero sync_to_async copia el contexto, así que también llegan a la medición de la solicitud.
+    """
+    medicion = medicion_actual.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    return medicion(execute, sql, params, many, context)
+
+
+def instalar_en_conexion(sender, connection, **kwargs):
+    """Receptor de connection_created (ver apps.py)."""
+    if medir_consulta not in connection.execute_wrappers: # Se llama de nuevo en cada reconexión
+        connection.execute_wrappers.append(medir_consulta)
+
+
+def registrar(vista, segundos, medicion):
+    """Agrega a los histogramas las mediciones de una solicitud a 'vista'."""
+    SOLICITUD_SEGUNDOS.observar(vista, segundos)
+    CONSULTAS_BD.observar(vista, medicion.consultas)
+    CONSULTAS_BD_SEGUNDOS.observar(vista, medicion.segundos_consultas)
+    PLANTILLAS_SEGUNDOS.observar(vista, medicion.segundos_plantillas)
+
+
+def exportar_prometheus():
+    """Texto de todas las métricas en el formato de exposición de Prometheus (versión 0.0.4)."""
+    lineas = []
+    for histograma in HISTOGRAMAS:
+        lineas.extend(histograma.exportar())
+    return '\n'.join(lineas) + '\n'
+
+
+def reiniciar():
+    for histograma in HISTOGRAMAS:
+        histograma.reiniciar()
+
+
+class PlantillaConMetricas:
+    """Envoltorio de una plantilla del backend de Django que suma su tiempo de render a la medición en curso."""
+
+    def __init__(self, plantilla):
+        self.plantilla = plantilla
+
+    def __getattr__(self, nombre):
+        return getattr(self.plantilla, nombre)
+
+    def render(self, context=None, request=None):
+        medicion = medicion_actual.get()
+        if medicion is None:
+            return self.plantilla.render(context, request)
+        medicion.profundidad_plantillas += 1
+        inicio = time_module.perf_counter()
+        try:
+            return self.plantilla.render(context, request)
+        finally:
+            medicion.profundidad_plantillas -= 1
+            if not medicion.profundidad_plantillas:
+                medicion.segundos_plantillas += time_module.perf_counter() - inicio
+
+
+class DjangoTemplatesConMetricas(DjangoTemplates):
+    """Backend de plantillas de Django que mide el tiempo de render (ver settings.TEMPLATES)."""
+
+    def from_string(self, template_code):
+        return PlantillaConMetricas(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return PlantillaConMetricas(super().get_template(template_name))
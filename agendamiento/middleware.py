@@ -0,0 +1,72 @@
+# agendamiento/middleware.py
+import logging
+import time as time_module
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metricas
+
+
+logger = logging.getLogger(__name__)
+
+
+class MetricasMiddleware:
+    """
+    Mide latencia, consultas a la BD y tiempo de plantillas de cada solicitud a
+    una URL con nombre de la app (ver agendamiento/metricas.py).
+    Se desactiva con AGENDAMIENTO_METRICAS_ACTIVAS = False.
+    Funciona en modo síncrono y asíncrono: bajo ASGI no obliga a las vistas async a correr en un hilo.
+    """
+    ESPACIO_DE_NOMBRES = 'agendamiento'
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'AGENDAMIENTO_METRICAS_ACTIVAS', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        medicion = metricas.MedicionSolicitud()
+        token = metricas.medicion_actual.set(medicion)
+        inicio = time_module.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metricas.medicion_actual.reset(token)
+        self._registrar(request, response, medicion, time_module.perf_counter() - inicio)
+        return response
+
+    async def __acall__(self, request):
+        medicion = metricas.MedicionSolicitud()
+        token = metricas.medicion_actual.set(medicion)
+        inicio = time_module.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metricas.medicion_actual.reset(token)
+        self._registrar(request, response, medicion, time_module.perf_counter() - inicio)
+        return response
+
+    def _registrar(self, request, response, medicion, segundos):
+        # Solo URLs con nombre de la app: el admin, los 404 y las URLs sin nombre no agregan series
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match and resolver_match.url_name and self.ESPACIO_DE_NOMBRES in resolver_match.namespaces:
+            metricas.registrar(resolver_match.view_name, segundos, medicion)
+            # El 'extra' solo se arma si el nivel DEBUG está activo (ver LOGGING en settings)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Solicitud %s %s", request.method, resolver_match.view_name,
+                    extra={
+                        'vista': resolver_match.view_name, 'estado': response.status_code,
+                        'segundos': segundos, 'consultas': medicion.consultas,
+                        'segundos_consultas': medicion.segundos_consultas, 'segundos_plantillas': medicion.segundos_plantillas,
+                    },
+                )
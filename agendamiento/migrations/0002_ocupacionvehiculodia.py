@@ -0,0 +1,42 @@
+# Generated by Django 5.2.1 on 2026-10-17 00:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def poblar_ocupacion(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Reserva = apps.get_model('agendamiento', 'Reserva')
+    OcupacionVehiculoDia = apps.get_model('agendamiento', 'OcupacionVehiculoDia')
+    mascaras = {}
+    for vehiculo_id, fecha, hora in Reserva.objects.using(db_alias).values_list('vehiculo_id', 'fecha_reserva', 'hora_inicio_reserva').iterator():
+        mascaras[(vehiculo_id, fecha)] = mascaras.get((vehiculo_id, fecha), 0) | (1 << hora.hour)
+    OcupacionVehiculoDia.objects.using(db_alias).bulk_create(
+        [OcupacionVehiculoDia(vehiculo_id=v, fecha=f, mascara=m) for (v, f), m in mascaras.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OcupacionVehiculoDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Fecha')),
+                ('mascara', models.PositiveIntegerField(default=0, verbose_name='Máscara de Bloques Reservados')),
+                ('vehiculo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ocupaciones', to='agendamiento.vehiculo', verbose_name='Vehículo')),
+            ],
+            options={
+                'verbose_name': 'Ocupación de Vehículo por Día',
+                'verbose_name_plural': 'Ocupaciones de Vehículos por Día',
+                'unique_together': {('vehiculo', 'fecha')},
+            },
+        ),
+        migrations.RunPython(poblar_ocupacion, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.1 on 2026-10-17 01:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0002_ocupacionvehiculodia'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['usuario', '-fecha_reserva', '-hora_inicio_reserva'], name='reserva_usuario_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['fecha_reserva', 'vehiculo'], name='reserva_fecha_vehiculo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehiculo',
+            index=models.Index(fields=['razon_social', 'estado', 'marca', 'modelo'], name='vehiculo_empresa_estado_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.1 on 2026-10-17 01:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0003_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Empresa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('razon_social', models.CharField(max_length=255, unique=True, verbose_name='Razón Social Principal')),
+                ('razon_social2', models.CharField(blank=True, max_length=255, null=True, verbose_name='Razón Social Secundaria')),
+                ('rut', models.CharField(max_length=20, verbose_name='RUT Empresa')),
+            ],
+            options={
+                'verbose_name': 'Empresa',
+                'verbose_name_plural': 'Empresas',
+                'ordering': ['razon_social'],
+            },
+        ),
+        migrations.AddField(
+            model_name='usuariosistema',
+            name='empresa',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='usuarios', to='agendamiento.empresa', verbose_name='Empresa Asignada'),
+        ),
+        migrations.AddField(
+            model_name='vehiculo',
+            name='empresa',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='vehiculos', to='agendamiento.empresa', verbose_name='Empresa'),
+        ),
+    ]
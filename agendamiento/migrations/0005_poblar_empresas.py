@@ -0,0 +1,99 @@
+from collections import Counter, defaultdict
+
+from django.db import migrations
+
+
+# Empresa para vehículos que no tenían razón social (el importador no los crea, pero la columna lo permitía)
+RAZON_SOCIAL_VACIA = '(sin razón social)'
+
+
+def _clave(razon_social):
+    # Variantes con distinto espaciado o mayúsculas son la misma empresa
+    return ' '.join(razon_social.split()).casefold()
+
+
+def _mas_frecuente(contador):
+    valores = [(cantidad, valor) for valor, cantidad in contador.items() if valor]
+    return max(valores)[1] if valores else None
+
+
+def poblar_empresas(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Empresa = apps.get_model('agendamiento', 'Empresa')
+    Vehiculo = apps.get_model('agendamiento', 'Vehiculo')
+    UsuarioSistema = apps.get_model('agendamiento', 'UsuarioSistema')
+
+    nombres = defaultdict(Counter)
+    nombres2 = defaultdict(Counter)
+    ruts = defaultdict(Counter)
+    filas = [
+        (Vehiculo, 'razon_social', 'razon_social2', 'rut'),
+        (UsuarioSistema, 'razon_social_empresa', 'razon_social2_empresa', 'rut_empresa'),
+    ]
+    for modelo, campo_razon, campo_razon2, campo_rut in filas:
+        for razon_social, razon_social2, rut in modelo.objects.using(db_alias).values_list(campo_razon, campo_razon2, campo_rut).iterator():
+            razon_social = (razon_social or '').strip()
+            if not razon_social:
+                continue
+            clave = _clave(razon_social)
+            nombres[clave][razon_social] += 1
+            nombres2[clave][(razon_social2 or '').strip()] += 1
+            ruts[clave][(rut or '').strip()] += 1
+
+    # La variante más usada de cada nombre es la razón social canónica
+    Empresa.objects.using(db_alias).bulk_create([
+        Empresa(
+            razon_social=_mas_frecuente(nombres[clave]),
+            razon_social2=_mas_frecuente(nombres2[clave]),
+            rut=_mas_frecuente(ruts[clave]) or '',
+        )
+        for clave in nombres
+    ], batch_size=1000)
+    empresa_por_clave = {_clave(razon_social): id for id, razon_social in Empresa.objects.using(db_alias).values_list('id', 'razon_social')}
+
+    vehiculos = list(Vehiculo.objects.using(db_alias).only('id', 'razon_social'))
+    if any(not (v.razon_social or '').strip() for v in vehiculos):
+        empresa_por_clave[''] = Empresa.objects.using(db_alias).create(razon_social=RAZON_SOCIAL_VACIA, rut='').id
+    for vehiculo in vehiculos:
+        vehiculo.empresa_id = empresa_por_clave[_clave(vehiculo.razon_social or '')]
+    Vehiculo.objects.using(db_alias).bulk_update(vehiculos, ['empresa'], batch_size=1000)
+
+    perfiles = list(UsuarioSistema.objects.using(db_alias).only('id', 'razon_social_empresa'))
+    for perfil in perfiles:
+        perfil.empresa_id = empresa_por_clave.get(_clave(perfil.razon_social_empresa or '')) # Sin empresa: None
+    UsuarioSistema.objects.using(db_alias).bulk_update(perfiles, ['empresa'], batch_size=1000)
+
+
+def restaurar_textos_empresa(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Empresa = apps.get_model('agendamiento', 'Empresa')
+    Vehiculo = apps.get_model('agendamiento', 'Vehiculo')
+    UsuarioSistema = apps.get_model('agendamiento', 'UsuarioSistema')
+
+    empresas = {empresa.id: empresa for empresa in Empresa.objects.using(db_alias).all()}
+    vehiculos = list(Vehiculo.objects.using(db_alias).only('id', 'empresa_id'))
+    for vehiculo in vehiculos:
+        empresa = empresas[vehiculo.empresa_id]
+        vehiculo.razon_social = '' if empresa.razon_social == RAZON_SOCIAL_VACIA else empresa.razon_social
+        vehiculo.razon_social2 = empresa.razon_social2
+        vehiculo.rut = empresa.rut
+    Vehiculo.objects.using(db_alias).bulk_update(vehiculos, ['razon_social', 'razon_social2', 'rut'], batch_size=1000)
+
+    perfiles = list(UsuarioSistema.objects.using(db_alias).only('id', 'empresa_id'))
+    for perfil in perfiles:
+        empresa = empresas.get(perfil.empresa_id)
+        perfil.razon_social_empresa = empresa.razon_social if empresa else ''
+        perfil.razon_social2_empresa = empresa.razon_social2 if empresa else None
+        perfil.rut_empresa = empresa.rut if empresa else ''
+    UsuarioSistema.objects.using(db_alias).bulk_update(perfiles, ['razon_social_empresa', 'razon_social2_empresa', 'rut_empresa'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0004_empresa'),
+    ]
+
+    operations = [
+        migrations.RunPython(poblar_empresas, restaurar_textos_empresa),
+    ]
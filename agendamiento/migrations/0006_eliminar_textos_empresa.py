@@ -0,0 +1,51 @@
+# Generated by Django 5.2.1 on 2026-10-17 01:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0005_poblar_empresas'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='vehiculo',
+            name='vehiculo_empresa_estado_idx',
+        ),
+        migrations.RemoveField(
+            model_name='usuariosistema',
+            name='razon_social2_empresa',
+        ),
+        migrations.RemoveField(
+            model_name='usuariosistema',
+            name='razon_social_empresa',
+        ),
+        migrations.RemoveField(
+            model_name='usuariosistema',
+            name='rut_empresa',
+        ),
+        migrations.RemoveField(
+            model_name='vehiculo',
+            name='razon_social',
+        ),
+        migrations.RemoveField(
+            model_name='vehiculo',
+            name='razon_social2',
+        ),
+        migrations.RemoveField(
+            model_name='vehiculo',
+            name='rut',
+        ),
+        migrations.AlterField(
+            model_name='vehiculo',
+            name='empresa',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='vehiculos', to='agendamiento.empresa', verbose_name='Empresa Propietaria'),
+        ),
+        migrations.AddIndex(
+            model_name='vehiculo',
+            index=models.Index(fields=['empresa', 'estado', 'marca', 'modelo'], name='vehiculo_empresa_estado_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.1 on 2026-10-17 01:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0006_eliminar_textos_empresa'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='reserva',
+            name='reserva_usuario_fecha_idx',
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['usuario', 'fecha_reserva', 'hora_inicio_reserva', 'id'], name='reserva_usuario_cursor_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.1 on 2026-10-17 01:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0007_indice_cursor_mis_reservas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiaNoOperativo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Fecha')),
+                ('descripcion', models.CharField(blank=True, max_length=255, verbose_name='Descripción')),
+                ('empresa', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dias_no_operativos', to='agendamiento.empresa', verbose_name='Empresa')),
+            ],
+            options={
+                'verbose_name': 'Día No Operativo',
+                'verbose_name_plural': 'Días No Operativos',
+                'ordering': ['fecha'],
+                'unique_together': {('empresa', 'fecha')},
+            },
+        ),
+        migrations.CreateModel(
+            name='HorarioOperacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia_semana', models.PositiveSmallIntegerField(choices=[(0, 'Lunes'), (1, 'Martes'), (2, 'Miércoles'), (3, 'Jueves'), (4, 'Viernes'), (5, 'Sábado'), (6, 'Domingo')], verbose_name='Día de la Semana')),
+                ('hora_apertura', models.TimeField(verbose_name='Hora de Apertura')),
+                ('hora_cierre', models.TimeField(verbose_name='Hora de Cierre')),
+                ('empresa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='horarios', to='agendamiento.empresa', verbose_name='Empresa')),
+            ],
+            options={
+                'verbose_name': 'Horario de Operación',
+                'verbose_name_plural': 'Horarios de Operación',
+                'ordering': ['empresa', 'dia_semana', 'hora_apertura'],
+                'unique_together': {('empresa', 'dia_semana', 'hora_apertura')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-17 02:41
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def eliminar_globales_duplicados(apps, schema_editor):
+    # unique_together dejaba repetir un día sin empresa: se conserva el primero de cada fecha
+    db_alias = schema_editor.connection.alias
+    DiaNoOperativo = apps.get_model('agendamiento', 'DiaNoOperativo')
+    globales = DiaNoOperativo.objects.using(db_alias).filter(empresa__isnull=True)
+    primeros = globales.values('fecha').annotate(primero=Min('id')).values_list('primero', flat=True)
+    globales.exclude(id__in=list(primeros)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamiento', '0008_calendarios_operacion'),
+    ]
+
+    operations = [
+        migrations.RunPython(eliminar_globales_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dianooperativo',
+            constraint=models.UniqueConstraint(condition=models.Q(('empresa__isnull', True)), fields=('fecha',), name='dia_no_operativo_global_unico', violation_error_message='Ya existe un día no operativo para todas las empresas en esa fecha.'),
+        ),
+    ]
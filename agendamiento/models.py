@@ -1,16 +1,118 @@
 # agendamiento/models.py
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Case, F, Q, Value, When
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-import re
+from .validadores import validar_patente, validar_rut
 
-class Vehiculo(models.Model):
+class Empresa(models.Model):
     """
-    Modelo para representar los vehículos que se pueden agendar.
+    Empresa (línea de negocio) a la que pertenecen vehículos y usuarios.
+    Las consultas por empresa filtran por empresa_id.
     """
-    razon_social = models.CharField(max_length=255, verbose_name="Razón Social Principal")
+    razon_social = models.CharField(max_length=255, unique=True, verbose_name="Razón Social Principal")
     razon_social2 = models.CharField(max_length=255, blank=True, null=True, verbose_name="Razón Social Secundaria")
     rut = models.CharField(max_length=20, verbose_name="RUT Empresa") # Ej: "80.010.900-0"
+
+    CLAVE_CACHE_OPCIONES = 'agendamiento:empresas:opciones'
+
+    def __str__(self):
+        return self.razon_social
+
+    @classmethod
+    def opciones(cls):
+        """
+        Lista [(id, razon_social)] de todas las empresas, para filtros y selects.
+        Se guarda en la caché por defecto; las señales de Empresa la invalidan.
+        """
+        return cache.get_or_set(
+            cls.CLAVE_CACHE_OPCIONES,
+            lambda: list(cls.objects.order_by('razon_social').values_list('id', 'razon_social')),
+            None,
+        )
+
+    @classmethod
+    def invalidar_opciones(cls):
+        cache.delete(cls.CLAVE_CACHE_OPCIONES)
+
+    def clean(self):
+        # Validar formato y dígito verificador del RUT
+        if self.rut:
+            try:
+                validar_rut(self.rut)
+            except ValidationError as e:
+                raise ValidationError({'rut': e.messages})
+
+    class Meta:
+        verbose_name = "Empresa"
+        verbose_name_plural = "Empresas"
+        ordering = ['razon_social']
+
+class HorarioOperacion(models.Model):
+    """
+    Rango de horas en que opera una empresa un día de la semana; los bloques de
+    reserva son de una hora, por lo que apertura y cierre van en horas exactas.
+    Una empresa sin horarios opera todos los días con el horario por defecto
+    (ver calendario.HORARIOS_OPERACION); con horarios, los días sin rangos están cerrados.
+    """
+    DIAS_SEMANA = [(0, 'Lunes'), (1, 'Martes'), (2, 'Miércoles'), (3, 'Jueves'), (4, 'Viernes'), (5, 'Sábado'), (6, 'Domingo')]
+
+    empresa = models.ForeignKey(Empresa, on_delete=models.CASCADE, related_name="horarios", verbose_name="Empresa")
+    dia_semana = models.PositiveSmallIntegerField(choices=DIAS_SEMANA, verbose_name="Día de la Semana")
+    hora_apertura = models.TimeField(verbose_name="Hora de Apertura") # Ej: 08:00, primer bloque
+    hora_cierre = models.TimeField(verbose_name="Hora de Cierre")     # Ej: 18:00, el último bloque termina a esta hora
+
+    def __str__(self):
+        return f"{self.get_dia_semana_display()} {self.hora_apertura.strftime('%H:%M')} - {self.hora_cierre.strftime('%H:%M')}"
+
+    def clean(self):
+        if self.hora_apertura is None or self.hora_cierre is None:
+            return
+        if self.hora_apertura.minute or self.hora_apertura.second or self.hora_cierre.minute or self.hora_cierre.second:
+            raise ValidationError("Los bloques de reserva son de una hora: use horas exactas (ej: 08:00).")
+        if self.hora_apertura >= self.hora_cierre:
+            raise ValidationError({'hora_cierre': "La hora de cierre debe ser posterior a la de apertura."})
+        traslapados = HorarioOperacion.objects.filter(
+            empresa_id=self.empresa_id, dia_semana=self.dia_semana,
+            hora_apertura__lt=self.hora_cierre, hora_cierre__gt=self.hora_apertura,
+        ).exclude(pk=self.pk)
+        if self.empresa_id and traslapados.exists():
+            raise ValidationError("El rango se traslapa con otro horario de la empresa para el mismo día.")
+
+    class Meta:
+        verbose_name = "Horario de Operación"
+        verbose_name_plural = "Horarios de Operación"
+        ordering = ['empresa', 'dia_semana', 'hora_apertura']
+        unique_together = ('empresa', 'dia_semana', 'hora_apertura')
+
+class DiaNoOperativo(models.Model):
+    """Feriado o día cerrado: sin empresa aplica a todas (ej: feriados nacionales)."""
+    empresa = models.ForeignKey(Empresa, on_delete=models.CASCADE, blank=True, null=True, related_name="dias_no_operativos", verbose_name="Empresa")
+    fecha = models.DateField(verbose_name="Fecha")
+    descripcion = models.CharField(max_length=255, blank=True, verbose_name="Descripción") # Ej: "Fiestas Patrias"
+
+    def __str__(self):
+        return f"{self.fecha} {self.descripcion} ({self.empresa or 'todas las empresas'})"
+
+    class Meta:
+        verbose_name = "Día No Operativo"
+        verbose_name_plural = "Días No Operativos"
+        ordering = ['fecha']
+        unique_together = ('empresa', 'fecha')
+        constraints = [
+            # unique_together no cubre los días sin empresa: para la BD los NULL son todos distintos
+            models.UniqueConstraint(
+                fields=['fecha'], condition=Q(empresa__isnull=True), name='dia_no_operativo_global_unico',
+                violation_error_message="Ya existe un día no operativo para todas las empresas en esa fecha.",
+            ),
+        ]
+
+class Vehiculo(models.Model):
+    """
+    Modelo para representar los vehículos que se pueden agendar.
+    """
+    empresa = models.ForeignKey(Empresa, on_delete=models.PROTECT, related_name="vehiculos", verbose_name="Empresa Propietaria")
     patente = models.CharField(max_length=10, unique=True, verbose_name="Patente") # Ej: "RFWB-77"
     tipo_vehiculo = models.CharField(max_length=255, verbose_name="Tipo de Vehículo")
     marca = models.CharField(max_length=100, verbose_name="Marca")
@@ -19,25 +121,24 @@ class Vehiculo(models.Model):
     estado = models.CharField(max_length=100, blank=True, null=True, verbose_name="Estado") # Ej: 'Activo', 'Mantenimiento'
 
     def __str__(self):
-        return f"{self.marca} {self.modelo} ({self.patente}) - {self.razon_social}"
+        return f"{self.marca} {self.modelo} ({self.patente}) - {self.empresa}"
 
     def clean(self):
         # Validar formato de patente (ej: AAAA-11 o AA-AA-11 o AA-11-AA)
-        if not re.match(r'^[A-Z0-9]{2,4}-[A-Z0-9]{2,4}$', self.patente.upper()):
-            # Intenta un formato más genérico si el primero falla, permitiendo guiones
-            if not re.match(r'^[A-Z0-9]+(?:-[A-Z0-9]+)*$', self.patente.upper()):
-                 raise ValidationError({'patente': 'Formato de patente inválido. Use formatos como XXXX-XX, XX-XX-XX o XX-XX-XX.'})
+        try:
+            validar_patente(self.patente)
+        except ValidationError as e:
+            raise ValidationError({'patente': e.messages})
         self.patente = self.patente.upper()
 
-        # Validar formato de RUT (opcional, pero recomendado)
-        # Aquí un ejemplo simple, se podría usar una librería para validación de RUT chileno
-        if self.rut and not re.match(r'^\d{1,2}\.\d{3}\.\d{3}-[\dkK]$', self.rut):
-            raise ValidationError({'rut': 'Formato de RUT inválido. Use XX.XXX.XXX-X.'})
-
     class Meta:
         verbose_name = "Vehículo"
         verbose_name_plural = "Vehículos"
         ordering = ['marca', 'modelo', 'patente']
+        indexes = [
+            # Grilla de disponibilidad: vehículos activos de una empresa, ordenados por marca y modelo
+            models.Index(fields=['empresa', 'estado', 'marca', 'modelo'], name='vehiculo_empresa_estado_idx'),
+        ]
 
 class UsuarioSistema(models.Model):
     """
@@ -46,18 +147,11 @@ class UsuarioSistema(models.Model):
     """
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="perfil_sistema", verbose_name="Usuario Django")
     nombre_usuario_completo = models.CharField(max_length=255, verbose_name="Nombre Completo del Usuario") # Ej: "RICARDO CLAVIJO"
-    razon_social_empresa = models.CharField(max_length=255, verbose_name="Razón Social Empresa Asignada")
-    razon_social2_empresa = models.CharField(max_length=255, blank=True, null=True, verbose_name="Razón Social Secundaria Empresa")
-    rut_empresa = models.CharField(max_length=20, verbose_name="RUT Empresa Asignada") # Ej: "80.010.900-0"
+    empresa = models.ForeignKey(Empresa, on_delete=models.PROTECT, blank=True, null=True, related_name="usuarios", verbose_name="Empresa Asignada")
     ciudad = models.CharField(max_length=100, verbose_name="Ciudad")
 
     def __str__(self):
-        return f"{self.nombre_usuario_completo} ({self.razon_social_empresa})"
-
-    def clean(self):
-        # Validar formato de RUT (opcional)
-        if self.rut_empresa and not re.match(r'^\d{1,2}\.\d{3}\.\d{3}-[\dkK]$', self.rut_empresa):
-            raise ValidationError({'rut_empresa': 'Formato de RUT inválido para la empresa. Use XX.XXX.XXX-X.'})
+        return f"{self.nombre_usuario_completo} ({self.empresa})"
 
     class Meta:
         verbose_name = "Usuario del Sistema"
@@ -119,10 +213,119 @@ class Reserva(models.Model):
             self.hora_fin_reserva = fin_esperado_datetime.time()
 
         self.full_clean() # Llama a clean() antes de guardar
-        super().save(*args, **kwargs)
+        # La señal post_save actualiza OcupacionVehiculoDia dentro de esta misma transacción
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     class Meta:
         verbose_name = "Reserva"
         verbose_name_plural = "Reservas"
         ordering = ['fecha_reserva', 'hora_inicio_reserva', 'vehiculo']
-        unique_together = ('vehiculo', 'fecha_reserva', 'hora_inicio_reserva') # Asegura unicidad a nivel de BD
\ No newline at end of file
+        unique_together = ('vehiculo', 'fecha_reserva', 'hora_inicio_reserva') # Asegura unicidad a nivel de BD
+        indexes = [
+            # Mis Reservas: páginas por cursor sobre (fecha, hora, id) de un usuario; se recorre en ambos sentidos
+            models.Index(fields=['usuario', 'fecha_reserva', 'hora_inicio_reserva', 'id'], name='reserva_usuario_cursor_idx'),
+            # Grilla del día / API de rango: reservas de una fecha (o rango) de todos los vehículos
+            models.Index(fields=['fecha_reserva', 'vehiculo'], name='reserva_fecha_vehiculo_idx'),
+        ]
+
+class OcupacionVehiculoDia(models.Model):
+    """
+    Índice de ocupación: una fila por (vehículo, fecha) con una máscara de bits
+    de los bloques reservados. El bit N corresponde al bloque que empieza a la
+    hora N (ej: el bloque 08:00 es el bit 8).
+    Se mantiene desde las señales de Reserva y se puede reconstruir con el
+    comando 'reconstruir_ocupacion'.
+    """
+    vehiculo = models.ForeignKey(Vehiculo, on_delete=models.CASCADE, related_name="ocupaciones", verbose_name="Vehículo")
+    fecha = models.DateField(verbose_name="Fecha")
+    mascara = models.PositiveIntegerField(default=0, verbose_name="Máscara de Bloques Reservados")
+
+    def __str__(self):
+        return f"Ocupación de {self.vehiculo_id} el {self.fecha}: {self.mascara:024b}"
+
+    @staticmethod
+    def bit_de_hora(hora):
+        return 1 << hora.hour
+
+    @classmethod
+    def mascara_de_horas(cls, horas):
+        mascara = 0
+        for hora in horas:
+            mascara |= cls.bit_de_hora(hora)
+        return mascara
+
+    @classmethod
+    def obtener(cls, vehiculo_id, fecha):
+        """
+        Retorna la ocupación del vehículo en la fecha (una consulta). Si no hay
+        reservas, retorna una instancia sin guardar con la máscara vacía.
+        """
+        ocupacion = cls.objects.filter(vehiculo_id=vehiculo_id, fecha=fecha).first()
+        return ocupacion or cls(vehiculo_id=vehiculo_id, fecha=fecha, mascara=0)
+
+    def esta_libre(self, hora):
+        return not (self.mascara & self.bit_de_hora(hora))
+
+    def horas_libres(self, horarios):
+        return [hora for hora in horarios if self.esta_libre(hora)]
+
+    def primera_hora_libre(self, horarios):
+        for hora in horarios:
+            if self.esta_libre(hora):
+                return hora
+        return None
+
+    @classmethod
+    def marcar(cls, vehiculo_id, fecha, horas):
+        """Marca como reservados los bloques de 'horas' con un UPDATE atómico (OR de bits)."""
+        bits = cls.mascara_de_horas(horas)
+        fila = cls.objects.filter(vehiculo_id=vehiculo_id, fecha=fecha)
+        if fila.update(mascara=F('mascara').bitor(bits)):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(vehiculo_id=vehiculo_id, fecha=fecha, mascara=bits)
+        except IntegrityError:
+            # Otra transacción creó la fila entre el UPDATE y el INSERT
+            fila.update(mascara=F('mascara').bitor(bits))
+
+    @classmethod
+    def marcar_fechas(cls, vehiculo_id, horas_por_fecha):
+        """
+        marcar() de varias fechas de un vehículo ({fecha: horas}) en dos consultas:
+        un INSERT de las filas que faltan (vacías) y un solo UPDATE con el OR de los
+        bits de cada fecha.
+        """
+        if not horas_por_fecha:
+            return
+        # ignore_conflicts: si otra transacción creó una fila entretanto, el UPDATE la marca igual
+        cls.objects.bulk_create([cls(vehiculo_id=vehiculo_id, fecha=fecha, mascara=0) for fecha in horas_por_fecha],
+                                ignore_conflicts=True)
+        bits_por_fecha = Case(
+            *[When(fecha=fecha, then=Value(cls.mascara_de_horas(horas))) for fecha, horas in horas_por_fecha.items()],
+            default=Value(0), output_field=models.PositiveIntegerField(),
+        )
+        cls.objects.filter(vehiculo_id=vehiculo_id, fecha__in=list(horas_por_fecha)).update(mascara=F('mascara').bitor(bits_por_fecha))
+
+    @classmethod
+    def liberar(cls, vehiculo_id, fecha, horas):
+        """Libera los bloques de 'horas' con un UPDATE atómico (AND con el complemento)."""
+        complemento = MASCARA_DIA_COMPLETO & ~cls.mascara_de_horas(horas)
+        cls.objects.filter(vehiculo_id=vehiculo_id, fecha=fecha).update(mascara=F('mascara').bitand(complemento))
+
+    @classmethod
+    def recalcular(cls, vehiculo_id, fecha):
+        """Recalcula la máscara de un (vehículo, fecha) desde Reserva."""
+        horas = Reserva.objects.filter(vehiculo_id=vehiculo_id, fecha_reserva=fecha).values_list('hora_inicio_reserva', flat=True)
+        mascara = cls.mascara_de_horas(horas)
+        cls.objects.update_or_create(vehiculo_id=vehiculo_id, fecha=fecha, defaults={'mascara': mascara})
+
+    class Meta:
+        verbose_name = "Ocupación de Vehículo por Día"
+        verbose_name_plural = "Ocupaciones de Vehículos por Día"
+        unique_together = ('vehiculo', 'fecha')
+
+
+# Un bit por cada hora del día
+MASCARA_DIA_COMPLETO = (1 << 24) - 1
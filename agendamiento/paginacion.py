@@ -0,0 +1,99 @@
+# agendamiento/paginacion.py
+"""
+Paginación por cursor (keyset) de Mis Reservas.
+
+Cada página se pide con el (fecha_reserva, hora_inicio_reserva, id) de la
+última fila de la página anterior y se lee del índice reserva_usuario_cursor_idx
+a partir de ese punto, por lo que su costo no depende del número de página ni
+de cuántas reservas tenga el usuario (con OFFSET la base de datos recorre y
+descarta todas las filas anteriores). Cancelar reservas entre una página y
+otra no desplaza ni repite filas.
+"""
+from dataclasses import dataclass, field
+from datetime import date, time
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Reserva
+
+
+# Vistas de Mis Reservas
+PROXIMAS = 'proximas' # Desde hoy en adelante, de la más cercana a la más lejana
+PASADAS = 'pasadas'   # Antes de hoy, de la más reciente a la más antigua
+VISTAS = (PROXIMAS, PASADAS)
+
+POR_PAGINA = 20
+
+
+@dataclass
+class PaginaReservas:
+    """Una página de reservas; cursor_siguiente es None en la última página."""
+    vista: str = PROXIMAS
+    reservas: list = field(default_factory=list)
+    cursor_siguiente: str | None = None
+
+
+def codificar_cursor(reserva):
+    """Cursor de la posición de 'reserva', ej: '2025-06-02_08:00_154'."""
+    return f"{reserva.fecha_reserva.isoformat()}_{reserva.hora_inicio_reserva.strftime('%H:%M')}_{reserva.id}"
+
+
+def decodificar_cursor(cursor):
+    """Retorna (fecha, hora, id) del cursor, o None si está vacío o mal formado."""
+    try:
+        fecha, hora, reserva_id = cursor.split('_')
+        return date.fromisoformat(fecha), time.fromisoformat(hora), int(reserva_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _despues_de(posicion, descendente):
+    # (fecha, hora, id) > (f, h, i) en el orden de la vista. La condición suelta sobre la fecha
+    # acota el rango del índice; el OR solo descarta las filas de la fecha del cursor ya mostradas
+    fecha, hora, reserva_id = posicion
+    op = 'lt' if descendente else 'gt'
+    return Q(**{f'fecha_reserva__{op}e': fecha}) & (
+        Q(**{f'fecha_reserva__{op}': fecha})
+        | Q(**{f'hora_inicio_reserva__{op}': hora})
+        | Q(hora_inicio_reserva=hora, **{f'id__{op}': reserva_id})
+    )
+
+
+def _consulta_pagina(usuario_sistema, vista, cursor, por_pagina, hoy):
+    hoy = hoy or timezone.localdate()
+    reservas = Reserva.objects.filter(usuario=usuario_sistema).select_related('vehiculo')
+    if vista == PASADAS:
+        reservas = reservas.filter(fecha_reserva__lt=hoy).order_by('-fecha_reserva', '-hora_inicio_reserva', '-id')
+    else:
+        vista = PROXIMAS
+        reservas = reservas.filter(fecha_reserva__gte=hoy).order_by('fecha_reserva', 'hora_inicio_reserva', 'id')
+
+    posicion = decodificar_cursor(cursor)
+    if posicion:
+        reservas = reservas.filter(_despues_de(posicion, descendente=vista == PASADAS))
+
+    # Una fila de más indica si hay página siguiente, sin un COUNT(*)
+    return vista, reservas[:por_pagina + 1]
+
+
+def _armar_pagina(vista, filas, por_pagina):
+    pagina = PaginaReservas(vista=vista, reservas=filas[:por_pagina])
+    if len(filas) > por_pagina:
+        pagina.cursor_siguiente = codificar_cursor(pagina.reservas[-1])
+    return pagina
+
+
+def pagina_de_reservas(usuario_sistema, vista=PROXIMAS, cursor=None, por_pagina=POR_PAGINA, hoy=None):
+    """
+    Retorna la PaginaReservas de 'usuario_sistema' que sigue a 'cursor' (None: la primera)
+    en la vista indicada, con el vehículo de cada reserva ya cargado (una sola consulta).
+    """
+    vista, reservas = _consulta_pagina(usuario_sistema, vista, cursor, por_pagina, hoy)
+    return _armar_pagina(vista, list(reservas), por_pagina)
+
+
+async def apagina_de_reservas(usuario_sistema, vista=PROXIMAS, cursor=None, por_pagina=POR_PAGINA, hoy=None):
+    """Versión async de pagina_de_reservas()."""
+    vista, reservas = _consulta_pagina(usuario_sistema, vista, cursor, por_pagina, hoy)
+    return _armar_pagina(vista, [reserva async for reserva in reservas], por_pagina)
@@ -0,0 +1,24 @@
+# agendamiento/perfiles.py
+from .models import UsuarioSistema
+
+
+async def aperfil_sistema(request):
+    """
+    UsuarioSistema (con su empresa) del usuario de la solicitud, o None, para las
+    vistas async. Se consulta una vez por solicitud.
+    """
+    if not hasattr(request, '_perfil_sistema'):
+        user = await request.auser()
+        # Las plantillas y los context processors leen request.user: ya cargado, no vuelven a consultarlo
+        request.user = user
+        request._perfil_sistema = None
+        if user.is_authenticated:
+            relacion = UsuarioSistema._meta.get_field('user').remote_field
+            if relacion.is_cached(user):
+                # Cargado junto con el usuario (ver autenticacion.BackendConPerfil)
+                request._perfil_sistema = relacion.get_cached_value(user)
+            else:
+                request._perfil_sistema = await UsuarioSistema.objects.select_related('empresa').filter(user_id=user.pk).afirst()
+                # Deja user.perfil_sistema en caché (también si no existe) para base.html
+                relacion.set_cached_value(user, request._perfil_sistema)
+    return request._perfil_sistema
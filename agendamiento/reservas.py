@@ -0,0 +1,291 @@
+# agendamiento/reservas.py
+"""
+Camino de escritura de reservas de varios bloques.
+
+Verifica todos los bloques pedidos con una sola consulta y los inserta con un
+solo bulk_create. La restricción unique_together de Reserva es el árbitro
+final: si otra transacción ganó algún bloque entre la verificación y el
+INSERT, el IntegrityError se traduce en un error por bloque.
+
+Ante contención:
+- En backends con SELECT ... FOR UPDATE se bloquea la fila de
+  OcupacionVehiculoDia del (vehículo, fecha), serializando las reservas de ese
+  vehículo-día sin bloquear el resto.
+- Los errores de bloqueo de la base de datos ("database is locked", deadlocks,
+  fallas de serialización) se reintentan un número acotado de veces con
+  espera exponencial, siempre que la llamada no esté dentro de una
+  transacción externa (que ya no se podría reintentar).
+
+Las series (reservar_serie()) siguen la misma idea a lo largo de muchas
+fechas: una consulta de conflictos para toda la serie, un bulk_create y un
+solo UPDATE del índice de ocupación. Las ocurrencias ya tomadas o en días
+sin operación se informan como conflictos y el resto de la serie se reserva.
+"""
+import random
+import time as time_module
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection, transaction
+
+from .models import Reserva, OcupacionVehiculoDia
+from .calendario import calendarios
+from .signals import reservas_creadas, reservas_en_serie_creadas
+
+
+# Estados de ResultadoReserva
+RESERVADA = 'reservada'
+BLOQUE_TOMADO = 'bloque_tomado'
+BASE_DE_DATOS_OCUPADA = 'base_de_datos_ocupada'
+SIN_BLOQUES = 'sin_bloques'
+
+# Frecuencias de fechas_de_serie()
+DIARIA = 'diaria'
+SEMANAL = 'semanal'
+DIAS_DE_SEMANA = 'dias_de_semana'
+
+# Motivos de un Conflicto
+OCUPADO = 'ocupado'
+NO_OPERA = 'no_opera'
+
+MAX_REINTENTOS = getattr(settings, 'AGENDAMIENTO_RESERVA_MAX_REINTENTOS', 5)
+ESPERA_BASE_SEGUNDOS = getattr(settings, 'AGENDAMIENTO_RESERVA_ESPERA_BASE', 0.02)
+MAX_OCURRENCIAS = getattr(settings, 'AGENDAMIENTO_SERIE_MAX_OCURRENCIAS', 366)
+
+# Veces que una serie vuelve a insertar lo que queda libre si otra transacción le gana alguna ocurrencia
+_INTENTOS_INSERCION_SERIE = 3
+
+_FRAGMENTOS_ERROR_DE_BLOQUEO = ('locked', 'deadlock', 'could not serialize', 'lock wait timeout', 'lock timeout')
+
+
+@dataclass
+class ResultadoReserva:
+    estado: str = SIN_BLOQUES
+    reservas: list = field(default_factory=list)
+    errores: dict = field(default_factory=dict) # {hora_inicio: mensaje}
+    mensaje: str = ''
+    reintentos: int = 0
+
+    @property
+    def exitosa(self):
+        return self.estado == RESERVADA
+
+
+@dataclass(frozen=True)
+class Conflicto:
+    """Ocurrencia de una serie que no se reservó."""
+    fecha: date
+    hora: time
+    motivo: str # OCUPADO o NO_OPERA
+
+
+@dataclass
+class ResultadoSerie:
+    estado: str = SIN_BLOQUES
+    reservas: list = field(default_factory=list)
+    conflictos: list = field(default_factory=list) # [Conflicto] por fecha y hora
+    mensaje: str = ''
+    reintentos: int = 0
+
+    @property
+    def exitosa(self):
+        return self.estado == RESERVADA
+
+
+def es_error_de_bloqueo(error):
+    mensaje = str(error).lower()
+    return any(fragmento in mensaje for fragmento in _FRAGMENTOS_ERROR_DE_BLOQUEO)
+
+
+def _horas_ocupadas(vehiculo, fecha, horas):
+    return set(
+        Reserva.objects.filter(
+            vehiculo=vehiculo, fecha_reserva=fecha, hora_inicio_reserva__in=horas
+        ).order_by().values_list('hora_inicio_reserva', flat=True)
+    )
+
+
+def _errores_por_bloque(vehiculo, horas_ocupadas):
+    return {
+        hora: f"El bloque {hora.strftime('%H:%M')} para el vehículo {vehiculo.patente} ya está reservado."
+        for hora in sorted(horas_ocupadas)
+    }
+
+
+def _bloquear_vehiculo_dia(vehiculo, fecha):
+    # Solo en backends con bloqueo de filas; en SQLite la escritura ya es serializada por la BD
+    if not connection.features.has_select_for_update:
+        return
+    OcupacionVehiculoDia.objects.get_or_create(vehiculo=vehiculo, fecha=fecha)
+    OcupacionVehiculoDia.objects.select_for_update().filter(vehiculo=vehiculo, fecha=fecha).exists()
+
+
+def _nueva_reserva(vehiculo, usuario_sistema, fecha, hora_inicio):
+    return Reserva(
+        vehiculo=vehiculo,
+        usuario=usuario_sistema,
+        fecha_reserva=fecha,
+        hora_inicio_reserva=hora_inicio,
+        hora_fin_reserva=(datetime.combine(date.today(), hora_inicio) + timedelta(hours=1)).time(),
+    )
+
+
+def _reservar_bloques_una_vez(vehiculo, fecha, usuario_sistema, horas):
+    with transaction.atomic():
+        _bloquear_vehiculo_dia(vehiculo, fecha)
+
+        ocupadas = _horas_ocupadas(vehiculo, fecha, horas)
+        if ocupadas:
+            return ResultadoReserva(estado=BLOQUE_TOMADO, errores=_errores_por_bloque(vehiculo, ocupadas))
+
+        reservas = [_nueva_reserva(vehiculo, usuario_sistema, fecha, hora_inicio) for hora_inicio in horas]
+        try:
+            with transaction.atomic():
+                Reserva.objects.bulk_create(reservas)
+        except IntegrityError:
+            # Otra transacción tomó algún bloque después de la verificación
+            ocupadas = _horas_ocupadas(vehiculo, fecha, horas)
+            return ResultadoReserva(estado=BLOQUE_TOMADO, errores=_errores_por_bloque(vehiculo, ocupadas or horas))
+
+        reservas_creadas.send(sender=Reserva, vehiculo=vehiculo, fecha=fecha, reservas=reservas)
+    return ResultadoReserva(estado=RESERVADA, reservas=reservas)
+
+
+def reservar_bloques(vehiculo, fecha, usuario_sistema, horas, max_reintentos=None):
+    """
+    Crea una reserva por cada hora de inicio en 'horas', todas o ninguna.
+    Retorna un ResultadoReserva: RESERVADA con las reservas creadas,
+    BLOQUE_TOMADO con un error por bloque ya reservado, o BASE_DE_DATOS_OCUPADA
+    si se agotaron los reintentos por bloqueos.
+    """
+    horas = sorted(set(horas))
+    if not horas:
+        return ResultadoReserva()
+    return _con_reintentos(lambda: _reservar_bloques_una_vez(vehiculo, fecha, usuario_sistema, horas),
+                           max_reintentos, ResultadoReserva)
+
+
+def _con_reintentos(operacion, max_reintentos, clase_resultado):
+    """Ejecuta 'operacion' reintentando ante errores de bloqueo de la base de datos (ver el docstring del módulo)."""
+    if max_reintentos is None:
+        max_reintentos = MAX_REINTENTOS
+    if transaction.get_connection().in_atomic_block:
+        # Dentro de una transacción externa un error de bloqueo la invalida: no se puede reintentar aquí
+        max_reintentos = 0
+
+    for intento in range(max_reintentos + 1):
+        try:
+            resultado = operacion()
+        except OperationalError as e:
+            if not es_error_de_bloqueo(e) or transaction.get_connection().in_atomic_block:
+                raise
+            if intento < max_reintentos:
+                # Espera exponencial con jitter para que los perdedores no reintenten al unísono
+                time_module.sleep(ESPERA_BASE_SEGUNDOS * (2 ** intento) * (0.5 + random.random()))
+            continue
+        resultado.reintentos = intento
+        return resultado
+
+    return clase_resultado(
+        estado=BASE_DE_DATOS_OCUPADA,
+        mensaje="El sistema está procesando muchas reservas en este momento. Por favor, intente de nuevo.",
+        reintentos=max_reintentos,
+    )
+
+
+def fechas_de_serie(inicio, frecuencia, dias_semana=(), repeticiones=None, hasta=None):
+    """
+    Fechas de una serie que empieza en 'inicio': todos los días (DIARIA), el mismo
+    día de la semana que 'inicio' (SEMANAL) o los 'dias_semana' indicados (lunes = 0,
+    DIAS_DE_SEMANA). Termina tras 'repeticiones' fechas o en 'hasta' (incluida), lo
+    que ocurra primero, y nunca pasa de MAX_OCURRENCIAS fechas.
+    """
+    if repeticiones is None and hasta is None:
+        raise ValueError("Una serie necesita 'repeticiones' o 'hasta'.")
+    if frecuencia == DIARIA:
+        dias = set(range(7))
+    elif frecuencia == SEMANAL:
+        dias = {inicio.weekday()}
+    elif frecuencia == DIAS_DE_SEMANA:
+        dias = set(dias_semana)
+    else:
+        raise ValueError(f"Frecuencia desconocida: {frecuencia!r}")
+    if not dias:
+        return []
+
+    limite = min(repeticiones if repeticiones is not None else MAX_OCURRENCIAS, MAX_OCURRENCIAS)
+    fechas = []
+    fecha = inicio
+    while len(fechas) < limite and (hasta is None or fecha <= hasta):
+        if fecha.weekday() in dias:
+            fechas.append(fecha)
+        fecha += timedelta(days=1)
+    return fechas
+
+
+def _ocupados_en_serie(vehiculo, pedidos):
+    # Una consulta para toda la serie: el rango de fechas y las horas pedidas; lo que no es de la serie se descarta aquí
+    fechas = [fecha for fecha, _ in pedidos]
+    reservados = Reserva.objects.filter(
+        vehiculo=vehiculo, fecha_reserva__range=(min(fechas), max(fechas)),
+        hora_inicio_reserva__in={hora for _, hora in pedidos},
+    ).order_by().values_list('fecha_reserva', 'hora_inicio_reserva')
+    return set(reservados) & pedidos
+
+
+def _reservar_serie_una_vez(vehiculo, usuario_sistema, pedidos):
+    # Sin el bloqueo por vehículo-día de _reservar_bloques_una_vez(): serían dos consultas por fecha.
+    # La restricción unique_together decide; lo que otra transacción gane se vuelve a consultar y se excluye.
+    with transaction.atomic():
+        ocupados = _ocupados_en_serie(vehiculo, pedidos)
+        for _ in range(_INTENTOS_INSERCION_SERIE):
+            reservas = [_nueva_reserva(vehiculo, usuario_sistema, fecha, hora) for fecha, hora in sorted(pedidos - ocupados)]
+            try:
+                with transaction.atomic():
+                    Reserva.objects.bulk_create(reservas)
+                break
+            except IntegrityError:
+                ocupados = _ocupados_en_serie(vehiculo, pedidos)
+        else:
+            reservas = []
+            ocupados = pedidos
+
+        if reservas:
+            reservas_en_serie_creadas.send(sender=Reserva, vehiculo=vehiculo, reservas=reservas)
+    return ResultadoSerie(
+        estado=RESERVADA if reservas else BLOQUE_TOMADO,
+        reservas=reservas,
+        conflictos=[Conflicto(fecha, hora, OCUPADO) for fecha, hora in sorted(ocupados)],
+    )
+
+
+def reservar_serie(vehiculo, usuario_sistema, fechas, horas, max_reintentos=None):
+    """
+    Reserva las 'horas' de inicio en cada una de las 'fechas' (ver fechas_de_serie()).
+    A diferencia de reservar_bloques() no es todo o nada: las ocurrencias ya
+    reservadas (OCUPADO) o fuera del calendario de la empresa (NO_OPERA) quedan en
+    ResultadoSerie.conflictos y el resto se reserva. RESERVADA si se creó alguna
+    reserva, BLOQUE_TOMADO si todas las ocurrencias posibles estaban tomadas,
+    SIN_BLOQUES si ninguna era posible y BASE_DE_DATOS_OCUPADA si se agotaron los
+    reintentos por bloqueos.
+    """
+    fechas = sorted(set(fechas))
+    horas = sorted(set(horas))
+    calendario = calendarios.de_empresa(vehiculo.empresa_id)
+    pedidos = set()
+    no_operativos = []
+    for fecha in fechas:
+        tabla = calendario.tabla_para(fecha)
+        for hora in horas:
+            if tabla.mascara & OcupacionVehiculoDia.bit_de_hora(hora):
+                pedidos.add((fecha, hora))
+            else:
+                no_operativos.append(Conflicto(fecha, hora, NO_OPERA))
+    if not pedidos:
+        return ResultadoSerie(conflictos=no_operativos)
+
+    resultado = _con_reintentos(lambda: _reservar_serie_una_vez(vehiculo, usuario_sistema, pedidos),
+                                max_reintentos, ResultadoSerie)
+    resultado.conflictos = sorted(resultado.conflictos + no_operativos, key=lambda c: (c.fecha, c.hora))
+    return resultado
@@ -1,7 +1,21 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.contrib.auth.models import User
-from django.dispatch import receiver
-from .models import UsuarioSistema
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.dispatch import receiver, Signal
+from .models import Empresa, HorarioOperacion, DiaNoOperativo, Vehiculo, UsuarioSistema, Reserva, OcupacionVehiculoDia
+from . import autenticacion
+from .cache_disponibilidad import cache_disponibilidad
+from .calendario import calendarios
+from .eventos import difusor, RESERVADO, LIBRE
+
+# Enviada por agendamiento.reservas al crear reservas con bulk_create, que no dispara post_save.
+# Argumentos: vehiculo, fecha, reservas.
+reservas_creadas = Signal()
+
+# Enviada por agendamiento.reservas.reservar_serie() con las reservas de una serie, que
+# pueden caer en muchas fechas. Argumentos: vehiculo, reservas.
+reservas_en_serie_creadas = Signal()
 
 @receiver(post_save, sender=User)
 def crear_perfil_usuario_sistema(sender, instance, created, **kwargs):
@@ -9,7 +23,153 @@ def crear_perfil_usuario_sistema(sender, instance, created, **kwargs):
         UsuarioSistema.objects.create(
             user=instance,
             nombre_usuario_completo=instance.get_full_name() or instance.username,
-            razon_social_empresa='',
-            rut_empresa='',
+            empresa=None, # La asigna el administrador o la carga CSV
             ciudad=''
-        )
\ No newline at end of file
+        )
+
+@receiver(pre_save, sender=Reserva)
+def recordar_bloque_anterior_reserva(sender, instance, raw=False, **kwargs):
+    # Solo para modificaciones: guardar el (vehículo, fecha) anterior para recalcular su ocupación
+    if instance.pk and not raw:
+        instance._ocupacion_anterior = Reserva.objects.filter(pk=instance.pk).values_list('vehiculo_id', 'fecha_reserva').first()
+
+@receiver(post_save, sender=Reserva)
+def actualizar_ocupacion_reserva_guardada(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        OcupacionVehiculoDia.marcar(instance.vehiculo_id, instance.fecha_reserva, [instance.hora_inicio_reserva])
+        return
+    anterior = getattr(instance, '_ocupacion_anterior', None)
+    if anterior and anterior != (instance.vehiculo_id, instance.fecha_reserva):
+        OcupacionVehiculoDia.recalcular(*anterior)
+    OcupacionVehiculoDia.recalcular(instance.vehiculo_id, instance.fecha_reserva)
+
+@receiver(post_delete, sender=Reserva)
+def actualizar_ocupacion_reserva_eliminada(sender, instance, **kwargs):
+    OcupacionVehiculoDia.liberar(instance.vehiculo_id, instance.fecha_reserva, [instance.hora_inicio_reserva])
+
+
+@receiver(post_save, sender=Reserva)
+@receiver(post_delete, sender=Reserva)
+def invalidar_cache_disponibilidad_reserva(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    try:
+        empresa_id = instance.vehiculo.empresa_id
+    except Vehiculo.DoesNotExist:
+        return # El vehículo se eliminó; su señal invalida la empresa completa
+    cache_disponibilidad.invalidar_dia(empresa_id, instance.fecha_reserva)
+    anterior = getattr(instance, '_ocupacion_anterior', None)
+    if anterior and anterior != (instance.vehiculo_id, instance.fecha_reserva):
+        vehiculo_anterior_id, fecha_anterior = anterior
+        if vehiculo_anterior_id != instance.vehiculo_id:
+            empresa_id = Vehiculo.objects.filter(pk=vehiculo_anterior_id).values_list('empresa_id', flat=True).first()
+        if empresa_id is not None:
+            cache_disponibilidad.invalidar_dia(empresa_id, fecha_anterior)
+
+def _datos_bloques(reservas, estado):
+    reserva = reservas[0]
+    return {
+        'tipo': 'bloques', 'estado': estado, 'vehiculo_id': reserva.vehiculo_id, 'usuario_id': reserva.usuario_id,
+        'horas': [r.hora_inicio_reserva.strftime('%H:%M') for r in reservas],
+    }
+
+@receiver(post_save, sender=Reserva)
+@receiver(post_delete, sender=Reserva)
+def notificar_grillas_reserva(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    try:
+        empresa_id = instance.vehiculo.empresa_id
+    except Vehiculo.DoesNotExist:
+        return
+    if kwargs['signal'] is post_delete:
+        difusor.publicar_al_confirmar(empresa_id, instance.fecha_reserva, _datos_bloques([instance], LIBRE))
+    elif created:
+        difusor.publicar_al_confirmar(empresa_id, instance.fecha_reserva, _datos_bloques([instance], RESERVADO))
+    else:
+        # Modificación (admin): no se sabe qué bloque quedó libre, las grillas del día se recargan
+        difusor.publicar_al_confirmar(empresa_id, instance.fecha_reserva, {'tipo': 'recargar'})
+        anterior = getattr(instance, '_ocupacion_anterior', None)
+        if anterior and anterior[1] != instance.fecha_reserva:
+            difusor.publicar_al_confirmar(empresa_id, anterior[1], {'tipo': 'recargar'})
+
+@receiver(pre_save, sender=Vehiculo)
+def recordar_empresa_anterior_vehiculo(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._empresa_anterior_id = Vehiculo.objects.filter(pk=instance.pk).values_list('empresa_id', flat=True).first()
+
+@receiver(post_save, sender=Vehiculo)
+@receiver(post_delete, sender=Vehiculo)
+def invalidar_cache_disponibilidad_vehiculo(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    empresas = {instance.empresa_id, getattr(instance, '_empresa_anterior_id', None)} - {None}
+    for empresa_id in empresas:
+        cache_disponibilidad.invalidar_empresa(empresa_id)
+
+@receiver(post_save, sender=Empresa)
+@receiver(post_delete, sender=Empresa)
+def invalidar_opciones_empresa(sender, instance, **kwargs):
+    Empresa.invalidar_opciones()
+    transaction.on_commit(Empresa.invalidar_opciones)
+
+@receiver(post_save, sender=Empresa)
+def invalidar_perfiles_empresa(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created:
+        autenticacion.invalidar_empresa(instance.id)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidar_perfil_user(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autenticacion.invalidar_usuario(instance.pk)
+
+@receiver(user_logged_in)
+def invalidar_perfil_al_iniciar_sesion(sender, user, **kwargs):
+    # No depende de update_last_login (que Django desconecta si el modelo no tiene last_login)
+    autenticacion.invalidar_usuario(user.pk)
+
+@receiver(post_save, sender=UsuarioSistema)
+@receiver(post_delete, sender=UsuarioSistema)
+def invalidar_perfil_usuario_sistema(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autenticacion.invalidar_usuario(instance.user_id)
+
+@receiver(pre_save, sender=HorarioOperacion)
+@receiver(pre_save, sender=DiaNoOperativo)
+def recordar_empresa_anterior_calendario(sender, instance, raw=False, **kwargs):
+    # Solo para modificaciones: si cambia la empresa, también hay que invalidar el calendario de la anterior
+    if instance.pk and not raw:
+        # Una lista (vacía si la fila no existe): None es una empresa_id válida, la de todas las empresas
+        instance._empresa_anterior = list(sender.objects.filter(pk=instance.pk).values_list('empresa_id', flat=True))
+
+@receiver(post_save, sender=HorarioOperacion)
+@receiver(post_delete, sender=HorarioOperacion)
+@receiver(post_save, sender=DiaNoOperativo)
+@receiver(post_delete, sender=DiaNoOperativo)
+def invalidar_calendario(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # empresa_id es None en un DiaNoOperativo de todas las empresas: se invalidan todos los calendarios
+    for empresa_id in {instance.empresa_id, *getattr(instance, '_empresa_anterior', [])}:
+        calendarios.invalidar(empresa_id)
+
+@receiver(reservas_creadas)
+def actualizar_por_reservas_creadas(sender, vehiculo, fecha, reservas, **kwargs):
+    OcupacionVehiculoDia.marcar(vehiculo.id, fecha, [r.hora_inicio_reserva for r in reservas])
+    cache_disponibilidad.invalidar_dia(vehiculo.empresa_id, fecha)
+    if reservas:
+        difusor.publicar_al_confirmar(vehiculo.empresa_id, fecha, _datos_bloques(reservas, RESERVADO))
+
+@receiver(reservas_en_serie_creadas)
+def actualizar_por_reservas_en_serie(sender, vehiculo, reservas, **kwargs):
+    # Un solo marcar_fechas() para toda la serie; la caché y los eventos son por fecha pero no consultan la BD
+    por_fecha = {}
+    for reserva in reservas:
+        por_fecha.setdefault(reserva.fecha_reserva, []).append(reserva)
+    OcupacionVehiculoDia.marcar_fechas(vehiculo.id, {fecha: [r.hora_inicio_reserva for r in del_dia] for fecha, del_dia in por_fecha.items()})
+    for fecha, del_dia in por_fecha.items():
+        cache_disponibilidad.invalidar_dia(vehiculo.empresa_id, fecha)
+        difusor.publicar_al_confirmar(vehiculo.empresa_id, fecha, _datos_bloques(del_dia, RESERVADO))
@@ -1,3 +1,1435 @@
-from django.test import TestCase
+from datetime import date, time, timedelta
 
-# Create your tests here.
+import asyncio
+import csv
+import json
+import os
+import tempfile
+import threading
+import time as time_module
+from io import StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.contrib.auth.tokens import default_token_generator
+from django.core.asgi import get_asgi_application
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.signals import request_finished, request_started
+from django.core.exceptions import ValidationError
+from django.core.management.base import CommandError
+from django.db import close_old_connections, connection
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .cache_disponibilidad import CacheDisponibilidad, cache_disponibilidad
+from .calendario import calendarios, compilar_tabla
+from .disponibilidad import HORARIOS_OPERACION, VEHICULO_MARCADOR, construir_grilla_disponibilidad
+from .eventos import MAX_PENDIENTES, difusor
+from .fragmentos import cache_filas
+from . import checks, metricas
+from . import reservas as reservas_module
+from .admin import PaginadorConteoEstimado
+from .asgi_eventos import ConEventosDisponibilidad
+from .forms import ReservaForm
+from .models import Empresa, HorarioOperacion, DiaNoOperativo, Vehiculo, UsuarioSistema, Reserva, OcupacionVehiculoDia
+from .paginacion import PASADAS, PROXIMAS, codificar_cursor, pagina_de_reservas
+from .reservas import (
+    reservar_bloques, reservar_serie, fechas_de_serie, Conflicto, RESERVADA, BLOQUE_TOMADO, BASE_DE_DATOS_OCUPADA,
+    DIARIA, SEMANAL, DIAS_DE_SEMANA, OCUPADO, NO_OPERA,
+)
+from .validadores import digito_verificador, normalizar_patente, verificar_rut, verificar_ruts
+
+
+RAZON_SOCIAL = 'Agenciamiento'
+
+
+def obtener_empresa(razon_social=RAZON_SOCIAL):
+    empresa, _ = Empresa.objects.get_or_create(razon_social=razon_social, defaults={'rut': '80.010.900-0'})
+    return empresa
+
+
+def crear_usuario(username, razon_social=RAZON_SOCIAL):
+    """Crea un User con su perfil de sistema asignado a la empresa indicada."""
+    user = User.objects.create_user(username=username, password='clave-de-prueba')
+    perfil = user.perfil_sistema # Creado por la señal post_save
+    perfil.empresa = obtener_empresa(razon_social)
+    perfil.ciudad = 'SANTIAGO'
+    perfil.save()
+    return user, perfil
+
+
+def crear_flota(cantidad, razon_social=RAZON_SOCIAL, prefijo='T'):
+    """Crea 'cantidad' vehículos activos con bulk_create."""
+    empresa = obtener_empresa(razon_social)
+    Vehiculo.objects.bulk_create([
+        Vehiculo(
+            empresa=empresa,
+            patente=f"{prefijo}{i:05d}",
+            tipo_vehiculo='Camioneta',
+            marca='MITSUBISHI',
+            modelo='L-200',
+            tipo_transmision='4x2',
+            estado='Activo',
+        )
+        for i in range(cantidad)
+    ])
+    return list(Vehiculo.objects.filter(empresa=empresa, patente__startswith=prefijo))
+
+
+
+def calentar_perfil(client):
+    """
+    Una solicitud para que el usuario quede en la caché de perfiles (ver autenticacion.py):
+    las pruebas que comparan consultas entre solicitudes no cuentan la primera carga.
+    """
+    client.get(reverse('agendamiento:pagina_inicio_o_perfil'))
+
+
+class MostrarDisponibilidadTests(TestCase):
+    def setUp(self):
+        self.user, self.perfil = crear_usuario('conductor')
+        self.otro_user, self.otro_perfil = crear_usuario('otro')
+        self.fecha = date.today() + timedelta(days=1)
+        self.url = reverse('agendamiento:mostrar_disponibilidad', kwargs={'fecha_str': self.fecha.isoformat()})
+        self.client.force_login(self.user)
+        calentar_perfil(self.client)
+
+    def _contar_consultas(self):
+        # Los datos de estas pruebas se crean con bulk_create (sin señales), se mide sin caché
+        cache_disponibilidad.limpiar()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_marca_reservas_propias_y_ajenas(self):
+        vehiculo_a, vehiculo_b = crear_flota(2)
+        Reserva.objects.create(vehiculo=vehiculo_a, usuario=self.perfil, fecha_reserva=self.fecha, hora_inicio_reserva=time(8))
+        Reserva.objects.create(vehiculo=vehiculo_b, usuario=self.otro_perfil, fecha_reserva=self.fecha, hora_inicio_reserva=time(9))
+
+        _, response = self._contar_consultas()
+        data = response.context['disponibilidad_data']
+        self.assertTrue(data[vehiculo_a.id]['horarios']['08:00:00']['reservado_por_mi'])
+        self.assertEqual(data[vehiculo_b.id]['horarios']['09:00:00']['texto_reserva'], "Reservado")
+        self.assertTrue(data[vehiculo_b.id]['horarios']['08:00:00']['disponible'])
+
+    def test_celdas_con_enlace_y_clase_precalculados(self):
+        vehiculo_a, vehiculo_b = crear_flota(2)
+        Reserva.objects.create(vehiculo=vehiculo_a, usuario=self.perfil, fecha_reserva=self.fecha, hora_inicio_reserva=time(8))
+        Reserva.objects.create(vehiculo=vehiculo_b, usuario=self.otro_perfil, fecha_reserva=self.fecha, hora_inicio_reserva=time(8))
+
+        _, response = self._contar_consultas()
+        url = reverse('agendamiento:reservar_vehiculo', kwargs={'vehiculo_id': vehiculo_b.id, 'fecha_str': self.fecha.isoformat()})
+        self.assertContains(response, f'<a href="{url}?hora_inicio=09:00:00"')
+        self.assertContains(
+            response, f'<td data-vehiculo="{vehiculo_a.id}" data-hora="08:00" title="08:00 - 09:00" class="bloque-reservado-por-mi">Reservado por ti</td>',
+            html=True,
+        )
+        self.assertContains(
+            response, f'<td data-vehiculo="{vehiculo_b.id}" data-hora="08:00" title="08:00 - 09:00" class="bloque-reservado">Reservado</td>',
+            html=True,
+        )
+        self.assertEqual(response.context['disponibilidad_data'][vehiculo_b.id]['horarios']['08:00:00']['url'], '')
+
+        # Un prefijo o segmento con '/0/' no confunde el reemplazo del vehículo
+        url_marcada = f"/sitio/0/reservar/{VEHICULO_MARCADOR}/2030-01-01/"
+        grilla = construir_grilla_disponibilidad([vehiculo_b], {}, self.perfil.id, url_reserva=url_marcada)
+        self.assertEqual(grilla[vehiculo_b.id]['horarios']['09:00:00']['url'], f"/sitio/0/reservar/{vehiculo_b.id}/2030-01-01/?hora_inicio=09:00:00")
+
+    def test_filas_compartidas_entre_usuarios_con_celdas_propias(self):
+        vehiculo, = crear_flota(1)
+        Reserva.objects.create(vehiculo=vehiculo, usuario=self.perfil, fecha_reserva=self.fecha, hora_inicio_reserva=time(8))
+        Reserva.objects.create(vehiculo=vehiculo, usuario=self.otro_perfil, fecha_reserva=self.fecha, hora_inicio_reserva=time(9))
+        cache_disponibilidad.limpiar()
+        otro_client = Client()
+        otro_client.force_login(self.otro_user)
+
+        def celda(response, hora, clase, texto):
+            self.assertContains(
+                response, f'<td data-vehiculo="{vehiculo.id}" data-hora="{hora}" title="{hora} - {int(hora[:2]) + 1:02d}:00" class="{clase}">{texto}</td>',
+                html=True,
+            )
+
+        antes = cache_filas.estadisticas()
+        response = otro_client.get(self.url)
+        celda(response, '08:00', 'bloque-reservado', 'Reservado')
+        celda(response, '09:00', 'bloque-reservado-por-mi', 'Reservado por ti')
+        response = self.client.get(self.url) # La misma fila guardada, con las celdas de este usuario
+        celda(response, '08:00', 'bloque-reservado-por-mi', 'Reservado por ti')
+        celda(response, '09:00', 'bloque-reservado', 'Reservado')
+        despues = cache_filas.estadisticas()
+        self.assertEqual(despues['fallos'] - antes['fallos'], 1)
+        self.assertEqual(despues['aciertos'] - antes['aciertos'], 1)
+
+        # Una reserva nueva cambia la fila: se renderiza de nuevo
+        Reserva.objects.create(vehiculo=vehiculo, usuario=self.otro_perfil, fecha_reserva=self.fecha, hora_inicio_reserva=time(10))
+        celda(self.client.get(self.url), '10:00', 'bloque-reservado', 'Reservado')
+        self.assertEqual(cache_filas.estadisticas()['fallos'] - antes['fallos'], 2)
+
+    def test_consultas_constantes_segun_tamano_de_flota(self):
+        conteos = []
+        creados = 0
+        for prefijo, tamano in (('A', 10), ('B', 100), ('C', 1000)):
+            nuevos = crear_flota(tamano - creados, prefijo=prefijo)
+            creados = tamano
+            # Una reserva propia y una ajena por cada vehículo nuevo
+            Reserva.objects.bulk_create(
+                [Reserva(vehiculo=v, usuario=self.perfil, fecha_reserva=self.fecha,
+                         hora_inicio_reserva=time(8), hora_fin_reserva=time(9)) for v in nuevos] +
+                [Reserva(vehiculo=v, usuario=self.otro_perfil, fecha_reserva=self.fecha,
+                         hora_inicio_reserva=time(12), hora_fin_reserva=time(13)) for v in nuevos]
+            )
+            num_consultas, response = self._contar_consultas()
+            self.assertEqual(len(response.context['disponibilidad_data']), tamano)
+            conteos.append(num_consultas)
+
+        self.assertEqual(conteos[0], conteos[1])
+        self.assertEqual(conteos[1], conteos[2])
+
+
+class OcupacionVehiculoDiaTests(TestCase):
+    def setUp(self):
+        self.user, self.perfil = crear_usuario('conductor')
+        self.vehiculo, = crear_flota(1)
+        self.fecha = date.today() + timedelta(days=1)
+
+    def _reservar(self, hora):
+        return Reserva.objects.create(vehiculo=self.vehiculo, usuario=self.perfil, fecha_reserva=self.fecha, hora_inicio_reserva=hora)
+
+    def test_crear_y_eliminar_reserva_actualiza_mascara(self):
+        reserva_8 = self._reservar(time(8))
+        self._reservar(time(10))
+        ocupacion = OcupacionVehiculoDia.obtener(self.vehiculo.id, self.fecha)
+        self.assertEqual(ocupacion.mascara, (1 << 8) | (1 << 10))
+        self.assertFalse(ocupacion.esta_libre(time(8)))
+        self.assertEqual(ocupacion.primera_hora_libre(HORARIOS_OPERACION), time(9))
+
+        reserva_8.delete()
+        ocupacion = OcupacionVehiculoDia.obtener(self.vehiculo.id, self.fecha)
+        self.assertEqual(ocupacion.horas_libres(HORARIOS_OPERACION), [h for h in HORARIOS_OPERACION if h != time(10)])
+
+    def test_modificar_reserva_recalcula_ambos_dias(self):
+        reserva = self._reservar(time(8))
+        otra_fecha = self.fecha + timedelta(days=1)
+        reserva.fecha_reserva = otra_fecha
+        reserva.save()
+        self.assertEqual(OcupacionVehiculoDia.obtener(self.vehiculo.id, self.fecha).mascara, 0)
+        self.assertEqual(OcupacionVehiculoDia.obtener(self.vehiculo.id, otra_fecha).mascara, 1 << 8)
+
+    def test_comando_verifica_y_reconstruye(self):
+        self._reservar(time(9))
+        # bulk_create no dispara señales: el índice queda desfasado
+        Reserva.objects.bulk_create([Reserva(vehiculo=self.vehiculo, usuario=self.perfil, fecha_reserva=self.fecha,
+                                             hora_inicio_reserva=time(11), hora_fin_reserva=time(12))])
+        with self.assertRaises(CommandError):
+            call_command('reconstruir_ocupacion', verificar=True, stdout=StringIO())
+
+        call_command('reconstruir_ocupacion', stdout=StringIO())
+        call_command('reconstruir_ocupacion', verificar=True, stdout=StringIO())
+        self.assertEqual(OcupacionVehiculoDia.obtener(self.vehiculo.id, self.fecha).mascara, (1 << 9) | (1 << 11))
+
+
+class DisponibilidadRangoTests(TestCase):
+    def setUp(self):
+        self.user, self.perfil = crear_usuario('conductor')
+        self.vehiculo_a, self.vehiculo_b = crear_flota(2)
+        crear_flota(1, razon_social='Otra Empresa', prefijo='X')
+        self.desde = date.today() + timedelta(days=1)
+        self.url = reverse('agendamiento:disponibilidad_rango')
+        self.client.force_login(self.user)
+
+    def test_mascaras_por_vehiculo_y_dia_en_una_consulta_de_rango(self):
+        Reserva.objects.create(vehiculo=self.vehiculo_a, usuario=self.perfil, fecha_reserva=self.desde, hora_inicio_reserva=time(8))
+        Reserva.objects.create(vehiculo=self.vehiculo_a, usuario=self.perfil, fecha_reserva=self.desde + timedelta(days=6), hora_inicio_reserva=time(17))
+        Reserva.objects.create(vehiculo=self.vehiculo_b, usuario=self.perfil, fecha_reserva=self.desde + timedelta(days=7), hora_inicio_reserva=time(9))
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, {'desde': self.desde.isoformat(), 'hasta': (self.desde + timedelta(days=6)).isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum('"agendamiento_reserva"' in q['sql'] for q in ctx.captured_queries), 1)
+
+        data = response.json()
+        self.assertEqual(data['horarios'][0], '08:00')
+        ocupacion = {v['id']: v['ocupacion'] for v in data['vehiculos']}
+        self.assertEqual(set(ocupacion), {self.vehiculo_a.id, self.vehiculo_b.id})
+        self.assertEqual(ocupacion[self.vehiculo_a.id], [1 << 8, 0, 0, 0, 0, 0, 1 << 17])
+        self.assertEqual(ocupacion[self.vehiculo_b.id], [0] * 7) # La reserva del día 8 queda fuera del rango
+
+    def test_rango_invalido(self):
+        self.assertEqual(self.client.get(self.url, {'desde': 'ayer', 'hasta': 'hoy'}).status_code, 400)
+        hasta_excesivo = self.desde + timedelta(days=40)
+        response = self.client.get(self.url, {'desde': self.desde.isoformat(), 'hasta': hasta_excesivo.isoformat()})
+        self.assertEqual(response.status_code, 400)
+
+
+class CacheDisponibilidadTests(TestCase):
+    def setUp(self):
+        cache_disponibilidad.limpiar()
+        self.user, self.perfil = crear_usuario('conductor')
+        self.vehiculo, = crear_flota(1)
+        self.fecha = date.today() + timedelta(days=1)
+        self.url = reverse('agendamiento:mostrar_disponibilidad', kwargs={'fecha_str': self.fecha.isoformat()})
+        self.client.force_login(self.user)
+
+    def _bloque_8(self):
+        response = self.client.get(self.url)
+        return response.context['disponibilidad_data'][self.vehiculo.id]['horarios']['08:00:00']
+
+    def _verificar_reserva_y_cancelacion_nunca_obsoletas(self):
+        self.assertTrue(self._bloque_8()['disponible'])
+        self.assertTrue(self._bloque_8()['disponible'])
+        self.assertEqual(cache_disponibilidad.estadisticas()['aciertos'], 1)
+
+        url_reserva = reverse('agendamiento:reservar_vehiculo', kwargs={'vehiculo_id': self.vehiculo.id, 'fecha_str': self.fecha.isoformat()})
+        response = self.client.post(url_reserva, {
+            'vehiculo_id': self.vehiculo.id, 'fecha_reserva': self.fecha.isoformat(), 'bloques_seleccionados': ['08:00:00'],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(self._bloque_8()['reservado_por_mi'])
+
+        reserva = Reserva.objects.get(vehiculo=self.vehiculo, fecha_reserva=self.fecha)
+        self.client.post(reverse('agendamiento:mis_reservas'), {'reserva_id': reserva.id})
+        self.assertTrue(self._bloque_8()['disponible'])
+
+        self.vehiculo.estado = 'Mantenimiento'
+        self.vehiculo.save()
+        self.assertEqual(self.client.get(self.url).context['disponibilidad_data'], {})
+
+    def test_cache_local_memory_nunca_muestra_grilla_obsoleta(self):
+        self._verificar_reserva_y_cancelacion_nunca_obsoletas()
+
+    def test_cache_file_based_nunca_muestra_grilla_obsoleta(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            caches_archivo = {
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'disponibilidad': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directorio},
+            }
+            with override_settings(CACHES=caches_archivo):
+                cache_disponibilidad.limpiar()
+                self._verificar_reserva_y_cancelacion_nunca_obsoletas()
+
+    def test_desalojo_lru_acotado(self):
+        cache = CacheDisponibilidad(max_entradas=2)
+        cache.limpiar()
+        fechas = [self.fecha + timedelta(days=d) for d in range(3)]
+        cache.obtener(self.perfil.empresa_id, fechas[0])
+        cache.obtener(self.perfil.empresa_id, fechas[1])
+        cache.obtener(self.perfil.empresa_id, fechas[0]) # fechas[1] pasa a ser la menos usada
+        cache.obtener(self.perfil.empresa_id, fechas[2])
+        self.assertEqual(cache.estadisticas(), {'aciertos': 1, 'fallos': 3, 'entradas': 2})
+
+        cache.obtener(self.perfil.empresa_id, fechas[0])
+        cache.obtener(self.perfil.empresa_id, fechas[1])
+        self.assertEqual(cache.estadisticas(), {'aciertos': 2, 'fallos': 4, 'entradas': 2})
+
+    def test_con_cache_local_otro_proceso_no_sirve_grilla_invalidada(self):
+        # Dos LocMemCache distintas hacen de dos workers: la invalidación del primero no llega al segundo
+        caches_locales = {
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'proceso_a': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'proceso-a'},
+            'proceso_b': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'proceso-b'},
+        }
+        with override_settings(CACHES=caches_locales):
+            proceso_a, proceso_b = CacheDisponibilidad(alias='proceso_a'), CacheDisponibilidad(alias='proceso_b')
+            empresa_id = self.perfil.empresa_id
+            self.assertEqual(proceso_b.obtener(empresa_id, self.fecha)[1], {})
+            Reserva.objects.create(vehiculo=self.vehiculo, usuario=self.perfil, fecha_reserva=self.fecha, hora_inicio_reserva=time(8))
+            proceso_a.invalidar_dia(empresa_id, self.fecha)
+            self.assertEqual(proceso_a.obtener(empresa_id, self.fecha)[1], {self.vehiculo.id: {time(8): self.perfil.id}})
+            with mock.patch('time.time', return_value=time_module.time() + proceso_b.timeout_local + 1):
+                self.assertEqual(proceso_b.obtener(empresa_id, self.fecha)[1], {self.vehiculo.id: {time(8): self.perfil.id}})
+            self.assertEqual(proceso_b.estadisticas()['aciertos'], 0)
+            self.assertEqual([aviso.id for aviso in checks.revisar_cache_por_defecto(None)], ['agendamiento.W001'])
+
+
+class ReservarBloquesTests(TestCase):
+    def setUp(self):
+        cache_disponibilidad.limpiar()
+        self.user, self.perfil = crear_usuario('conductor')
+        self.vehiculo, = crear_flota(1)
+        self.fecha = date.today() + timedelta(days=1)
+
+    def test_diez_bloques_en_consultas_fijas(self):
+        # Verificación, INSERT masivo, actualización del índice y sus savepoints
+        with self.assertNumQueries(10):
+            resultado = reservar_bloques(self.vehiculo, self.fecha, self.perfil, HORARIOS_OPERACION)
+        self.assertTrue(resultado.exitosa)
+        self.assertEqual(len(resultado.reservas), 10)
+        self.assertEqual(Reserva.objects.filter(vehiculo=self.vehiculo, fecha_reserva=self.fecha).count(), 10)
+        self.assertEqual(OcupacionVehiculoDia.obtener(self.vehiculo.id, self.fecha).horas_libres(HORARIOS_OPERACION), [])
+
+    def test_post_de_diez_bloques_cuesta_lo_mismo_que_uno(self):
+        self.client.force_login(self.user)
+        calentar_perfil(self.client)
+        url = reverse('agendamiento:reservar_vehiculo', kwargs={'vehiculo_id': self.vehiculo.id, 'fecha_str': self.fecha.isoformat()})
+        conteos = []
+        for fecha, bloques in ((self.fecha, ['08:00:00']), (self.fecha + timedelta(days=1), [h.strftime('%H:%M:%S') for h in HORARIOS_OPERACION])):
+            url = reverse('agendamiento:reservar_vehiculo', kwargs={'vehiculo_id': self.vehiculo.id, 'fecha_str': fecha.isoformat()})
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(url, {'vehiculo_id': self.vehiculo.id, 'fecha_reserva': fecha.isoformat(), 'bloques_seleccionados': bloques})
+            self.assertEqual(response.status_code, 302)
+            conteos.append(len(ctx.captured_queries))
+        self.assertEqual(conteos[0], conteos[1])
+
+    def test_bloque_ocupado_no_crea_ninguna_reserva(self):
+        Reserva.objects.create(vehiculo=self.vehiculo, usuario=self.perfil, fecha_reserva=self.fecha, hora_inicio_reserva=time(9))
+        resultado = reservar_bloques(self.vehiculo, self.fecha, self.perfil, [time(8), time(9), time(10)])
+        self.assertFalse(resultado.exitosa)
+        self.assertEqual(list(resultado.errores), [time(9)])
+        self.assertEqual(Reserva.objects.filter(vehiculo=self.vehiculo).count(), 1)
+
+    def test_integrity_error_se_traduce_en_error_por_bloque(self):
+        Reserva.objects.create(vehiculo=self.vehiculo, usuario=self.perfil, fecha_reserva=self.fecha, hora_inicio_reserva=time(9))
+        real = reservas_module._horas_ocupadas
+        # La primera verificación "no ve" la reserva existente, como si otra transacción la hubiera creado después
+        with mock.patch.object(reservas_module, '_horas_ocupadas', side_effect=[set(), real(self.vehiculo, self.fecha, [time(9)])]):
+            resultado = reservar_bloques(self.vehiculo, self.fecha, self.perfil, [time(8), time(9)])
+        self.assertEqual(list(resultado.errores), [time(9)])
+        self.assertIn("09:00", resultado.errores[time(9)])
+        self.assertEqual(Reserva.objects.filter(vehiculo=self.vehiculo).count(), 1)
+
+
+class ReservasEnSerieTests(TestCase):
+    """Reservas recurrentes: una consulta de conflictos y un INSERT para toda la serie."""
+
+    def setUp(self):
+        calendarios.limpiar()
+        cache_disponibilidad.limpiar()
+        self.user, self.perfil = crear_usuario('conductor')
+        self.vehiculo, = crear_flota(1)
+        hoy = date.today()
+        self.lunes = hoy + timedelta(days=7 - hoy.weekday()) # Próximo lunes (siempre en el futuro)
+
+    def tearDown(self):
+        calendarios.limpiar()
+
+    def test_fechas_de_serie(self):
+        semanal = fechas_de_serie(self.lunes, SEMANAL, repeticiones=52)
+        self.assertEqual(len(semanal), 52)
+        self.assertEqual(semanal[-1], self.lunes + timedelta(weeks=51))
+        self.assertEqual(fechas_de_serie(self.lunes, DIARIA, repeticiones=3), [self.lunes + timedelta(days=d) for d in range(3)])
+        # Lunes y miércoles hasta el domingo de la semana siguiente; 'repeticiones' corta antes si llega primero
+        self.assertEqual(fechas_de_serie(self.lunes, DIAS_DE_SEMANA, dias_semana=[0, 2], hasta=self.lunes + timedelta(days=13)),
+                         [self.lunes + timedelta(days=d) for d in (0, 2, 7, 9)])
+        self.assertEqual(len(fechas_de_serie(self.lunes, DIAS_DE_SEMANA, dias_semana=[0, 2], repeticiones=3, hasta=self.lunes + timedelta(days=13))), 3)
+
+    def test_cincuenta_y_dos_semanas_en_consultas_fijas(self):
+        fechas = fechas_de_serie(self.lunes, SEMANAL, repeticiones=52)
+        Reserva.objects.create(vehiculo=self.vehiculo, usuario=self.perfil, fecha_reserva=fechas[10], hora_inicio_reserva=time(8),
+                               hora_fin_reserva=time(9))
+        DiaNoOperativo.objects.create(fecha=fechas[20], descripcion='Feriado')
+        calendarios.de_empresa(self.perfil.empresa_id) # Calendario ya compilado, como en cualquier solicitud
+
+        # Verificación, INSERT masivo, filas nuevas del índice, un UPDATE del índice y sus savepoints
+        with self.assertNumQueries(8):
+            resultado = reservar_serie(self.vehiculo, self.perfil, fechas, [time(8)])
+        self.assertTrue(resultado.exitosa)
+        self.assertEqual(len(resultado.reservas), 50)
+        self.assertEqual(resultado.conflictos, [Conflicto(fechas[10], time(8), OCUPADO), Conflicto(fechas[20], time(8), NO_OPERA)])
+        self.assertEqual(Reserva.objects.filter(vehiculo=self.vehiculo, usuario=self.perfil).count(), 51)
+        for fecha in (fechas[0], fechas[10], fechas[51]):
+            self.assertFalse(OcupacionVehiculoDia.obtener(self.vehiculo.id, fecha).esta_libre(time(8)))
+        self.assertTrue(OcupacionVehiculoDia.obtener(self.vehiculo.id, fechas[20]).esta_libre(time(8)))
+
+    def test_integrity_error_excluye_solo_la_ocurrencia_tomada(self):
+        fechas = fechas_de_serie(self.lunes, DIARIA, repeticiones=3)
+        Reserva.objects.create(vehiculo=self.vehiculo, usuario=self.perfil, fecha_reserva=fechas[1], hora_inicio_reserva=time(9),
+                               hora_fin_reserva=time(10))
+        real = reservas_module._ocupados_en_serie
+        # La primera verificación "no ve" la reserva existente, como si otra transacción la hubiera creado después
+        with mock.patch.object(reservas_module, '_ocupados_en_serie', side_effect=[set(), real(self.vehiculo, {(fechas[1], time(9))})]):
+            resultado = reservar_serie(self.vehiculo, self.perfil, fechas, [time(9)])
+        self.assertEqual(resultado.estado, RESERVADA)
+        self.assertEqual([r.fecha_reserva for r in resultado.reservas], [fechas[0], fechas[2]])
+        self.assertEqual(resultado.conflictos, [Conflicto(fechas[1], time(9), OCUPADO)])
+
+    def test_post_reserva_la_serie_y_lista_los_conflictos(self):
+        Reserva.objects.create(vehiculo=self.vehiculo, usuario=self.perfil, fecha_reserva=self.lunes + timedelta(weeks=2),
+                               hora_inicio_reserva=time(8), hora_fin_reserva=time(9))
+        self.client.force_login(self.user)
+        url = reverse('agendamiento:reservar_serie', kwargs={'vehiculo_id': self.vehiculo.id})
+        self.assertEqual(self.client.get(url, {'fecha': self.lunes.isoformat()}).status_code, 200)
+        response = self.client.post(url, {
+            'fecha_inicio': self.lunes.isoformat(), 'frecuencia': SEMANAL, 'repeticiones': 4, 'bloques_seleccionados': ['08:00:00'],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Reserva.objects.filter(vehiculo=self.vehiculo).count(), 4)
+        self.assertEqual([item['conflicto'].fecha for item in response.context['conflictos']], [self.lunes + timedelta(weeks=2)])
+        self.assertContains(response, (self.lunes + timedelta(weeks=2)).strftime('%d/%m/%Y'))
+
+        # Sin número de fechas ni término: no se reserva nada
+        response = self.client.post(url, {'fecha_inicio': self.lunes.isoformat(), 'frecuencia': DIARIA, 'bloques_seleccionados': ['09:00:00']})
+        self.assertTrue(response.context['form'].non_field_errors())
+        self.assertEqual(Reserva.objects.filter(vehiculo=self.vehiculo).count(), 4)
+
+
+class ReservarBloquesContencionTests(TransactionTestCase):
+    def setUp(self):
+        cache_disponibilidad.limpiar()
+        self.user, self.perfil = crear_usuario('conductor')
+        self.vehiculo, = crear_flota(1)
+        self.fecha = date.today() + timedelta(days=1)
+
+    def test_reintenta_errores_de_bloqueo(self):
+        real = reservas_module._reservar_bloques_una_vez
+        intentos = []
+
+        def bloquear_dos_veces(*args):
+            intentos.append(args)
+            if len(intentos) <= 2:
+                raise OperationalError('database is locked')
+            return real(*args)
+
+        with mock.patch.object(reservas_module, '_reservar_bloques_una_vez', side_effect=bloquear_dos_veces):
+            resultado = reservar_bloques(self.vehiculo, self.fecha, self.perfil, [time(8)])
+        self.assertEqual(resultado.estado, RESERVADA)
+        self.assertEqual(resultado.reintentos, 2)
+        self.assertEqual(Reserva.objects.count(), 1)
+
+    def test_reintentos_agotados_retorna_resultado_estructurado(self):
+        with mock.patch.object(reservas_module, '_reservar_bloques_una_vez', side_effect=OperationalError('database is locked')):
+            resultado = reservar_bloques(self.vehiculo, self.fecha, self.perfil, [time(8)], max_reintentos=2)
+        self.assertEqual(resultado.estado, BASE_DE_DATOS_OCUPADA)
+        self.assertEqual(resultado.reintentos, 2)
+        self.assertTrue(resultado.mensaje)
+
+    def test_otros_errores_operacionales_no_se_reintentan(self):
+        with mock.patch.object(reservas_module, '_reservar_bloques_una_vez', side_effect=OperationalError('no such table')) as intento:
+            with self.assertRaises(OperationalError):
+                reservar_bloques(self.vehiculo, self.fecha, self.perfil, [time(8)])
+        self.assertEqual(intento.call_count, 1)
+
+    def test_bloque_tomado_por_otro_usuario(self):
+        _, otro_perfil = crear_usuario('otro')
+        self.assertEqual(reservar_bloques(self.vehiculo, self.fecha, otro_perfil, [time(8)]).estado, RESERVADA)
+        resultado = reservar_bloques(self.vehiculo, self.fecha, self.perfil, [time(8), time(9)])
+        self.assertEqual(resultado.estado, BLOQUE_TOMADO)
+        self.assertEqual(list(resultado.errores), [time(8)])
+
+
+class LoadCsvDataVehiculosPorLotesTests(TestCase):
+    ENCABEZADO = "RAZON SOCIAL,RAZON SOCIAL2,RUT,PATENTE,TIPO VEHICULO,MARCA,MODELO,TIPO,ESTADO\n"
+
+    def _cargar(self, filas, **opciones):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as archivo:
+            archivo.write(self.ENCABEZADO + "".join(filas))
+        salida = StringIO()
+        try:
+            call_command('load_csv_data', archivo.name, 'Vehiculo', stdout=salida, **opciones)
+        finally:
+            os.unlink(archivo.name)
+        return salida.getvalue()
+
+    def test_crea_actualiza_y_omite_por_lotes(self):
+        crear_flota(1, prefijo='RFWB') # Patente "RFWB00000"
+        Vehiculo.objects.filter(patente='RFWB00000').update(patente='RFWB-77', marca='ANTIGUA')
+        filas = [
+            "Agenciamiento,,80.010.900-0,RFWB-77,Camioneta,MITSUBISHI,L-200,4x2,Activo\n",
+            "AGENCIAMIENTO ,,80010900-0,RDCJ42,Camioneta,MITSUBISHI,L-200,4x2,Activo\n",
+            "Agenciamiento,,80.010.900-0,,Camioneta,MITSUBISHI,L-200,4x2,Activo\n",
+            "Agenciamiento,,80.010.900-0,KLMN-11,Camioneta,TOYOTA,HILUX,4x4,\n",
+            "Agenciamiento,,80.010.900-0,KLMN-11,Camioneta,TOYOTA,HILUX,4x4,Activo\n",
+            "Agenciamiento,,80.010.900-9,DVMAL-1,Camioneta,TOYOTA,HILUX,4x4,Activo\n",
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            salida = self._cargar(filas, batch_size=2)
+
+        self.assertEqual(Vehiculo.objects.get(patente='RFWB-77').marca, 'MITSUBISHI')
+        self.assertEqual(Vehiculo.objects.get(patente='RDCJ-42').empresa.rut, '80.010.900-0')
+        self.assertEqual(Vehiculo.objects.get(patente='KLMN-11').estado, 'Activo')
+        self.assertIn("Lote 3 (filas 6-7)", salida)
+        self.assertIn("Creados: 2, Actualizados: 2, Omitidos: 2.", salida)
+        self.assertIn("Fila 7 (Patente: DVMAL-1): RUT '80.010.900-9' con dígito verificador inválido (se esperaba 0).", salida)
+        self.assertFalse(Vehiculo.objects.filter(patente='DVMAL-1').exists())
+        # Empresas resueltas por el mapa en memoria: la existente se reutiliza, sin una consulta por fila
+        self.assertEqual(Empresa.objects.count(), 1)
+        self.assertLessEqual(len([q for q in ctx.captured_queries if 'agendamiento_empresa' in q['sql']]), 1)
+        self.assertIn("filas/s", salida)
+        self.assertNotIn("creado.", salida) # Sin una línea por fila
+        # Por lote: prefetch de patentes, bulk_create y bulk_update, nunca una consulta por fila
+        self.assertLessEqual(len([q for q in ctx.captured_queries if 'agendamiento_vehiculo' in q['sql']]), 3 * 3)
+
+    def test_parseo_en_paralelo_reporta_igual_que_secuencial(self):
+        filas = []
+        for i in range(40):
+            if i % 7 == 3:
+                filas.append("Agenciamiento,,,SINRUT{i:02d},Camioneta,MITSUBISHI,L-200,4x2,Activo\n".format(i=i))
+            elif i % 11 == 5:
+                filas.append("Agenciamiento,,80.010.900-0,,Camioneta,MITSUBISHI,L-200,4x2,Activo\n")
+            else:
+                filas.append(f"Agenciamiento,,80.010.900-0,PP{i:02d}-{i:02d},Camioneta,MITSUBISHI,L-200,4x2,Activo\n")
+
+        def sin_tiempos(salida):
+            return [linea for linea in salida.splitlines() if 'filas/s' not in linea and 'Iniciando' not in linea]
+
+        secuencial = sin_tiempos(self._cargar(filas, batch_size=4))
+        Vehiculo.objects.all().delete()
+        Empresa.objects.all().delete()
+        paralelo = sin_tiempos(self._cargar(filas, batch_size=4, workers=2))
+        self.assertEqual(secuencial, paralelo)
+        self.assertIn("Fila 5 (Patente: SINRUT03): RUT faltante. Se omite esta fila.", paralelo)
+        self.assertEqual(Vehiculo.objects.count(), 40 - 6 - 3)
+
+
+class LoadCsvDataUsuariosMasivoTests(TestCase):
+    ENCABEZADO = "USUARIO,RAZON SOCIAL,RAZON SOCIAL2,RUT,CIUDAD\n"
+
+    def _cargar(self, filas, **opciones):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as archivo:
+            archivo.write(self.ENCABEZADO + "".join(filas))
+        salida = StringIO()
+        try:
+            call_command('load_csv_data', archivo.name, 'UsuarioSistema', stdout=salida, **opciones)
+        finally:
+            os.unlink(archivo.name)
+        return salida.getvalue()
+
+    def test_crea_usuarios_y_perfiles_en_bloque(self):
+        User.objects.create(username='ricardoclavijo')
+        filas = [
+            "RICARDO CLAVIJO,Agenciamiento,,80010900-0,SANTIAGO\n",
+            "RICARDO CLAVIJO,Agenciamiento,,80.010.900-0,TALCA\n",
+            ",Agenciamiento,,80.010.900-0,SANTIAGO\n",
+            "ANA PEREZ,Agenciamiento,,,SANTIAGO\n",
+        ] + [f"CONDUCTOR {i},Agenciamiento,,80.010.900-0,SANTIAGO\n" for i in range(20)]
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta_tokens = os.path.join(directorio, 'tokens.csv')
+            with CaptureQueriesContext(connection) as ctx:
+                salida = self._cargar(filas, batch_size=100, tokens_salida=ruta_tokens)
+            with open(ruta_tokens, encoding='utf-8') as archivo:
+                tokens = list(csv.DictReader(archivo))
+
+        perfil = UsuarioSistema.objects.select_related('user', 'empresa').get(user__username='ricardoclavijo1')
+        self.assertEqual(perfil.empresa.rut, '80.010.900-0')
+        self.assertEqual(perfil.empresa.razon_social, 'Agenciamiento')
+        self.assertEqual(perfil.user.first_name, 'RICARDO')
+        self.assertEqual(perfil.user.last_name, 'CLAVIJO')
+        self.assertFalse(perfil.user.has_usable_password())
+        self.assertEqual(UsuarioSistema.objects.get(user__username='ricardoclavijo2').ciudad, 'TALCA')
+        self.assertEqual(UsuarioSistema.objects.filter(empresa__razon_social='Agenciamiento').count(), 22)
+        self.assertIn("Creados: 22, Omitidos: 2.", salida)
+        self.assertIn("Tiempos por fase:", salida)
+        self.assertEqual(len(tokens), 22)
+        user = User.objects.get(username=tokens[0]['username'])
+        self.assertTrue(default_token_generator.check_token(user, tokens[0]['token']))
+        # Sin consultas por fila: usernames en un set, usuarios y perfiles con bulk_create
+        self.assertLessEqual(len(ctx.captured_queries), 10)
+
+    def test_clave_temporal(self):
+        self._cargar(["ANA PEREZ,Agenciamiento,,80.010.900-0,SANTIAGO\n"], batch_size=100, claves='temporal')
+        self.assertTrue(User.objects.get(username='anaperez').check_password('password123'))
+
+
+class ValidadoresTests(TestCase):
+    def test_digito_verificador(self):
+        self.assertEqual(digito_verificador('80010900'), '0')
+        self.assertEqual(digito_verificador('11111111'), '1')
+        self.assertEqual(digito_verificador('10000013'), 'K')
+        self.assertEqual(digito_verificador('1000005'), 'K')
+
+    def test_verificar_rut_normaliza_y_rechaza_digito_incorrecto(self):
+        self.assertEqual(verificar_rut('80010900-0'), ('80.010.900-0', None))
+        self.assertEqual(verificar_rut(' 10.000.013-k '), ('10.000.013-K', None))
+        self.assertEqual(verificar_rut(''), (None, None))
+        rut, error = verificar_rut('80.010.900-1')
+        self.assertIsNone(rut)
+        self.assertIn("dígito verificador inválido (se esperaba 0)", error)
+        self.assertIn("formato inválido", verificar_rut('ABC')[1])
+
+    def test_verificar_ruts_por_columna(self):
+        valores = ['80010900-0', '80010900-1', '', '80010900-0']
+        self.assertEqual(verificar_ruts(valores), [verificar_rut(v) for v in valores])
+
+    def test_normalizar_patente(self):
+        self.assertEqual(normalizar_patente(' rfwb77 '), ('RFWB-77', None))
+        self.assertEqual(normalizar_patente('AB-CD-12'), ('AB-CD-12', None))
+        self.assertIsNotNone(normalizar_patente('AB CD')[1])
+
+    def test_clean_de_modelos_verifica_digito(self):
+        empresa = Empresa(razon_social=RAZON_SOCIAL, rut='80.010.900-1')
+        with self.assertRaises(ValidationError) as ctx:
+            empresa.clean()
+        self.assertIn('rut', ctx.exception.message_dict)
+        empresa.rut = '80.010.900-0'
+        empresa.clean()
+        vehiculo = Vehiculo(patente='rfwb-77')
+        vehiculo.clean()
+        self.assertEqual(vehiculo.patente, 'RFWB-77')
+        vehiculo.patente = 'RFWB 77'
+        with self.assertRaises(ValidationError) as ctx:
+            vehiculo.clean()
+        self.assertIn('patente', ctx.exception.message_dict)
+
+
+@skipUnless(connection.vendor == 'sqlite', "Usa EXPLAIN QUERY PLAN de SQLite")
+class PlanesDeConsultaTests(TestCase):
+    """Las consultas de las vistas deben usar índices, nunca recorrer tablas completas."""
+
+    def setUp(self):
+        self.user, self.perfil = crear_usuario('conductor')
+        self.client.force_login(self.user)
+        self.fecha = date.today() + timedelta(days=1)
+        crear_flota(5)
+        crear_flota(5, razon_social='Otra Empresa', prefijo='O')
+        for vehiculo in Vehiculo.objects.all():
+            Reserva.objects.create(vehiculo=vehiculo, usuario=self.perfil, fecha_reserva=self.fecha, hora_inicio_reserva=time(8))
+        cache_disponibilidad.limpiar()
+
+    def _planes(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        planes = {}
+        with connection.cursor() as cursor:
+            for consulta in ctx.captured_queries:
+                sql = consulta['sql']
+                if sql.startswith('SELECT') and 'agendamiento_' in sql:
+                    cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                    planes[sql] = [fila[-1] for fila in cursor.fetchall()]
+        self.assertTrue(planes)
+        return planes
+
+    def _assert_sin_recorridos_completos(self, url):
+        for sql, plan in self._planes(url).items():
+            for paso in plan:
+                # "SCAN tabla" sin "USING ... INDEX" es un recorrido completo de la tabla
+                if paso.startswith('SCAN') and 'INDEX' not in paso:
+                    self.fail(f"Recorrido completo ({paso}) en:\n{sql}\nPlan: {plan}")
+                if 'TEMP B-TREE' in paso:
+                    self.fail(f"Ordenamiento sin índice ({paso}) en:\n{sql}\nPlan: {plan}")
+
+    def test_mostrar_disponibilidad(self):
+        self._assert_sin_recorridos_completos(
+            reverse('agendamiento:mostrar_disponibilidad', kwargs={'fecha_str': self.fecha.isoformat()})
+        )
+
+    def test_disponibilidad_rango(self):
+        self._assert_sin_recorridos_completos(
+            reverse('agendamiento:disponibilidad_rango') + f"?desde={self.fecha.isoformat()}&hasta={(self.fecha + timedelta(days=6)).isoformat()}"
+        )
+
+    def test_mis_reservas(self):
+        self._assert_sin_recorridos_completos(reverse('agendamiento:mis_reservas'))
+
+    def test_mis_reservas_paginas_siguientes(self):
+        cursor = codificar_cursor(Reserva.objects.filter(usuario=self.perfil).first())
+        url = reverse('agendamiento:mis_reservas')
+        self._assert_sin_recorridos_completos(f"{url}?vista=proximas&despues={cursor}")
+        self._assert_sin_recorridos_completos(f"{url}?vista=pasadas&despues={cursor}")
+
+
+
+class MisReservasTests(TestCase):
+    """Mis Reservas se pagina por cursor sobre (fecha, hora, id), con el vehículo cargado en la misma consulta."""
+
+    def setUp(self):
+        self.user, self.perfil = crear_usuario('conductor')
+        self.client.force_login(self.user)
+        calentar_perfil(self.client)
+        self.hoy = timezone.localdate()
+        self.vehiculos = crear_flota(2)
+        self.url = reverse('agendamiento:mis_reservas')
+
+    def _crear_reservas(self, dias, horas=HORARIOS_OPERACION[:3]):
+        # Dos vehículos por bloque: filas con la misma fecha y hora que solo se distinguen por id
+        Reserva.objects.bulk_create([
+            Reserva(vehiculo=vehiculo, usuario=self.perfil, fecha_reserva=self.hoy + timedelta(days=dia),
+                    hora_inicio_reserva=hora, hora_fin_reserva=time(hora.hour + 1))
+            for dia in dias for hora in horas for vehiculo in self.vehiculos
+        ])
+
+    def _recorrer(self, vista, por_pagina):
+        ids, cursor = [], None
+        while True:
+            pagina = pagina_de_reservas(self.perfil, vista, cursor, por_pagina=por_pagina, hoy=self.hoy)
+            ids.extend(reserva.id for reserva in pagina.reservas)
+            if not pagina.cursor_siguiente:
+                return ids
+            cursor = pagina.cursor_siguiente
+
+    def test_paginas_recorren_todas_las_reservas_en_orden(self):
+        self._crear_reservas(range(-4, 4))
+        reservas = Reserva.objects.filter(usuario=self.perfil)
+        proximas = reservas.filter(fecha_reserva__gte=self.hoy).order_by('fecha_reserva', 'hora_inicio_reserva', 'id')
+        pasadas = reservas.filter(fecha_reserva__lt=self.hoy).order_by('-fecha_reserva', '-hora_inicio_reserva', '-id')
+        self.assertEqual(self._recorrer(PROXIMAS, 5), list(proximas.values_list('id', flat=True)))
+        self.assertEqual(self._recorrer(PASADAS, 5), list(pasadas.values_list('id', flat=True)))
+
+    def _consultas(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_consultas_constantes_sin_importar_cuantas_reservas(self):
+        self._crear_reservas(range(0, 5))
+        pocas, response = self._consultas(self.url)
+        segunda_pagina = f"{self.url}?vista={PROXIMAS}&despues={response.context['pagina'].cursor_siguiente}"
+        pocas_segunda, _ = self._consultas(segunda_pagina)
+
+        self._crear_reservas(range(5, 200))
+        muchas, response = self._consultas(self.url)
+        self.assertEqual(muchas, pocas)
+        self.assertEqual(len(response.context['reservas']), 20)
+        self.assertEqual(self._consultas(segunda_pagina)[0], pocas_segunda)
+
+    def test_cancelar_desde_una_pagina_siguiente(self):
+        self._crear_reservas(range(0, 5))
+        cursor = self.client.get(self.url).context['pagina'].cursor_siguiente
+        segunda_pagina = self.client.get(self.url, {'vista': PROXIMAS, 'despues': cursor}).context['reservas']
+        cancelada = segunda_pagina[0]
+
+        response = self.client.post(self.url, {'reserva_id': cancelada.id, 'vista': PROXIMAS, 'despues': cursor})
+        self.assertRedirects(response, f"{self.url}?vista={PROXIMAS}&despues={cursor.replace(':', '%3A')}")
+        self.assertFalse(Reserva.objects.filter(id=cancelada.id).exists())
+        # La página sigue desde el mismo punto: solo desaparece la reserva cancelada
+        self.assertEqual(self.client.get(response.url).context['reservas'][:len(segunda_pagina) - 1], segunda_pagina[1:])
+
+    def test_cursor_invalido_muestra_la_primera_pagina(self):
+        self._crear_reservas([1])
+        response = self.client.get(self.url, {'vista': 'otra', 'despues': 'no-es-un-cursor'})
+        self.assertEqual(response.context['vista'], PROXIMAS)
+        self.assertEqual(len(response.context['reservas']), 6)
+
+
+class MetricasTests(TestCase):
+    """El middleware agrega latencia, consultas y plantillas por vista; /metricas/ las expone a staff."""
+
+    def setUp(self):
+        metricas.reiniciar()
+        self.user, self.perfil = crear_usuario('conductor')
+        self.staff = User.objects.create(username='operaciones', is_staff=True)
+        self.url = reverse('agendamiento:metricas')
+
+    def _exportado(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_registra_consultas_y_plantillas_por_vista(self):
+        self.client.force_login(self.user)
+        consultas = 0
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as ctx: # request_started reinicia el registro de consultas
+                self.client.get(reverse('agendamiento:mis_reservas'))
+            consultas += len(ctx.captured_queries)
+        texto = self._exportado()
+
+        serie = 'vista="agendamiento:mis_reservas"'
+        self.assertIn(f'agendamiento_solicitud_segundos_count{{{serie}}} 2', texto)
+        self.assertIn(f'agendamiento_consultas_bd_sum{{{serie}}} {consultas}', texto)
+        self.assertIn(f'agendamiento_plantillas_segundos_count{{{serie}}} 2', texto)
+        self.assertIn(f'agendamiento_consultas_bd_bucket{{{serie},le="+Inf"}} 2', texto)
+        # El admin y las URLs sin nombre no agregan series
+        self.assertNotIn('admin:', texto)
+
+    def test_registro_debug_solo_con_el_nivel_activo(self):
+        self.client.force_login(self.user)
+        url = reverse('agendamiento:mis_reservas')
+        with mock.patch('agendamiento.middleware.logger.debug') as debug:
+            self.client.get(url)
+        debug.assert_not_called()
+        with self.assertLogs('agendamiento.middleware', level='DEBUG') as logs:
+            self.client.get(url)
+        self.assertEqual(logs.records[0].vista, 'agendamiento:mis_reservas')
+
+    def test_buckets_acumulados(self):
+        histograma = metricas.Histograma('prueba', 'Prueba.', (1, 5))
+        for valor in (0, 1, 3, 9):
+            histograma.observar('v', valor)
+        self.assertEqual(histograma.exportar()[2:], [
+            'prueba_bucket{vista="v",le="1"} 2', 'prueba_bucket{vista="v",le="5"} 3', 'prueba_bucket{vista="v",le="+Inf"} 4',
+            'prueba_sum{vista="v"} 13', 'prueba_count{vista="v"} 4',
+        ])
+
+    def test_solo_staff(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_formulario_registra_en_debug_sin_escribir_en_stdout(self):
+        vehiculo = crear_flota(1)[0]
+        fecha = date.today() + timedelta(days=1)
+        with mock.patch('sys.stdout', new_callable=StringIO) as salida:
+            ReservaForm(vehiculo=vehiculo, fecha=fecha, usuario_sistema=self.perfil)
+        self.assertEqual(salida.getvalue(), '')
+        with self.assertLogs('agendamiento.forms', level='DEBUG') as logs:
+            ReservaForm(vehiculo=vehiculo, fecha=fecha, usuario_sistema=self.perfil)
+        self.assertEqual(logs.records[0].vehiculo_id, vehiculo.id)
+        self.assertEqual(len(logs.records[0].bloques_disponibles), len(HORARIOS_OPERACION))
+
+
+class CalendarioTests(TestCase):
+    """Horarios por empresa y día de la semana, feriados y tablas de bloques compiladas una sola vez."""
+
+    def setUp(self):
+        calendarios.limpiar()
+        self.user, self.perfil = crear_usuario('conductor')
+        self.client.force_login(self.user)
+        self.vehiculo = crear_flota(1)[0]
+        hoy = date.today()
+        self.lunes = hoy + timedelta(days=7 - hoy.weekday()) # Próximo lunes (siempre en el futuro)
+        self.martes = self.lunes + timedelta(days=1)
+        HorarioOperacion.objects.create(empresa=self.perfil.empresa, dia_semana=0, hora_apertura=time(9), hora_cierre=time(12))
+
+    def tearDown(self):
+        # Los ids de empresa se reutilizan tras el rollback de cada test: no dejar calendarios compilados
+        calendarios.limpiar()
+
+    def _grilla(self, fecha):
+        response = self.client.get(reverse('agendamiento:mostrar_disponibilidad', kwargs={'fecha_str': fecha.isoformat()}))
+        return response.context['disponibilidad_data']
+
+    def test_tabla_compilada_una_vez_por_conjunto_de_horas(self):
+        tabla = compilar_tabla((9, 10))
+        self.assertIs(compilar_tabla((9, 10)), tabla)
+        bloque = tabla.por_clave['09:00:00']
+        self.assertEqual((bloque.inicio, bloque.fin, bloque.etiqueta, bloque.id_checkbox), (time(9), time(10), '09:00 - 10:00', 'id_bloque_090000'))
+        self.assertEqual(tabla.mascara, OcupacionVehiculoDia.mascara_de_horas([time(9), time(10)]))
+        with self.assertRaises(AttributeError):
+            bloque.etiqueta = 'otra'
+
+    def test_grilla_y_formulario_siguen_el_calendario(self):
+        self.assertEqual(list(self._grilla(self.lunes)[self.vehiculo.id]['horarios']), ['09:00:00', '10:00:00', '11:00:00'])
+        self.assertEqual(self._grilla(self.martes), {}) # Sin horario el martes: cerrado
+
+        form = ReservaForm(vehiculo=self.vehiculo, fecha=self.lunes, usuario_sistema=self.perfil)
+        self.assertEqual([valor for valor, _ in form.fields['bloques_seleccionados'].choices], ['09:00:00', '10:00:00', '11:00:00'])
+        url = reverse('agendamiento:reservar_vehiculo', kwargs={'vehiculo_id': self.vehiculo.id, 'fecha_str': self.lunes.isoformat()})
+        self.client.post(url, {'vehiculo_id': self.vehiculo.id, 'fecha_reserva': self.lunes.isoformat(), 'bloques_seleccionados': ['08:00:00']})
+        self.assertFalse(Reserva.objects.exists()) # 08:00 está fuera del horario de la empresa
+
+    def test_feriado_de_todas_las_empresas(self):
+        DiaNoOperativo.objects.create(fecha=self.lunes, descripcion='Feriado')
+        self.assertEqual(self._grilla(self.lunes), {})
+        form = ReservaForm(vehiculo=self.vehiculo, fecha=self.lunes, usuario_sistema=self.perfil)
+        self.assertNotIn('bloques_seleccionados', form.fields)
+
+    def test_un_solo_feriado_de_todas_las_empresas_por_fecha(self):
+        DiaNoOperativo.objects.create(fecha=self.lunes, descripcion='Feriado')
+        with self.assertRaises(ValidationError):
+            DiaNoOperativo(fecha=self.lunes, descripcion='Repetido').full_clean()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DiaNoOperativo.objects.create(fecha=self.lunes, descripcion='Repetido')
+        DiaNoOperativo.objects.create(empresa=self.perfil.empresa, fecha=self.lunes) # Uno de la empresa sí se permite
+
+    def test_cambiar_la_empresa_de_un_feriado_invalida_ambos_calendarios(self):
+        empresa_id = self.perfil.empresa_id
+        otra_id = obtener_empresa('Otra Empresa SpA').id
+        dia = DiaNoOperativo.objects.create(empresa_id=empresa_id, fecha=self.lunes)
+        self.assertEqual(self._grilla(self.lunes), {})
+        dia.empresa_id = otra_id
+        dia.save()
+        self.assertEqual(len(calendarios.tabla(empresa_id, self.lunes)), 3)
+        self.assertEqual(len(calendarios.tabla(otra_id, self.lunes)), 0)
+
+    def test_se_recompila_solo_cuando_cambia_el_calendario(self):
+        empresa_id = self.perfil.empresa_id
+        calendarios.de_empresa(empresa_id)
+        with self.assertNumQueries(0):
+            calendarios.de_empresa(empresa_id)
+        HorarioOperacion.objects.create(empresa_id=empresa_id, dia_semana=1, hora_apertura=time(14), hora_cierre=time(16))
+        with self.assertNumQueries(2):
+            self.assertEqual(calendarios.tabla(empresa_id, self.martes).horas(), [time(14), time(15)])
+
+    def test_con_cache_local_la_version_expira(self):
+        # Un cambio hecho por otro proceso (sin rotar la versión de este) se ve cuando la versión expira
+        empresa_id = self.perfil.empresa_id
+        calendarios.de_empresa(empresa_id)
+        HorarioOperacion.objects.filter(empresa_id=empresa_id).update(hora_cierre=time(10))
+        self.assertEqual(len(calendarios.tabla(empresa_id, self.lunes)), 3)
+        with mock.patch('time.time', return_value=time_module.time() + 61):
+            self.assertEqual(calendarios.tabla(empresa_id, self.lunes).horas(), [time(9)])
+        self.assertEqual([aviso.id for aviso in checks.revisar_cache_por_defecto(None)], ['agendamiento.W001'])
+
+    def test_api_de_rango_informa_bloques_operativos(self):
+        response = self.client.get(reverse('agendamiento:disponibilidad_rango'), {'desde': self.lunes.isoformat(), 'hasta': self.martes.isoformat()})
+        data = response.json()
+        self.assertEqual(data['horarios'], ['09:00', '10:00', '11:00'])
+        self.assertEqual(data['operacion'], [OcupacionVehiculoDia.mascara_de_horas([time(9), time(10), time(11)]), 0])
+
+    def test_empresa_sin_horarios_usa_el_horario_por_defecto(self):
+        otro, perfil = crear_usuario('otro', razon_social='Otra Empresa')
+        self.assertEqual(calendarios.tabla(perfil.empresa_id, self.martes).horas(), HORARIOS_OPERACION)
+
+    def test_rechaza_rangos_traslapados_o_sin_hora_exacta(self):
+        empresa = self.perfil.empresa
+        with self.assertRaises(ValidationError):
+            HorarioOperacion(empresa=empresa, dia_semana=0, hora_apertura=time(11), hora_cierre=time(13)).full_clean()
+        with self.assertRaises(ValidationError):
+            HorarioOperacion(empresa=empresa, dia_semana=2, hora_apertura=time(8, 30), hora_cierre=time(12)).full_clean()
+
+# Las pruebas corren en un solo proceso: las cachés locales sirven para los sellos
+@override_settings(AGENDAMIENTO_RESPUESTAS_CONDICIONALES=True)
+class CondicionalTests(TestCase):
+    """Disponibilidad y reserva responden 304 si nada cambió, sin leer reservas ni renderizar plantillas."""
+
+    def setUp(self):
+        cache_disponibilidad.limpiar()
+        self.user, self.perfil = crear_usuario('conductor')
+        self.client.force_login(self.user)
+        self.vehiculo, = crear_flota(1)
+        self.fecha = date.today() + timedelta(days=1)
+        self.url = reverse('agendamiento:mostrar_disponibilidad', kwargs={'fecha_str': self.fecha.isoformat()})
+        self.url_reserva = reverse('agendamiento:reservar_vehiculo', kwargs={'vehiculo_id': self.vehiculo.id, 'fecha_str': self.fecha.isoformat()})
+
+    def _etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def _reservar(self):
+        self.client.post(self.url_reserva, {
+            'vehiculo_id': self.vehiculo.id, 'fecha_reserva': self.fecha.isoformat(), 'bloques_seleccionados': ['08:00:00'],
+        })
+        self.client.get(self.url) # Muestra (y consume) el mensaje de la reserva
+
+    def test_304_sin_consultar_reservas_ni_renderizar(self):
+        etag = self._etag(self.url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response.templates, [])
+        sql = ' '.join(consulta['sql'] for consulta in ctx.captured_queries)
+        self.assertNotIn('agendamiento_reserva', sql)
+        self.assertNotIn('agendamiento_ocupacionvehiculodia', sql)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_reserva_cancelacion_y_vehiculo_cambian_el_etag(self):
+        etags = [self._etag(self.url)]
+        self._reservar()
+        etags.append(self._etag(self.url))
+
+        reserva = Reserva.objects.get(vehiculo=self.vehiculo, fecha_reserva=self.fecha)
+        self.client.post(reverse('agendamiento:mis_reservas'), {'reserva_id': reserva.id})
+        self.client.get(reverse('agendamiento:mis_reservas')) # Consume el mensaje de la cancelación
+        etags.append(self._etag(self.url))
+
+        self.vehiculo.estado = 'Mantenimiento'
+        self.vehiculo.save()
+        etags.append(self._etag(self.url))
+        self.assertEqual(len(set(etags)), len(etags))
+
+        # Con el ETag anterior a un cambio la página se vuelve a renderizar
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etags[0])
+        self.assertEqual(response.status_code, 200)
+
+    def test_pagina_de_reserva(self):
+        self.client.get(self.url_reserva) # El primer render fija la cookie CSRF, que es parte del ETag
+        etag = self._etag(self.url_reserva)
+        self.assertEqual(self.client.get(self.url_reserva, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self._reservar()
+        self.assertNotEqual(self._etag(self.url_reserva), etag)
+
+    def test_mensajes_pendientes_se_muestran(self):
+        etag = self._etag(self.url)
+        otro_dia = self.fecha + timedelta(days=1)
+        url_otro_dia = reverse('agendamiento:reservar_vehiculo', kwargs={'vehiculo_id': self.vehiculo.id, 'fecha_str': otro_dia.isoformat()})
+        self.client.post(url_otro_dia, {
+            'vehiculo_id': self.vehiculo.id, 'fecha_reserva': otro_dia.isoformat(), 'bloques_seleccionados': ['08:00:00'],
+        }) # Reserva de otra fecha: el ETag de esta no cambia, pero queda un mensaje por mostrar
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(list(response.context['messages']))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    @override_settings(AGENDAMIENTO_RESPUESTAS_CONDICIONALES=None)
+    def test_con_caches_locales_no_hay_304(self):
+        # Otro worker no vería cambiar el sello de esta caché: no se responde 304 ni se envía ETag
+        response = self.client.get(self.url)
+        self.assertNotIn('ETag', response)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"x"').status_code, 200)
+        self.assertEqual(checks.revisar_respuestas_condicionales(None), [])
+        with override_settings(AGENDAMIENTO_RESPUESTAS_CONDICIONALES=True):
+            self.assertEqual([error.id for error in checks.revisar_respuestas_condicionales(None)], ['agendamiento.E002'])
+
+
+class EventosDisponibilidadTests(TestCase):
+    """Las grillas abiertas reciben por server-sent events los bloques que se reservan o liberan."""
+
+    def setUp(self):
+        self.user, self.perfil = crear_usuario('conductor')
+        self.otro_user, self.otro_perfil = crear_usuario('otro')
+        self.vehiculo, = crear_flota(1)
+        self.fecha = date.today() + timedelta(days=1)
+        self.url = reverse('agendamiento:eventos_disponibilidad', kwargs={'fecha_str': self.fecha.isoformat()})
+
+    def _reservar(self, perfil, hora):
+        with self.captureOnCommitCallbacks(execute=True):
+            return reservar_bloques(self.vehiculo, self.fecha, perfil, [hora])
+
+    def _cancelar(self, reserva):
+        with self.captureOnCommitCallbacks(execute=True):
+            reserva.delete()
+
+    async def _evento(self, flujo):
+        while True:
+            trozo = (await asyncio.wait_for(anext(flujo), 2)).decode()
+            if not trozo.startswith(':'): # Latidos
+                return trozo
+
+    async def test_difunde_reservas_y_cancelaciones(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        flujo = aiter(response.streaming_content)
+        self.assertEqual(await anext(flujo), b'retry: 3000\n\n') # Ya suscrito
+        self.assertEqual(difusor.suscriptores(self.perfil.empresa_id, self.fecha), 1)
+
+        resultado = await sync_to_async(self._reservar)(self.otro_perfil, time(9))
+        evento = await self._evento(flujo)
+        self.assertIn('event: bloques\n', evento)
+        datos = json.loads(evento.split('data: ')[1])
+        self.assertEqual(datos, {'estado': 'reservado', 'vehiculo_id': self.vehiculo.id, 'horas': ['09:00'], 'propia': False})
+
+        await sync_to_async(self._cancelar)(resultado.reservas[0])
+        datos = json.loads((await self._evento(flujo)).split('data: ')[1])
+        self.assertEqual((datos['estado'], datos['horas']), ('libre', ['09:00']))
+
+        await sync_to_async(self._reservar)(self.perfil, time(10))
+        self.assertTrue(json.loads((await self._evento(flujo)).split('data: ')[1])['propia'])
+
+        # El cliente se desconecta: el servidor ASGI cancela la tarea que espera el próximo evento
+        tarea = asyncio.ensure_future(anext(flujo))
+        await asyncio.sleep(0)
+        tarea.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await tarea
+        self.assertEqual(difusor.suscriptores(self.perfil.empresa_id, self.fecha), 0)
+
+    async def test_cliente_atrasado_recibe_recargar(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url, headers={'Last-Event-ID': '7'})
+        flujo = aiter(response.streaming_content)
+        self.assertIn(b'event: recargar', await anext(flujo)) # Reconexión: pudo perder eventos
+        for _ in range(MAX_PENDIENTES + 1):
+            difusor.publicar(self.perfil.empresa_id, self.fecha, {'tipo': 'recargar'})
+        await asyncio.sleep(0)
+        self.assertEqual(await anext(flujo), b'event: recargar\ndata: {}\n\n')
+        with self.assertRaises(StopAsyncIteration):
+            await anext(flujo)
+        self.assertEqual(difusor.suscriptores(), 0)
+
+    async def test_flujos_abiertos_no_retienen_hilos(self):
+        # ASGIHandler retiene un hilo por solicitud hasta cerrar la respuesta; ConEventosDisponibilidad no
+        aplicacion = ConEventosDisponibilidad(get_asgi_application())
+        await self.async_client.aforce_login(self.user)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.async_client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': self.url, 'raw_path': self.url.encode(), 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())], 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+        }
+        cerrar = asyncio.Event()
+        mensajes = []
+
+        async def receive():
+            if not any(m is None for m in mensajes):
+                mensajes.append(None) # Marca: cuerpo de la solicitud ya entregado
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await cerrar.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(mensaje):
+            mensajes.append(mensaje)
+
+        # Como el cliente de pruebas: que request_finished no cierre la conexión de la transacción del test
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            hilos = threading.active_count()
+            tareas = [asyncio.ensure_future(aplicacion(dict(scope), receive, send)) for _ in range(10)]
+            async def suscritas():
+                while difusor.suscriptores(self.perfil.empresa_id, self.fecha) < 10:
+                    await asyncio.sleep(0.01)
+            await asyncio.wait_for(suscritas(), 5)
+            self.assertLessEqual(threading.active_count(), hilos)
+            self.assertEqual([m['status'] for m in mensajes if m and m['type'] == 'http.response.start'], [200] * 10)
+            cerrar.set()
+            await asyncio.wait_for(asyncio.gather(*tareas), 2)
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+        self.assertEqual(difusor.suscriptores(), 0)
+
+    def test_bajo_wsgi_responde_204(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(self.url).status_code, 204)
+
+
+class VistasAsyncTests(TestCase):
+    """Disponibilidad, Mis Reservas y la API de rango son async y funcionan bajo ASGI sin tocar el ORM síncrono."""
+
+    def setUp(self):
+        cache_disponibilidad.limpiar()
+        metricas.reiniciar()
+        self.user, self.perfil = crear_usuario('conductor')
+        self.vehiculo, = crear_flota(1)
+        self.fecha = date.today() + timedelta(days=1)
+        Reserva.objects.create(vehiculo=self.vehiculo, usuario=self.perfil, fecha_reserva=self.fecha, hora_inicio_reserva=time(8))
+
+    async def test_vistas_de_lectura_bajo_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(
+            reverse('agendamiento:mostrar_disponibilidad', kwargs={'fecha_str': self.fecha.isoformat()}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['disponibilidad_data'][self.vehiculo.id]['horarios']['08:00:00']['reservado_por_mi'])
+        self.assertContains(response, 'Hola, conductor')
+
+        response = await self.async_client.get(reverse('agendamiento:mis_reservas'))
+        self.assertEqual([r.vehiculo.patente for r in response.context['reservas']], [self.vehiculo.patente])
+
+        response = await self.async_client.get(reverse('agendamiento:disponibilidad_rango'),
+                                               {'desde': self.fecha.isoformat(), 'hasta': self.fecha.isoformat()})
+        self.assertEqual(response.json()['vehiculos'][0]['ocupacion'], [OcupacionVehiculoDia.mascara_de_horas([time(8)])])
+
+        # Las consultas del ORM async (en otro hilo) igual se suman a la medición de la solicitud
+        self.assertGreater(metricas.CONSULTAS_BD._series['agendamiento:mis_reservas'][1], 0)
+
+    async def test_cancelacion_desde_mis_reservas(self):
+        await self.async_client.aforce_login(self.user)
+        reserva = await Reserva.objects.aget(usuario=self.perfil)
+        response = await self.async_client.post(reverse('agendamiento:mis_reservas'), {'reserva_id': reserva.id})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(await Reserva.objects.aexists())
+        ocupacion = await sync_to_async(OcupacionVehiculoDia.obtener)(self.vehiculo.id, self.fecha)
+        self.assertTrue(ocupacion.esta_libre(time(8)))
+
+
+@override_settings(AGENDAMIENTO_BD_REPLICAS=['replica'])
+class EnrutadorLecturasTests(TestCase):
+    """Disponibilidad y Mis Reservas leen de la réplica; quien acaba de escribir lee de la primaria."""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache_disponibilidad.limpiar()
+        self.user, self.perfil = crear_usuario('conductor')
+        self.otro_user, _ = crear_usuario('otro')
+        self.vehiculo, = crear_flota(1)
+        # La réplica queda al día hasta aquí y no recibe nada de lo que sigue: una réplica muy atrasada
+        for modelo in (User, Empresa, UsuarioSistema, Vehiculo):
+            modelo.objects.using('replica').bulk_create(modelo.objects.all())
+        self.fecha = date.today() + timedelta(days=1)
+        self.url = reverse('agendamiento:mostrar_disponibilidad', kwargs={'fecha_str': self.fecha.isoformat()})
+        self.url_reserva = reverse('agendamiento:reservar_vehiculo', kwargs={'vehiculo_id': self.vehiculo.id, 'fecha_str': self.fecha.isoformat()})
+        self.client.force_login(self.user)
+        self.otro = Client()
+        self.otro.force_login(self.otro_user)
+
+    def _bloque_8(self, client):
+        return client.get(self.url).context['disponibilidad_data'][self.vehiculo.id]['horarios']['08:00:00']
+
+    def test_quien_reserva_nunca_ve_su_bloque_libre(self):
+        self.assertTrue(self._bloque_8(self.client)['disponible'])
+        self.client.post(self.url_reserva, {
+            'vehiculo_id': self.vehiculo.id, 'fecha_reserva': self.fecha.isoformat(), 'bloques_seleccionados': ['08:00:00'],
+        })
+        self.assertTrue(Reserva.objects.using('default').exists())
+        self.assertFalse(Reserva.objects.using('replica').exists())
+
+        # Otro usuario lee de la réplica atrasada (y llena la caché) antes de que quien reservó recargue
+        self.assertTrue(self._bloque_8(self.otro)['disponible'])
+        for _ in range(2):
+            self.assertTrue(self._bloque_8(self.client)['reservado_por_mi'])
+        self.assertEqual(len(self.client.get(reverse('agendamiento:mis_reservas')).context['reservas']), 1)
+
+        # Vencida la fijación vuelve a leer de la réplica
+        with mock.patch('agendamiento.enrutador.time_module.time', return_value=time_module.time() + 60):
+            self.assertEqual(len(self.client.get(reverse('agendamiento:mis_reservas')).context['reservas']), 0)
+
+    def test_escrituras_y_posts_van_a_la_primaria(self):
+        reserva = Reserva.objects.create(vehiculo=self.vehiculo, usuario=self.perfil, fecha_reserva=self.fecha, hora_inicio_reserva=time(9))
+        self.assertEqual(reserva._state.db, 'default')
+        self.assertEqual(len(self.client.get(reverse('agendamiento:mis_reservas')).context['reservas']), 0) # Réplica atrasada
+        # Cancelar lee la reserva en la primaria aunque la réplica aún no la tenga
+        response = self.client.post(reverse('agendamiento:mis_reservas'), {'reserva_id': reserva.id})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Reserva.objects.exists())
+
+
+CACHES_COMPARTIDAS = {
+    # Un backend que autenticacion.py considera compartido entre procesos (ver caches.py)
+    'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': os.path.join(tempfile.gettempdir(), 'agendamiento-pruebas-cache')},
+    'disponibilidad': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'pruebas-disponibilidad'},
+}
+
+
+@override_settings(CACHES=CACHES_COMPARTIDAS)
+class PerfilEnCacheTests(TestCase):
+    """Usuario, perfil y empresa se cargan juntos y quedan en caché hasta que se editan (ver autenticacion.py)."""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user, self.perfil = crear_usuario('conductor')
+        self.client.force_login(self.user)
+        self.url = reverse('agendamiento:seleccionar_fecha')
+
+    def test_solo_la_sesion_y_la_contrasena_van_a_la_bd(self):
+        calentar_perfil(self.client)
+        with self.assertNumQueries(2): # La sesión (motor 'db') y la contraseña, para el hash de sesión
+            response = self.client.get(self.url)
+        self.assertContains(response, RAZON_SOCIAL)
+        self.assertEqual(response.context['perfil_usuario'], self.perfil)
+
+    def test_la_cache_no_guarda_contrasena_ni_last_login(self):
+        calentar_perfil(self.client)
+        en_cache = caches['default'].get(f"perfil:usuario:{self.user.pk}")
+        self.assertEqual(en_cache.get_deferred_fields(), {'password', 'last_login'})
+        self.assertEqual(en_cache.perfil_sistema.empresa.razon_social, RAZON_SOCIAL)
+
+    def test_contrasena_cambiada_cierra_la_sesion_con_el_usuario_en_cache(self):
+        calentar_perfil(self.client)
+        # Sin señales, como un cambio hecho directo en la BD: el usuario sigue en la caché
+        User.objects.filter(pk=self.user.pk).update(password=make_password('otra-clave'))
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_iniciar_sesion_invalida_la_cache(self):
+        calentar_perfil(self.client)
+        user_logged_in.send(sender=User, request=None, user=self.user)
+        self.assertIsNone(caches['default'].get(f"perfil:usuario:{self.user.pk}"))
+
+    def test_editar_perfil_o_empresa_invalida_la_cache(self):
+        calentar_perfil(self.client)
+        self.perfil.empresa = obtener_empresa('Otra Empresa SpA')
+        self.perfil.save()
+        self.assertContains(self.client.get(self.url), 'Otra Empresa SpA')
+
+        empresa = self.perfil.empresa
+        empresa.razon_social = 'Empresa Renombrada SpA'
+        empresa.save()
+        self.assertContains(self.client.get(self.url), 'Empresa Renombrada SpA')
+
+    def test_usuario_desactivado_pierde_la_sesion(self):
+        calentar_perfil(self.client)
+        self.user.is_active = False
+        self.user.save()
+        self.assertRedirects(self.client.get(self.url), f"{reverse('agendamiento:login')}?next={self.url}", fetch_redirect_response=False)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_con_cache_local_no_se_guarda_el_usuario(self):
+        # Otro proceso no vería la invalidación: un cambio sin señales (como el de otro worker) se ve en la solicitud siguiente
+        calentar_perfil(self.client)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_sesion_en_cookie_firmada_solo_consulta_la_contrasena(self):
+        client = Client()
+        response = client.post(reverse('agendamiento:login'), {'username': 'conductor', 'password': 'clave-de-prueba'})
+        self.assertEqual(response.status_code, 302)
+        calentar_perfil(client)
+        with self.assertNumQueries(1):
+            response = client.get(self.url)
+        self.assertEqual(response.context['perfil_usuario'], self.perfil)
+
+
+class MigracionEmpresasTests(TransactionTestCase):
+    """0005_poblar_empresas deduplica las razones sociales de vehículos y perfiles en filas de Empresa."""
+    antes = [('agendamiento', '0004_empresa')]
+    despues = [('agendamiento', '0005_poblar_empresas')]
+
+    def test_deduplica_razones_sociales(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.antes)
+        apps = executor.loader.project_state(self.antes).apps
+        Vehiculo_ = apps.get_model('agendamiento', 'Vehiculo')
+        UsuarioSistema_ = apps.get_model('agendamiento', 'UsuarioSistema')
+        User_ = apps.get_model('auth', 'User')
+        for i, razon_social in enumerate(['Agenciamiento', 'Agenciamiento', 'AGENCIAMIENTO ', 'Otra Empresa']):
+            Vehiculo_.objects.create(razon_social=razon_social, rut='80.010.900-0', patente=f"MG{i:04d}",
+                                     tipo_vehiculo='Camioneta', marca='M', modelo='M', tipo_transmision='4x2')
+        for i, razon_social in enumerate(['agenciamiento', '']):
+            UsuarioSistema_.objects.create(user=User_.objects.create(username=f"mig{i}"), nombre_usuario_completo='X',
+                                           razon_social_empresa=razon_social, rut_empresa='', ciudad='')
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.despues)
+        apps = executor.loader.project_state(self.despues).apps
+        Empresa_ = apps.get_model('agendamiento', 'Empresa')
+        self.assertEqual(sorted(Empresa_.objects.values_list('razon_social', flat=True)), ['Agenciamiento', 'Otra Empresa'])
+        agenciamiento = Empresa_.objects.get(razon_social='Agenciamiento')
+        self.assertEqual(agenciamiento.rut, '80.010.900-0')
+        Vehiculo_ = apps.get_model('agendamiento', 'Vehiculo')
+        UsuarioSistema_ = apps.get_model('agendamiento', 'UsuarioSistema')
+        self.assertEqual(Vehiculo_.objects.filter(empresa=agenciamiento).count(), 3)
+        self.assertEqual(UsuarioSistema_.objects.get(user__username='mig0').empresa_id, agenciamiento.id)
+        self.assertIsNone(UsuarioSistema_.objects.get(user__username='mig1').empresa_id)
+
+        MigrationExecutor(connection).migrate(executor.loader.graph.leaf_nodes('agendamiento'))
+
+
+class AdminRendimientoTests(TestCase):
+    """Los listados del admin hacen un número de consultas que no depende de la cantidad de filas."""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'clave-de-prueba')
+        self.client.force_login(self.admin)
+        self.fecha = date.today() + timedelta(days=1)
+        self.creados = 0
+
+    def _agregar_datos(self, cantidad):
+        vehiculos = crear_flota(cantidad, prefijo=f"AD{self.creados // 100}")
+        for i, vehiculo in enumerate(vehiculos):
+            user = User.objects.create(username=f"admin_{self.creados + i}") # Sin clave: evita el hash PBKDF2
+            perfil = user.perfil_sistema
+            perfil.empresa = obtener_empresa(f"Empresa {i % 3}")
+            perfil.save()
+            Reserva.objects.create(vehiculo=vehiculo, usuario=perfil, fecha_reserva=self.fecha, hora_inicio_reserva=time(8))
+        self.creados += 100
+
+    def _consultas(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return ctx.captured_queries
+
+    def _assert_consultas_constantes(self, url):
+        self._agregar_datos(3)
+        self._consultas(url) # Llena la caché de opciones de empresa
+        pocas = len(self._consultas(url))
+        self._agregar_datos(30)
+        self.assertEqual(len(self._consultas(url)), pocas)
+
+    def test_listado_de_reservas(self):
+        self._assert_consultas_constantes(reverse('admin:agendamiento_reserva_changelist'))
+
+    def test_listado_de_usuarios_del_sistema(self):
+        self._assert_consultas_constantes(reverse('admin:agendamiento_usuariosistema_changelist'))
+
+    def test_listado_de_vehiculos(self):
+        self._assert_consultas_constantes(reverse('admin:agendamiento_vehiculo_changelist'))
+
+    def test_formulario_de_reserva_usa_autocompletado(self):
+        self._assert_consultas_constantes(reverse('admin:agendamiento_reserva_add'))
+
+    def test_listado_sin_filtros_usa_conteo_estimado(self):
+        self._agregar_datos(3)
+        url = reverse('admin:agendamiento_reserva_changelist')
+        with mock.patch.object(PaginadorConteoEstimado, 'UMBRAL', 1):
+            consultas = [q['sql'] for q in self._consultas(url)]
+            self.assertFalse([sql for sql in consultas if 'COUNT(' in sql])
+            # Con un filtro el conteo es exacto
+            empresa_id = Empresa.objects.get(razon_social='Empresa 0').id
+            consultas = [q['sql'] for q in self._consultas(f"{url}?vehiculo__empresa={empresa_id}")]
+            self.assertEqual(len([sql for sql in consultas if 'COUNT(' in sql]), 1)
+
+    def test_opciones_de_empresa_en_cache(self):
+        self._agregar_datos(3)
+        url = reverse('admin:agendamiento_usuariosistema_changelist')
+        self._consultas(url)
+        self.assertFalse([q for q in self._consultas(url) if 'FROM "agendamiento_empresa"' in q['sql']])
+        obtener_empresa('Empresa nueva')
+        self.assertIn((Empresa.objects.get(razon_social='Empresa nueva').id, 'Empresa nueva'), Empresa.opciones())
@@ -33,8 +33,12 @@ urlpatterns = [
     # Ejemplo de cómo podría estar definida tu URL de seleccionar_fecha (ya debería existir)
     path('seleccionar-fecha/', views.seleccionar_fecha_view, name='seleccionar_fecha'),
     path('mostrar-disponibilidad/<str:fecha_str>/', views.mostrar_disponibilidad_view, name='mostrar_disponibilidad'),
+    path('eventos-disponibilidad/<str:fecha_str>/', views.eventos_disponibilidad_view, name='eventos_disponibilidad'),
+    path('api/disponibilidad/', views.disponibilidad_rango_view, name='disponibilidad_rango'),
     path('reservar/<int:vehiculo_id>/<str:fecha_str>/', views.reservar_vehiculo_view, name='reservar_vehiculo'),
+    path('reservar-serie/<int:vehiculo_id>/', views.reservar_serie_view, name='reservar_serie'),
     path('registro/', views.registro_usuario_view, name='registro'),
     path('logout/', views.logout_view, name='logout'),
     path('mis-reservas/', views.mis_reservas_view, name='mis_reservas'),
+    path('metricas/', views.metricas_view, name='metricas'),
 ]
\ No newline at end of file
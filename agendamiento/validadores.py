@@ -0,0 +1,111 @@
+# agendamiento/validadores.py
+"""
+Validación y normalización de patentes y RUTs, compartida por los modelos
+(clean), los formularios del admin (que llaman a clean) y el importador CSV.
+
+Los patrones se compilan una sola vez al importar el módulo. Las funciones
+verificar_ruts/normalizar_patentes validan una columna completa de valores en
+una llamada; en un CSV los RUTs de empresa se repiten mucho, por lo que cada
+valor distinto se calcula una sola vez.
+"""
+import re
+
+from django.core.exceptions import ValidationError
+
+
+# Formato almacenado en la BD: "80.010.900-0"
+PATRON_RUT = re.compile(r'^\d{1,2}\.\d{3}\.\d{3}-[\dkK]$')
+# RUT sin puntos ni guion (ya en mayúsculas): cuerpo de 7 u 8 dígitos + dígito verificador
+PATRON_RUT_LIMPIO = re.compile(r'^0*(\d{7,8})([\dK])$')
+# Ej: AAAA-11, AA-1111
+PATRON_PATENTE = re.compile(r'^[A-Z0-9]{2,4}-[A-Z0-9]{2,4}$')
+# Formato más genérico, permitiendo guiones
+PATRON_PATENTE_GENERICA = re.compile(r'^[A-Z0-9]+(?:-[A-Z0-9]+)*$')
+# Ej: RFWB77, se normaliza a RFWB-77
+PATRON_PATENTE_SIN_GUION = re.compile(r'^[A-Z0-9]{6}$')
+
+_ORD_CERO_POR_FACTORES = ord('0') * (3 + 2 + 7 + 6 + 5 + 4 + 3 + 2)
+
+
+def digito_verificador(cuerpo):
+    """Dígito verificador (módulo 11) del cuerpo de un RUT, ej: '80010900' -> '0'."""
+    # Factores 2..7 desde el dígito de las unidades, sobre los códigos ASCII del cuerpo
+    # completado a 8 dígitos (sin bucles ni int() por dígito: es el paso caro en importaciones)
+    d = cuerpo.zfill(8).encode('ascii')
+    suma = d[0] * 3 + d[1] * 2 + d[2] * 7 + d[3] * 6 + d[4] * 5 + d[5] * 4 + d[6] * 3 + d[7] * 2 - _ORD_CERO_POR_FACTORES
+    resto = 11 - suma % 11
+    if resto == 11:
+        return '0'
+    if resto == 10:
+        return 'K'
+    return str(resto)
+
+
+def verificar_rut(valor):
+    """
+    Normaliza un RUT ('80010900-0', '80.010.900-0', '80010900-0 ') al formato
+    XX.XXX.XXX-X y verifica su dígito verificador.
+    Retorna (rut_normalizado, error); rut_normalizado es None si el valor está
+    vacío (sin error) o es inválido (con error).
+    """
+    if not valor:
+        return None, None
+    limpio = valor.replace('.', '').replace('-', '').replace(' ', '').upper()
+    if not limpio:
+        return None, None
+    coincidencia = PATRON_RUT_LIMPIO.match(limpio)
+    if not coincidencia:
+        return None, f"RUT '{valor}' con formato inválido."
+    cuerpo, dv = coincidencia.groups()
+    esperado = digito_verificador(cuerpo)
+    if dv != esperado:
+        return None, f"RUT '{valor}' con dígito verificador inválido (se esperaba {esperado})."
+    return f"{cuerpo[:-6]}.{cuerpo[-6:-3]}.{cuerpo[-3:]}-{dv}", None
+
+
+def verificar_ruts(valores):
+    """Aplica verificar_rut a una columna de valores; retorna la lista de (rut_normalizado, error)."""
+    calculados = {}
+    resultado = []
+    for valor in valores:
+        verificado = calculados.get(valor)
+        if verificado is None:
+            verificado = calculados[valor] = verificar_rut(valor)
+        resultado.append(verificado)
+    return resultado
+
+
+def normalizar_patente(valor):
+    """
+    Pasa la patente a mayúsculas y agrega el guion a las de 6 caracteres (RFWB77 -> RFWB-77).
+    Retorna (patente_normalizada, advertencia_o_None).
+    """
+    if not valor:
+        return None, None
+    patente = valor.strip().upper()
+    if PATRON_PATENTE_SIN_GUION.match(patente):
+        patente = f"{patente[:4]}-{patente[4:]}"
+    elif not PATRON_PATENTE.match(patente) and not PATRON_PATENTE_GENERICA.match(patente):
+        return patente, f"Formato de patente '{patente}' podría ser inválido. Se intentará guardar."
+    return patente, None
+
+
+def normalizar_patentes(valores):
+    """Aplica normalizar_patente a una columna de valores; retorna la lista de (patente, advertencia)."""
+    return [normalizar_patente(valor) for valor in valores]
+
+
+def validar_patente(valor):
+    """Validador de Django para patentes ya normalizadas."""
+    patente = valor.upper()
+    if not PATRON_PATENTE.match(patente) and not PATRON_PATENTE_GENERICA.match(patente):
+        raise ValidationError('Formato de patente inválido. Use formatos como XXXX-XX, XX-XX-XX o XX-XX-XX.', code='patente_invalida')
+
+
+def validar_rut(valor):
+    """Validador de Django para RUTs en el formato almacenado (XX.XXX.XXX-X), con dígito verificador."""
+    if not PATRON_RUT.match(valor):
+        raise ValidationError('Formato de RUT inválido. Use XX.XXX.XXX-X.', code='rut_formato')
+    cuerpo, dv = valor.replace('.', '').upper().split('-')
+    if digito_verificador(cuerpo) != dv:
+        raise ValidationError('RUT inválido: el dígito verificador no corresponde.', code='rut_digito_verificador')
@@ -1,21 +1,33 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm # Para login y registro
 from django.contrib.auth import login as auth_login, logout as auth_logout
 from django.contrib import messages
 from django.utils import timezone
 from django.db import transaction
-from django.http import Http404, HttpResponseForbidden, HttpResponse 
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponseForbidden, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.urls import reverse
-from .models import Vehiculo, UsuarioSistema, Reserva
-from .forms import FechaSeleccionForm, ReservaForm
+from django.utils.http import urlencode
+from django.views.decorators.cache import cache_control
+from .models import Vehiculo, UsuarioSistema, Reserva, OcupacionVehiculoDia
+from .forms import FechaSeleccionForm, ReservaForm, ReservaSerieForm
+from .disponibilidad import MAX_DIAS_RANGO, VEHICULO_MARCADOR, acargar_ocupacion_rango, construir_grilla_disponibilidad
+from .cache_disponibilidad import cache_disponibilidad
+from .calendario import calendarios
+from . import metricas
+from .enrutador import afijar_primaria, fijar_primaria, lecturas_en_replica
+from .eventos import difusor
+from .fragmentos import cache_filas
+from .condicional import respuesta_condicional, sello_disponibilidad, sello_reserva
+from .paginacion import PROXIMAS, PASADAS, VISTAS, apagina_de_reservas
+from .perfiles import aperfil_sistema
+from .reservas import BLOQUE_TOMADO, BASE_DE_DATOS_OCUPADA, NO_OPERA
 from datetime import date, time, timedelta, datetime
+import json
 from django.core.exceptions import ValidationError
 
 
-# Horarios de operación (ej: 8 AM a 6 PM, último bloque empieza a las 5 PM)
-HORARIOS_OPERACION = [time(h) for h in range(8, 18)] 
-
 @login_required
 def seleccionar_fecha_view(request):
     """
@@ -44,82 +56,167 @@ def seleccionar_fecha_view(request):
     return render(request, 'agendamiento/seleccionar_fecha.html', context)
 
 @login_required
-def mostrar_disponibilidad_view(request, fecha_str):
+@lecturas_en_replica
+@cache_control(private=True, no_cache=True) # El navegador revalida siempre; si nada cambió recibe un 304
+@respuesta_condicional(sello_disponibilidad)
+async def mostrar_disponibilidad_view(request, fecha_str):
     """
-    Muestra la disponibilidad de vehículos para la razón social del usuario
-    en la fecha seleccionada.
+    Muestra la disponibilidad de vehículos para la empresa del usuario
+    en la fecha seleccionada. Async: bajo ASGI las lecturas no ocupan un hilo por solicitud.
     """
     try:
         fecha_seleccionada = date.fromisoformat(fecha_str)
     except ValueError:
         raise Http404("Formato de fecha inválido.")
 
-    if not hasattr(request.user, 'perfil_sistema'):
+    perfil_usuario = await aperfil_sistema(request)
+    if perfil_usuario is None:
         messages.error(request, "Perfil de sistema no encontrado para el usuario.")
         return redirect('agendamiento:seleccionar_fecha') # O alguna otra página de error/inicio
 
-    perfil_usuario = request.user.perfil_sistema
-    razon_social_usuario = perfil_usuario.razon_social_empresa
+    # Vehículos activos de la empresa y reservas del día (desde la caché o en un número fijo de consultas)
+    if perfil_usuario.empresa_id is None:
+        vehiculos_empresa, reservas_por_vehiculo = [], {}
+    else:
+        vehiculos_empresa, reservas_por_vehiculo = await cache_disponibilidad.aobtener(perfil_usuario.empresa_id, fecha_seleccionada)
+    if not vehiculos_empresa:
+        messages.info(request, f"No hay vehículos activos registrados para la empresa '{perfil_usuario.empresa or ''}'.")
 
-    # Filtrar vehículos por la razón social del usuario
-    vehiculos_empresa = Vehiculo.objects.filter(razon_social=razon_social_usuario, estado='Activo').order_by('marca', 'modelo')
-    if not vehiculos_empresa.exists():
-        messages.info(request, f"No hay vehículos activos registrados para la empresa '{razon_social_usuario}'.")
-    
-    # Obtener todas las reservas para la fecha seleccionada y los vehículos de la empresa
-    reservas_del_dia = Reserva.objects.filter(
-        vehiculo__in=vehiculos_empresa,
-        fecha_reserva=fecha_seleccionada
-    ).select_related('vehiculo') # Optimización
-
-    disponibilidad_data = {}
-
-    for vehiculo in vehiculos_empresa:
-        horarios_vehiculo = {}
-        reservas_vehiculo_dia = reservas_del_dia.filter(vehiculo=vehiculo)
-        
-        horas_reservadas_vehiculo = {r.hora_inicio_reserva: r for r in reservas_vehiculo_dia}
-
-        for hora_inicio_bloque in HORARIOS_OPERACION:
-            hora_fin_bloque = (datetime.combine(date.today(), hora_inicio_bloque) + timedelta(hours=1)).time()
-            texto_display_hora = f"{hora_inicio_bloque.strftime('%H:%M')} - {hora_fin_bloque.strftime('%H:%M')}"
-            
-            reserva_actual = horas_reservadas_vehiculo.get(hora_inicio_bloque)
-            
-            if reserva_actual:
-                disponible = False
-                reservado_por_mi = (reserva_actual.usuario == perfil_usuario)
-                texto_reserva = "Reservado por ti" if reservado_por_mi else "Reservado"
-            else:
-                disponible = True
-                reservado_por_mi = False
-                texto_reserva = "Disponible"
-
-            horarios_vehiculo[hora_inicio_bloque.strftime('%H:%M:%S')] = {
-                'display': texto_display_hora,
-                'disponible': disponible,
-                'reservado_por_mi': reservado_por_mi,
-                'texto_reserva': texto_reserva,
-                'hora_inicio_obj': hora_inicio_bloque # para el form
-            }
-        
-        disponibilidad_data[vehiculo.id] = {
-            'vehiculo': vehiculo,
-            'horarios': horarios_vehiculo
-        }
+    # Bloques del día según el calendario de la empresa (tabla ya compilada, sin formatear horas aquí)
+    tabla = await calendarios.atabla(perfil_usuario.empresa_id, fecha_seleccionada)
+    if vehiculos_empresa and not tabla:
+        messages.info(request, f"La empresa no opera el {fecha_seleccionada.strftime('%d/%m/%Y')}.")
+        vehiculos_empresa = []
+
+    # Se invierte una vez por página, no una por celda (la plantilla y su JS la completan con el vehículo)
+    url_reserva = reverse('agendamiento:reservar_vehiculo', kwargs={'vehiculo_id': VEHICULO_MARCADOR, 'fecha_str': fecha_seleccionada.isoformat()})
+    disponibilidad_data = construir_grilla_disponibilidad(vehiculos_empresa, reservas_por_vehiculo, perfil_usuario.id, tabla, url_reserva)
+    # Filas ya renderizadas desde la caché; solo se renderizan las de vehículos con cambios
+    filas_disponibilidad = await cache_filas.ahtml(
+        disponibilidad_data, reservas_por_vehiculo, perfil_usuario.id, fecha_seleccionada, tabla, url_reserva,
+    )
     
     context = {
         'fecha_seleccionada': fecha_seleccionada,
         'disponibilidad_data': disponibilidad_data,
+        'filas_disponibilidad': filas_disponibilidad,
+        'url_reserva': url_reserva,
+        'vehiculo_marcador': VEHICULO_MARCADOR,
         'perfil_usuario': perfil_usuario,
         'titulo_pagina': f"Disponibilidad para el {fecha_seleccionada.strftime('%d/%m/%Y')}",
-        'horarios_operacion_display': [(h.strftime('%H:%M:%S'), f"{h.strftime('%H:%M')} - {(datetime.combine(date.today(), h) + timedelta(hours=1)).time().strftime('%H:%M')}") for h in HORARIOS_OPERACION]
+        'bloques': tabla.bloques,
     }
     return render(request, 'agendamiento/mostrar_disponibilidad.html', context)
 
 
 @login_required
-@transaction.atomic # Asegura que todas las reservas se creen o ninguna
+@lecturas_en_replica
+async def disponibilidad_rango_view(request):
+    """
+    API JSON con la ocupación de los vehículos de la empresa del usuario entre
+    ?desde=AAAA-MM-DD y ?hasta=AAAA-MM-DD (máximo MAX_DIAS_RANGO días).
+    Cada vehículo trae una máscara por día: el bit N indica que el bloque que
+    empieza a la hora N está reservado.
+    """
+    perfil_usuario = await aperfil_sistema(request)
+    if perfil_usuario is None:
+        return JsonResponse({'error': "Perfil de sistema no encontrado para el usuario."}, status=403)
+
+    try:
+        desde = date.fromisoformat(request.GET.get('desde', ''))
+        hasta = date.fromisoformat(request.GET.get('hasta', ''))
+    except ValueError:
+        return JsonResponse({'error': "Use los parámetros 'desde' y 'hasta' con formato AAAA-MM-DD."}, status=400)
+
+    dias = (hasta - desde).days + 1
+    if dias < 1 or dias > MAX_DIAS_RANGO:
+        return JsonResponse({'error': f"El rango debe tener entre 1 y {MAX_DIAS_RANGO} días."}, status=400)
+
+    vehiculos, ocupacion_por_vehiculo = await acargar_ocupacion_rango(perfil_usuario.empresa_id, desde, hasta)
+    calendario = await calendarios.ade_empresa(perfil_usuario.empresa_id)
+    tablas = [calendario.tabla_para(desde + timedelta(days=d)) for d in range(dias)]
+    horas = sorted({bloque.hora for tabla in tablas for bloque in tabla})
+
+    return JsonResponse({
+        'empresa': str(perfil_usuario.empresa or ''),
+        'empresa_id': perfil_usuario.empresa_id,
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'horarios': horas, # Todas las horas de inicio que operan en algún día del rango
+        'operacion': [tabla.mascara for tabla in tablas], # Por día: el bit N indica que el bloque de la hora N opera
+        'vehiculos': [
+            {
+                'id': vehiculo.id,
+                'patente': vehiculo.patente,
+                'marca': vehiculo.marca,
+                'modelo': vehiculo.modelo,
+                'ocupacion': ocupacion_por_vehiculo[vehiculo.id],
+            }
+            for vehiculo in vehiculos
+        ],
+    })
+
+
+@login_required
+async def eventos_disponibilidad_view(request, fecha_str):
+    """
+    Server-sent events con los bloques que se reservan o liberan en la fecha
+    para la empresa del usuario (ver agendamiento/eventos.py). Requiere ASGI:
+    bajo WSGI cada conexión abierta ocuparía un hilo, así que se responde 204,
+    que le indica al navegador que no reintente. Bajo ASGI el ASGIHandler
+    también retiene un hilo por solicitud hasta cerrar la respuesta: con
+    proyecto_agendamiento.asgi los flujos los abre asgi_eventos.py, y esta
+    vista solo los sirve si se monta get_asgi_application() sin envolver.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    try:
+        fecha = date.fromisoformat(fecha_str)
+    except ValueError:
+        raise Http404("Formato de fecha inválido.")
+    perfil = await aperfil_sistema(request)
+    if perfil is None or perfil.empresa_id is None:
+        return HttpResponseForbidden("Perfil de sistema sin empresa.")
+
+    response = StreamingHttpResponse(
+        flujo_eventos(perfil.empresa_id, fecha, perfil.id, reconexion=request.headers.get('Last-Event-ID') is not None),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # Que nginx no acumule el flujo
+    return response
+
+
+# Comentario cada LATIDO_SEGUNDOS: mantiene viva la conexión en proxies y detecta clientes que se fueron
+LATIDO_SEGUNDOS = 20
+
+
+async def flujo_eventos(empresa_id, fecha, perfil_id, reconexion=False):
+    suscripcion = difusor.suscribir(empresa_id, fecha)
+    try:
+        # Sin historial de eventos: quien se reconecta pudo perder alguno y debe recargar la grilla
+        yield 'retry: 3000\nevent: recargar\ndata: {}\n\n' if reconexion else 'retry: 3000\n\n'
+        while True:
+            evento = await suscripcion.siguiente(LATIDO_SEGUNDOS)
+            if suscripcion.desbordada:
+                yield 'event: recargar\ndata: {}\n\n'
+                return
+            if evento is None:
+                yield ': latido\n\n'
+                continue
+            datos = {clave: valor for clave, valor in evento.items() if clave not in ('id', 'tipo', 'usuario_id')}
+            if evento['tipo'] == 'bloques':
+                datos['propia'] = evento['usuario_id'] == perfil_id
+            yield f"id: {evento['id']}\nevent: {evento['tipo']}\ndata: {json.dumps(datos)}\n\n"
+    finally:
+        difusor.desuscribir(suscripcion)
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@respuesta_condicional(sello_reserva)
+# Sin transaction.atomic aquí: reservar_bloques() crea todas las reservas o ninguna en su propia
+# transacción, y debe quedar fuera de una transacción externa para poder reintentar ante bloqueos.
 def reservar_vehiculo_view(request, vehiculo_id, fecha_str):
     """
     Permite a un usuario seleccionar bloques horarios y crear reservas para un vehículo y fecha específicos.
@@ -137,7 +234,7 @@ def reservar_vehiculo_view(request, vehiculo_id, fecha_str):
 
     perfil_usuario = request.user.perfil_sistema
 
-    if vehiculo.razon_social != perfil_usuario.razon_social_empresa:
+    if perfil_usuario.empresa_id is None or vehiculo.empresa_id != perfil_usuario.empresa_id:
         messages.error(request, "No tiene permiso para reservar este vehículo, no pertenece a su empresa.")
         return redirect('agendamiento:mostrar_disponibilidad', fecha_str=fecha_seleccionada.isoformat())
 
@@ -152,11 +249,16 @@ def reservar_vehiculo_view(request, vehiculo_id, fecha_str):
             try:
                 reservas_creadas = form.save() 
                 if reservas_creadas:
+                    fijar_primaria(request) # Sus próximas lecturas, desde la primaria: nunca verá su bloque libre
                     nombres_bloques = [f"{r.hora_inicio_reserva.strftime('%H:%M')}-{r.hora_fin_reserva.strftime('%H:%M')}" for r in reservas_creadas]
                     messages.success(request, 
                                      f"Reserva(s) para {vehiculo.patente} el {fecha_seleccionada.strftime('%d/%m/%Y')} "
                                      f"en los bloques: {', '.join(nombres_bloques)} realizada(s) con éxito.")
                     return redirect('agendamiento:mostrar_disponibilidad', fecha_str=fecha_seleccionada.isoformat())
+                elif form.resultado.estado == BLOQUE_TOMADO:
+                    messages.warning(request, "Otro usuario reservó alguno de los bloques seleccionados. Revise la disponibilidad actualizada.")
+                elif form.resultado.estado == BASE_DE_DATOS_OCUPADA:
+                    messages.error(request, "No se pudo completar la reserva por alta demanda. Por favor, intente de nuevo.")
                 else:
                     messages.error(request, "No se pudieron crear las reservas. Verifique los errores.")
             except ValidationError as e: 
@@ -166,24 +268,18 @@ def reservar_vehiculo_view(request, vehiculo_id, fecha_str):
     else:
         form = ReservaForm(vehiculo=vehiculo, fecha=fecha_seleccionada, usuario_sistema=perfil_usuario)
 
-    reservas_existentes_vehiculo = Reserva.objects.filter(
-        vehiculo=vehiculo,
-        fecha_reserva=fecha_seleccionada
-    ).values_list('hora_inicio_reserva', flat=True)
-    
-    horarios_disponibles_info = []
-    for hora_inicio_op in HORARIOS_OPERACION:
-        hora_fin_op = (datetime.combine(date.today(), hora_inicio_op) + timedelta(hours=1)).time()
-        esta_reservado = hora_inicio_op in reservas_existentes_vehiculo
-        horarios_disponibles_info.append({
-            'hora_inicio': hora_inicio_op,
-            'hora_fin': hora_fin_op,
-            'display': f"{hora_inicio_op.strftime('%H:%M')} - {hora_fin_op.strftime('%H:%M')}",
-            'id_checkbox': f"id_bloque_{hora_inicio_op.strftime('%H%M%S')}",
-            'valor_checkbox': hora_inicio_op.strftime('%H:%M:%S'),
-            'deshabilitado': esta_reservado,
-            'texto_estado': "Reservado" if esta_reservado else "Disponible"
-        })
+    # En un GET la ocupación leída por el formulario sigue vigente; tras un POST fallido
+    # se vuelve a leer porque otro usuario pudo haber tomado algún bloque.
+    if request.method == 'POST' or not hasattr(form, 'ocupacion'):
+        ocupacion = OcupacionVehiculoDia.obtener(vehiculo.id, fecha_seleccionada)
+    else:
+        ocupacion = form.ocupacion
+
+    # Los textos, ids y valores de cada bloque vienen de la tabla compilada del calendario
+    horarios_disponibles_info = [
+        {'bloque': bloque, 'deshabilitado': bool(ocupacion.mascara & bloque.bit)}
+        for bloque in form.tabla
+    ]
 
     context = {
         'form': form,
@@ -191,10 +287,64 @@ def reservar_vehiculo_view(request, vehiculo_id, fecha_str):
         'fecha_seleccionada': fecha_seleccionada,
         'perfil_usuario': perfil_usuario,
         'titulo_pagina': f"Reservar {vehiculo.patente} para el {fecha_seleccionada.strftime('%d/%m/%Y')}",
-        'horarios_info': horarios_disponibles_info
+        'horarios_info': horarios_disponibles_info,
+        'opera': bool(form.tabla),
     }
     return render(request, 'agendamiento/reservar_vehiculo.html', context)
 
+@login_required
+# Como reservar_vehiculo_view: reservar_serie() maneja su transacción y sus reintentos
+def reservar_serie_view(request, vehiculo_id):
+    """
+    Reserva los mismos bloques de un vehículo en una serie de fechas. La respuesta
+    lista las ocurrencias que no se pudieron reservar; el resto de la serie queda reservado.
+    """
+    vehiculo = get_object_or_404(Vehiculo, id=vehiculo_id)
+
+    if not hasattr(request.user, 'perfil_sistema'):
+        messages.error(request, "Perfil de sistema no encontrado.")
+        return redirect('agendamiento:seleccionar_fecha')
+
+    perfil_usuario = request.user.perfil_sistema
+
+    if perfil_usuario.empresa_id is None or vehiculo.empresa_id != perfil_usuario.empresa_id:
+        messages.error(request, "No tiene permiso para reservar este vehículo, no pertenece a su empresa.")
+        return redirect('agendamiento:seleccionar_fecha')
+
+    resultado = None
+    if request.method == 'POST':
+        form = ReservaSerieForm(request.POST, vehiculo=vehiculo, usuario_sistema=perfil_usuario)
+        resultado = form.save()
+        if resultado is not None:
+            if resultado.reservas:
+                fijar_primaria(request)
+                fechas = sorted({r.fecha_reserva for r in resultado.reservas})
+                messages.success(request,
+                                 f"{len(resultado.reservas)} reserva(s) para {vehiculo.patente} en {len(fechas)} fecha(s), "
+                                 f"del {fechas[0].strftime('%d/%m/%Y')} al {fechas[-1].strftime('%d/%m/%Y')}.")
+            if resultado.conflictos:
+                messages.warning(request, f"{len(resultado.conflictos)} bloque(s) de la serie no se reservaron; vea el detalle más abajo.")
+            if resultado.estado == BASE_DE_DATOS_OCUPADA:
+                messages.error(request, "No se pudo completar la reserva por alta demanda. Por favor, intente de nuevo.")
+    else:
+        try:
+            fecha_inicio = date.fromisoformat(request.GET.get('fecha', ''))
+        except ValueError:
+            fecha_inicio = timezone.now().date()
+        form = ReservaSerieForm(vehiculo=vehiculo, usuario_sistema=perfil_usuario, initial={'fecha_inicio': fecha_inicio})
+
+    context = {
+        'form': form,
+        'vehiculo': vehiculo,
+        'resultado': resultado,
+        'conflictos': [
+            {'conflicto': c, 'motivo': "La empresa no opera" if c.motivo == NO_OPERA else "Ya reservado"}
+            for c in (resultado.conflictos if resultado else [])
+        ],
+        'titulo_pagina': f"Reserva recurrente de {vehiculo.patente}",
+    }
+    return render(request, 'agendamiento/reservar_serie.html', context)
+
 def registro_usuario_view(request):
     if request.method == 'POST':
         form = UserCreationForm(request.POST)
@@ -234,19 +384,43 @@ def pagina_inicio_o_perfil(request):
     return render(request, 'agendamiento/base.html', {'titulo_pagina': 'Inicio', 'mensaje_generico': 'Bienvenido al sistema.'})
 
 @login_required
-def mis_reservas_view(request):
-    perfil_usuario = request.user.perfil_sistema
-    reservas = Reserva.objects.filter(usuario=perfil_usuario).order_by('-fecha_reserva', '-hora_inicio_reserva')
+@lecturas_en_replica
+async def mis_reservas_view(request):
+    perfil_usuario = await aperfil_sistema(request)
+    if perfil_usuario is None:
+        messages.error(request, "Perfil de sistema no encontrado para el usuario.")
+        return redirect('agendamiento:seleccionar_fecha')
 
     if request.method == 'POST':
         reserva_id = request.POST.get('reserva_id')
-        reserva = get_object_or_404(Reserva, id=reserva_id, usuario=perfil_usuario)
-        reserva.delete()
+        reserva = await aget_object_or_404(Reserva, id=reserva_id, usuario=perfil_usuario)
+        await reserva.adelete() # En un hilo: las señales actualizan la ocupación e invalidan la caché como antes
+        await afijar_primaria(request) # Que la réplica atrasada no le vuelva a mostrar la reserva
         messages.success(request, "Reserva eliminada correctamente.")
-        return redirect('agendamiento:mis_reservas')
+        # Volver a la misma página (vista y cursor) desde la que se canceló
+        parametros = {clave: request.POST[clave] for clave in ('vista', 'despues') if request.POST.get(clave)}
+        url = reverse('agendamiento:mis_reservas')
+        return redirect(f"{url}?{urlencode(parametros)}" if parametros else url)
+
+    vista = request.GET.get('vista')
+    if vista not in VISTAS:
+        vista = PROXIMAS
+    cursor = request.GET.get('despues') or ''
+    pagina = await apagina_de_reservas(perfil_usuario, vista, cursor)
 
     context = {
-        'reservas': reservas,
+        'reservas': pagina.reservas,
+        'pagina': pagina,
+        'vista': vista,
+        'cursor': cursor,
+        'vistas': [(PROXIMAS, "Próximas"), (PASADAS, "Pasadas")],
         'titulo_pagina': "Mis Reservas"
     }
-    return render(request, 'agendamiento/mis_reservas.html', context)
\ No newline at end of file
+    return render(request, 'agendamiento/mis_reservas.html', context)
+
+
+def metricas_view(request):
+    """Histogramas de latencia, consultas y plantillas por vista en formato Prometheus. Solo para staff."""
+    if not request.user.is_staff:
+        return HttpResponseForbidden("Solo para usuarios staff.")
+    return HttpResponse(metricas.exportar_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,14 @@
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'proyecto_agendamiento.settings')
+
+# Necesario para los eventos de disponibilidad (server-sent events), ej:
+# uvicorn proyecto_agendamiento.asgi:application --workers 4
+django_application = get_asgi_application()
+
+# Los flujos de eventos abiertos se sirven fuera del manejador de Django: sin un hilo por conexión
+from agendamiento.asgi_eventos import ConEventosDisponibilidad  # noqa: E402 (después de configurar Django)
+
+application = ConEventosDisponibilidad(django_application)
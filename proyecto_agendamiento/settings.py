@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Primero, para que la latencia medida incluya al resto de los middlewares
+    'agendamiento.middleware.MetricasMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -55,20 +58,29 @@ ROOT_URLCONF = 'proyecto_agendamiento.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates que además mide el tiempo de render para las métricas (ver agendamiento/metricas.py)
+        'BACKEND': 'agendamiento.metricas.DjangoTemplatesConMetricas',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Plantillas compiladas una vez por proceso. Explícito para no depender del valor por defecto
+            # de Django; con DEBUG el autoreloader de runserver vacía la caché al editar una plantilla
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'proyecto_agendamiento.wsgi.application'
+ASGI_APPLICATION = 'proyecto_agendamiento.asgi.application'
 
 
 # Database
@@ -78,7 +90,115 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'OPTIONS': {
+            # BEGIN IMMEDIATE toma el bloqueo de escritura al iniciar la transacción, así las reservas
+            # concurrentes esperan su turno (hasta 'timeout' segundos) en vez de fallar al escalar el bloqueo.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+    },
+    # Réplica de solo lectura para las vistas de disponibilidad y listados (ver agendamiento/enrutador.py).
+    # Solo se usa si su alias está en AGENDAMIENTO_BD_REPLICAS; en desarrollo puede ser una copia de db.sqlite3:
+    #   cp db.sqlite3 db_replica.sqlite3 && AGENDAMIENTO_BD_REPLICAS=replica python manage.py runserver
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_replica.sqlite3',
+    },
+}
+
+DATABASE_ROUTERS = ['agendamiento.enrutador.EnrutadorLecturas']
+AGENDAMIENTO_BD_REPLICAS = [alias for alias in os.environ.get('AGENDAMIENTO_BD_REPLICAS', '').split(',') if alias]
+# Tras reservar o cancelar, las lecturas del usuario van a la primaria por estos segundos (atraso máximo esperado)
+AGENDAMIENTO_BD_FIJACION_SEGUNDOS = 10
+
+# Reintentos de reservas ante bloqueos de la base de datos (ver agendamiento/reservas.py)
+AGENDAMIENTO_RESERVA_MAX_REINTENTOS = 5
+AGENDAMIENTO_RESERVA_ESPERA_BASE = 0.02
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# El alias 'disponibilidad' guarda la ocupación diaria por empresa (ver agendamiento/cache_disponibilidad.py).
+# Con varios procesos conviene un backend compartido, ej:
+#   'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': BASE_DIR / 'cache_disponibilidad'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'disponibilidad': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'agendamiento-disponibilidad',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+AGENDAMIENTO_CACHE_DISPONIBILIDAD_ALIAS = 'disponibilidad'
+AGENDAMIENTO_CACHE_DISPONIBILIDAD_MAX_ENTRADAS = 512
+AGENDAMIENTO_CACHE_DISPONIBILIDAD_TIMEOUT = 300
+# Con el alias local a cada proceso (LocMemCache) la grilla se guarda solo estos segundos: las reservas atendidas
+# por otro worker no la invalidan aquí
+AGENDAMIENTO_CACHE_DISPONIBILIDAD_TIMEOUT_LOCAL = 5
+AGENDAMIENTO_CACHE_DISPONIBILIDAD_VERSION_TIMEOUT = 3600
+
+# Respuestas 304 de disponibilidad y reserva (agendamiento/condicional.py). None: solo si CACHES['default'] y
+# 'disponibilidad' son compartidas por todos los procesos (con LocMemCache quedan desactivadas).
+AGENDAMIENTO_RESPUESTAS_CONDICIONALES = None
+
+# Segundos que vive la versión de un calendario compilado (agendamiento/calendario.py). Con CACHES['default']
+# local al proceso es lo que tarda un cambio de horario o feriado en verse en los demás workers.
+AGENDAMIENTO_CALENDARIO_VERSION_TIMEOUT = 3600
+AGENDAMIENTO_CALENDARIO_VERSION_TIMEOUT_LOCAL = 60
+
+# Usuario, perfil y empresa en una consulta (agendamiento/autenticacion.py), y en caché solo si CACHES['default']
+# es compartido por todos los procesos: con LocMemCache otro worker no vería, por ejemplo, un usuario desactivado.
+# ModelBackend queda para las sesiones iniciadas antes, que guardan la ruta de su backend
+AUTHENTICATION_BACKENDS = [
+    'agendamiento.autenticacion.BackendConPerfil',
+    'django.contrib.auth.backends.ModelBackend',
+]
+AGENDAMIENTO_CACHE_PERFILES_ALIAS = 'default'
+AGENDAMIENTO_CACHE_PERFILES_TIMEOUT = 60
+
+# Motor de sesiones con la variable de entorno AGENDAMIENTO_SESIONES: 'db' (por defecto), 'cached_db', 'cache'
+# o 'signed_cookies'. 'cached_db' y 'cache' leen la sesión sin ir a la BD, pero necesitan un CACHES['default']
+# compartido por todos los procesos (Redis, Memcached). 'signed_cookies' guarda la sesión firmada en la cookie,
+# sin BD ni caché; cerrar sesión no invalida una copia de la cookie tomada antes.
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + os.environ.get('AGENDAMIENTO_SESIONES', 'db')
+
+
+# Métricas por solicitud (agendamiento/metricas.py), expuestas solo a usuarios staff en /agendamiento/metricas/
+AGENDAMIENTO_METRICAS_ACTIVAS = True
+
+
+# Logging
+# https://docs.djangoproject.com/en/5.2/topics/logging/
+# Nivel de los logs de la app con la variable de entorno AGENDAMIENTO_LOG_NIVEL (ej: DEBUG). Por defecto
+# WARNING: los logger.debug() de la app se descartan antes de formatear el mensaje.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'clave_valor': {
+            '()': 'agendamiento.logs.FormateadorClaveValor',
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'consola': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'clave_valor',
+        },
+    },
+    'loggers': {
+        'agendamiento': {
+            'handlers': ['consola'],
+            'level': os.environ.get('AGENDAMIENTO_LOG_NIVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
 }
 
 